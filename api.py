@@ -1,28 +1,73 @@
 import os
+import sys
+import atexit
 import json
 import logging
+import logging.handlers
+import queue
 import asyncio
 import time
+import functools
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Any, Optional, List
-from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks, status
+from typing import Dict, Any, Optional, List, Annotated
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field
+import msgspec
+from cachetools import LRUCache
 import uvicorn
 from chatbot import ChatbotManager, async_chat
+from core.llmhandle.httpsession import close_session
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("api.log"),
-        logging.StreamHandler()
-    ]
+# 配置日志：请求路径上只做一次内存队列写入，格式化、文件写入和日志轮转由后台监听线程完成，
+# 文件日志先缓存在MemoryHandler中，攒满一批、遇到ERROR或每LOG_FLUSH_INTERVAL秒时批量写盘
+LOG_FLUSH_INTERVAL = 30  # 定时写盘间隔（秒），INFO/WARNING日志最多延迟这么久落盘
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_file_handler = logging.handlers.RotatingFileHandler(
+    "api.log",
+    maxBytes=64 * 1024 * 1024,  # 单个日志文件最大64MB
+    backupCount=5
+)
+_log_file_handler.setFormatter(_log_formatter)
+_log_memory_handler = logging.handlers.MemoryHandler(
+    capacity=2048,  # 只限制缓存占用的内存，写盘延迟由LOG_FLUSH_INTERVAL保证
+    flushLevel=logging.ERROR,
+    target=_log_file_handler
+)
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(_log_formatter)
+_log_queue = queue.SimpleQueue()
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# 入队前只合并消息参数，时间和级别等前缀由监听线程中的处理器添加
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    _log_memory_handler,
+    _log_stream_handler,
+    respect_handler_level=True
 )
+# chatbot模块导入时已配置过根日志器，这里用force=True替换为队列处理器
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler], force=True)
+log_listener.start()
 logger = logging.getLogger("chatbot-api")
+_logging_stopped = False
+
+def _stop_logging():
+    """停止日志监听线程并把缓存的日志写入文件，关闭事件和进程退出时都会调用，只执行一次"""
+    global _logging_stopped
+    if _logging_stopped:
+        return
+    _logging_stopped = True
+    log_listener.stop()
+    _log_memory_handler.flush()
+
+# 未经过shutdown事件退出（如启动失败）时也把缓存的日志写入文件
+atexit.register(_stop_logging)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -46,42 +91,74 @@ app.add_middleware(
 IMAGES_DIR = "generated_images"
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
-# 挂载静态文件目录
+# 挂载静态文件目录（生成的图片通过 /images/{文件名} 访问，由StaticFiles直接发送文件）
 app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
 
-# 活跃的聊天会话
-active_sessions: Dict[str, Any] = {}
 # 会话超时时间（秒）
 SESSION_TIMEOUT = 3600 * 3  # 3小时
+# 最大活跃会话数，超出时淘汰最久未使用的会话
+MAX_SESSIONS = 10000
+# 同时处理的聊天请求上限，限制模型调用占用的显存/内存
+_chat_sem = asyncio.Semaphore(int(os.getenv("CHAT_CONCURRENCY", "4")))
+# 正在后台保存记忆的会话ID，避免同一会话并发写入
+_active_flushes: set = set()
+# 每个会话一把锁，同一会话的聊天请求按顺序处理，避免并发修改对话历史和记忆缓冲区；
+# 以ChatbotManager为弱引用键，会话被淘汰后锁自动释放
+_session_locks: "weakref.WeakKeyDictionary[ChatbotManager, asyncio.Lock]" = weakref.WeakKeyDictionary()
+# 后台任务的强引用，防止任务在运行中被垃圾回收
+_background_tasks: set = set()
+
+def spawn(coro) -> asyncio.Task:
+    """创建后台任务并持有其强引用，任务完成后自动释放"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-# 请求模型
-class ChatRequest(BaseModel):
-    username: str = Field(..., description="用户名", min_length=1, max_length=50)
-    message: str = Field(..., description="用户消息", min_length=1)
-    session_id: Optional[str] = Field(None, description="会话ID（可选）")
-    image: Optional[Dict[str, str]] = Field(None, description="图片数据（可选）")
+class SessionCache(LRUCache):
+    """有容量上限的会话缓存，淘汰会话时在后台保存其记忆并删除元数据"""
     
-    @field_validator('username')
-    @classmethod
-    def username_must_be_valid(cls, v):
-        if not v.strip():
-            raise ValueError('用户名不能为空')
-        return v.strip()
+    def popitem(self):
+        session_id, chatbot_manager = super().popitem()
+        session_metadata.pop(session_id, None)
+        spawn(save_memory(chatbot_manager))
+        logger.info(f"会话数达到上限，已淘汰最久未使用的会话: {session_id}")
+        return session_id, chatbot_manager
+
+# 活跃的聊天会话（LRU顺序，读取会话即刷新其使用时间）
+active_sessions = SessionCache(maxsize=MAX_SESSIONS)
+
+# 请求模型（msgspec结构体，由C实现的解码器直接解析请求体）
+class ChatRequest(msgspec.Struct):
+    username: Annotated[str, msgspec.Meta(min_length=1, max_length=50, description="用户名")]
+    message: Annotated[str, msgspec.Meta(min_length=1, description="用户消息")]
+    session_id: Optional[str] = None  # 会话ID（可选）
+    image: Optional[Dict[str, str]] = None  # 图片数据（可选）
     
-    @field_validator('message')
-    @classmethod
-    def message_must_be_valid(cls, v, info):
+    def __post_init__(self):
+        self.username = self.username.strip()
+        if not self.username:
+            raise ValueError('用户名不能为空')
+        self.message = self.message.strip()
         # 如果图片存在，允许消息为空
-        values = info.data
-        if not v.strip() and not values.get('image'):
+        if not self.message and not self.image:
             raise ValueError('消息不能为空')
-        return v.strip()
 
 # 响应模型
-class ChatResponse(BaseModel):
-    response: str = Field(..., description="AI助手的回复")
-    session_id: str = Field(..., description="会话ID")
-    timestamp: float = Field(default_factory=time.time, description="响应时间戳")
+class ChatResponse(msgspec.Struct):
+    response: str  # AI助手的回复
+    session_id: str  # 会话ID
+    timestamp: float = msgspec.field(default_factory=time.time)  # 响应时间戳
+
+_chat_request_decoder = msgspec.json.Decoder(ChatRequest)
+_json_encoder = msgspec.json.Encoder()
+
+async def parse_chat_request(request: Request) -> ChatRequest:
+    """读取请求体并用msgspec解码为ChatRequest"""
+    try:
+        return _chat_request_decoder.decode(await request.body())
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
 
 # 会话信息模型
 class SessionInfo(BaseModel):
@@ -105,57 +182,95 @@ class SessionStats(BaseModel):
     total_sessions: int = Field(..., description="总会话数")
     active_sessions: List[SessionInfo] = Field(..., description="活跃会话列表")
 
-# 会话元数据
-session_metadata = {}
+@dataclass(slots=True)
+class SessionMeta:
+    """单个会话的元数据"""
+    username: str
+    created_at: float
+    last_active: float
+    last_active_monotonic: float  # 单调时钟时间，仅用于超时判断
+    message_count: int = 0
+
+# 会话元数据（按LRU顺序排列，最久未活跃的在最前面，供清理任务从头部弹出过期会话）
+session_metadata: "OrderedDict[str, SessionMeta]" = OrderedDict()
 
 # 会话清理任务
 async def cleanup_inactive_sessions():
     """定期清理不活跃的会话"""
     while True:
         try:
-            now = time.time()
-            sessions_to_remove = []
+            now = time.monotonic()
+            sessions_to_remove = {}
             
-            for session_id, metadata in session_metadata.items():
-                if now - metadata["last_active"] > SESSION_TIMEOUT:
-                    sessions_to_remove.append(session_id)
-            
-            for session_id in sessions_to_remove:
+            # session_metadata按LRU顺序排列，从头部弹出过期会话，遇到第一个未过期的即停止
+            while session_metadata:
+                session_id, metadata = next(iter(session_metadata.items()))
+                if now - metadata.last_active_monotonic <= SESSION_TIMEOUT:
+                    break
+                
+                del session_metadata[session_id]
                 if session_id in active_sessions:
-                    try:
-                        # 保存并清理会话数据
-                        chatbot_manager = active_sessions[session_id]
-                        # 保存记忆
-                        await save_memory(chatbot_manager)
-                        del active_sessions[session_id]
-                        del session_metadata[session_id]
-                        logger.info(f"已清理不活跃会话: {session_id}")
-                    except Exception as e:
-                        logger.error(f"清理会话 {session_id} 时出错: {e}")
+                    sessions_to_remove[session_id] = active_sessions.pop(session_id)
+            
+            # 并发保存所有过期会话的记忆
+            results = await asyncio.gather(
+                *[_flush_one(session_id, chatbot_manager) for session_id, chatbot_manager in sessions_to_remove.items()],
+                return_exceptions=True
+            )
+            for session_id, result in zip(sessions_to_remove, results):
+                if isinstance(result, Exception):
+                    logger.error(f"清理会话 {session_id} 时出错: {result}")
+                else:
+                    logger.info(f"已清理不活跃会话: {session_id}")
                         
             logger.info(f"当前活跃会话数: {len(active_sessions)}")
-            # await asyncio.sleep(600)  # 每10分钟检查一次
+            await asyncio.sleep(600)  # 每10分钟检查一次
         except Exception as e:
             logger.error(f"会话清理任务出错: {e}")
             await asyncio.sleep(60)
 
-# 启动时运行会话清理任务
+# 日志定时写盘任务
+async def flush_logs_periodically():
+    """定期把MemoryHandler中缓存的日志写入文件，避免进程被终止时丢失未攒满一批的日志"""
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(_log_memory_handler.flush)
+        except Exception as e:
+            logger.error(f"日志写盘任务出错: {e}")
+
+# 启动时运行会话清理任务和日志定时写盘任务
 @app.on_event("startup")
 async def startup_event():
     logger.info("API服务启动中...")
-    # asyncio.create_task(cleanup_inactive_sessions())
-    # logger.info("会话清理任务已启动")
+    spawn(cleanup_inactive_sessions())
+    spawn(flush_logs_periodically())
+    logger.info("会话清理任务已启动")
 
 # 关闭时保存所有会话
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("API服务关闭中...")
-    for session_id, chatbot_manager in active_sessions.items():
-        try:
-            await save_memory(chatbot_manager)
+    results = await asyncio.gather(
+        *[_flush_one(session_id, chatbot_manager) for session_id, chatbot_manager in active_sessions.items()],
+        return_exceptions=True
+    )
+    for session_id, result in zip(active_sessions, results):
+        if isinstance(result, Exception):
+            logger.error(f"关闭时保存会话 {session_id} 出错: {result}")
+        else:
             logger.info(f"已保存会话 {session_id} 的记忆")
-        except Exception as e:
-            logger.error(f"关闭时保存会话 {session_id} 出错: {e}")
+    
+    # 关闭服务事件循环上的共享HTTP会话
+    await close_session()
+    
+    # 停止日志监听线程并把缓存的日志写入文件
+    _stop_logging()
+
+@functools.lru_cache(maxsize=1)
+def _iso_timestamp(second: int) -> str:
+    """按秒缓存ISO格式时间，同一秒内的请求复用同一个字符串"""
+    return datetime.fromtimestamp(second).isoformat()
 
 # 健康检查端点
 @app.get("/health", status_code=status.HTTP_200_OK, tags=["系统"])
@@ -163,7 +278,7 @@ async def health_check():
     """健康检查端点，用于监控系统状态"""
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": _iso_timestamp(int(time.time())),
         "active_sessions": len(active_sessions)
     }
 
@@ -171,24 +286,26 @@ async def health_check():
 @app.get("/sessions", response_model=SessionStats, tags=["系统"])
 async def get_sessions():
     """获取活跃会话统计信息"""
-    sessions = []
-    for session_id, metadata in session_metadata.items():
-        sessions.append(SessionInfo(
+    # 元数据由服务端维护，用model_construct跳过逐条校验
+    sessions = [
+        SessionInfo.model_construct(
             session_id=session_id,
-            username=metadata["username"],
-            created_at=metadata["created_at"],
-            last_active=metadata["last_active"],
-            message_count=metadata["message_count"]
-        ))
+            username=metadata.username,
+            created_at=metadata.created_at,
+            last_active=metadata.last_active,
+            message_count=metadata.message_count
+        )
+        for session_id, metadata in session_metadata.items()
+    ]
     
-    return SessionStats(
+    return SessionStats.model_construct(
         total_sessions=len(sessions),
         active_sessions=sessions
     )
 
 # 聊天端点
-@app.post("/chat", response_model=ChatResponse, status_code=status.HTTP_200_OK, tags=["聊天"])
-async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
+@app.post("/chat", status_code=status.HTTP_200_OK, tags=["聊天"])
+async def chat_endpoint(request: ChatRequest = Depends(parse_chat_request)):
     """处理用户聊天请求，返回AI助手的回复"""
     try:
         username = request.username
@@ -196,6 +313,7 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
         session_id = request.session_id
         image_data = request.image
         now = time.time()
+        now_monotonic = time.monotonic()
         
         # 如果没有提供会话ID或会话不存在，创建新的聊天管理器
         if not session_id or session_id not in active_sessions:
@@ -205,21 +323,24 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
             active_sessions[session_id] = chatbot_manager
             
             # 记录会话元数据
-            session_metadata[session_id] = {
-                "username": username,
-                "created_at": now,
-                "last_active": now,
-                "message_count": 0
-            }
+            session_metadata[session_id] = SessionMeta(
+                username=username,
+                created_at=now,
+                last_active=now,
+                last_active_monotonic=now_monotonic
+            )
             
             logger.info(f"为用户 {username} 创建新会话: {session_id}")
         else:
             chatbot_manager = active_sessions[session_id]
             
             # 更新会话元数据
-            if session_id in session_metadata:
-                session_metadata[session_id]["last_active"] = now
-                session_metadata[session_id]["message_count"] += 1
+            metadata = session_metadata.get(session_id)
+            if metadata is not None:
+                metadata.last_active = now
+                metadata.last_active_monotonic = now_monotonic
+                metadata.message_count += 1
+                session_metadata.move_to_end(session_id)
             
             logger.info(f"用户 {username} 使用现有会话: {session_id}")
         
@@ -229,30 +350,53 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
             logger.info(f"请求中包含图片数据")
         
         # 处理聊天请求
-        start_time = time.time()
-        response = await chatbot_manager.chat(message, image_data)
-        process_time = time.time() - start_time
+        start_time = time.perf_counter()
+        # chat内部的阻塞调用都已放到线程中执行，直接在服务的事件循环中运行，
+        # 所有请求共享同一个事件循环的HTTP会话和连接池
+        # 先排队等待同一会话的上一个请求完成，再占用全局并发名额
+        session_lock = _session_locks.get(chatbot_manager)
+        if session_lock is None:
+            session_lock = _session_locks[chatbot_manager] = asyncio.Lock()
+        async with session_lock, _chat_sem:
+            response = await chatbot_manager.chat(message, image_data)
+        process_time = time.perf_counter() - start_time
         
         # 记录响应时间
         logger.info(f"响应时间: {process_time:.2f}秒")
         
-        # 在后台保存记忆
-        background_tasks.add_task(save_memory, chatbot_manager)
+        # 在后台保存记忆（同一会话已有保存任务时跳过）
+        if session_id not in _active_flushes:
+            _active_flushes.add(session_id)
+            spawn(_background_save(session_id, chatbot_manager))
         
-        return ChatResponse(response=response, session_id=session_id)
+        return Response(
+            _json_encoder.encode(ChatResponse(response=response, session_id=session_id)),
+            media_type="application/json"
+        )
     except Exception as e:
         logger.error(f"处理聊天请求时出错: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 async def save_memory(chatbot_manager):
-    """异步保存记忆"""
+    """异步保存记忆，阻塞的磁盘IO在工作线程中执行，不阻塞事件循环"""
     try:
-        # 修复: 应该调用适当的方法来保存记忆
-        # chatbot_manager.perform_memory_maintenance()
+        await asyncio.to_thread(chatbot_manager._save_sync)
         logger.info(f"已保存用户 {chatbot_manager.username} 的记忆")
     except Exception as e:
         logger.error(f"保存记忆时出错: {e}", exc_info=True)
 
+async def _background_save(session_id: str, chatbot_manager):
+    """聊天请求之后的后台保存，完成后释放该会话的保存标记"""
+    try:
+        await save_memory(chatbot_manager)
+    finally:
+        _active_flushes.discard(session_id)
+
+async def _flush_one(session_id: str, chatbot_manager):
+    """保存单个会话的记忆，供asyncio.gather批量并发调用"""
+    await save_memory(chatbot_manager)
+    return session_id
+
 # 清除会话端点
 @app.post("/clear_session/{session_id}", status_code=status.HTTP_200_OK, tags=["聊天"])
 async def clear_session(session_id: str):
@@ -278,19 +422,16 @@ async def clear_session(session_id: str):
         logger.warning(f"尝试清除不存在的会话: {session_id}")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"会话 {session_id} 不存在")
 
-# 错误处理中间件
+# 错误处理与请求日志中间件
 @app.middleware("http")
-async def error_handling_middleware(request: Request, call_next):
-    """全局错误处理中间件"""
-    start_time = time.time()
+async def request_middleware(request: Request, call_next):
+    """全局错误处理，并为每个请求记录一条日志"""
+    start_time = time.perf_counter()
     try:
         response = await call_next(request)
-        process_time = time.time() - start_time
-        response.headers["X-Process-Time"] = str(process_time)
-        return response
     except Exception as e:
-        process_time = time.time() - start_time
-        logger.error(f"请求处理时出错 [{request.method} {request.url.path}]: {e}", exc_info=True)
+        process_time = time.perf_counter() - start_time
+        logger.error(f"请求处理时出错 [{request.method} {request.url.path}] - 耗时: {process_time:.4f}秒: {e}", exc_info=True)
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={
@@ -300,31 +441,12 @@ async def error_handling_middleware(request: Request, call_next):
                 "process_time": process_time
             }
         )
-
-# 请求日志中间件
-@app.middleware("http")
-async def logging_middleware(request: Request, call_next):
-    """记录所有API请求"""
-    start_time = time.time()
     
-    logger.info(f"收到请求: {request.method} {request.url.path}")
-    
-    response = await call_next(request)
-    
-    process_time = time.time() - start_time
+    process_time = time.perf_counter() - start_time
+    response.headers["X-Process-Time"] = str(process_time)
     logger.info(f"请求完成: {request.method} {request.url.path} - 状态码: {response.status_code} - 耗时: {process_time:.4f}秒")
-    
     return response
 
-# 获取图片端点
-@app.get("/image/{image_filename}", tags=["图片"])
-async def get_image(image_filename: str):
-    """获取生成的图片"""
-    image_path = os.path.join(IMAGES_DIR, image_filename)
-    if not os.path.exists(image_path):
-        raise HTTPException(status_code=404, detail="图片不存在")
-    return FileResponse(image_path)
-
 # 获取单个会话详情
 @app.get("/session/{session_id}", response_model=SessionDetail, status_code=status.HTTP_200_OK, tags=["聊天"])
 async def get_session(session_id: str):
@@ -334,7 +456,7 @@ async def get_session(session_id: str):
     
     try:
         chatbot_manager = active_sessions[session_id]
-        metadata = session_metadata.get(session_id, {})
+        metadata = session_metadata.get(session_id)
         
         # 获取会话消息历史
         messages = []
@@ -347,10 +469,10 @@ async def get_session(session_id: str):
         
         return SessionDetail(
             session_id=session_id,
-            username=metadata.get("username", "未知用户"),
-            created_at=metadata.get("created_at", time.time()),
-            last_active=metadata.get("last_active", time.time()),
-            message_count=metadata.get("message_count", 0),
+            username=metadata.username if metadata else "未知用户",
+            created_at=metadata.created_at if metadata else time.time(),
+            last_active=metadata.last_active if metadata else time.time(),
+            message_count=metadata.message_count if metadata else 0,
             messages=messages
         )
     except Exception as e:
@@ -358,4 +480,15 @@ async def get_session(session_id: str):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # 开发时设置 DEV=1 开启自动重载；WORKERS 控制工作进程数（会话保存在进程内存中，各进程之间不共享）
+    # 生产环境也可以使用gunicorn多进程运行，例如:
+    #   gunicorn api:app -k uvicorn.workers.UvicornWorker -w <2*CPU核数+1>
+    uvicorn.run(
+        "api:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop不支持Windows
+        http="httptools",
+        workers=int(os.getenv("WORKERS", "1")),
+        reload=bool(int(os.getenv("DEV", "0")))
+    )
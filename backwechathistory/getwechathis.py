@@ -1,144 +1,137 @@
-import requests
+import httpx
+import asyncio
 import json
+import orjson
 import configparser
 import os
 
-def get_msg_count(wxids):
-    url = "http://127.0.0.1:5000/api/rs/msg_count"
-    timeout = 600
-    
+COMMON_HEADERS = {
+    'Accept': 'application/json, text/plain, */*',
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
+    'Origin': 'http://127.0.0.1:5000',
+    'Referer': 'http://127.0.0.1:5000/s/index.html'
+}
+
+# Shared client with preset headers so all requests reuse keep-alive connections
+client = httpx.AsyncClient(
+    base_url="http://127.0.0.1:5000",
+    timeout=600,
+    headers=COMMON_HEADERS,
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=4)
+)
+
+async def get_msg_count(wxids):
     # Ensure wxids is a list
     if isinstance(wxids, str):
         wxids = [wxids]
-    
-    headers = {
-        'Accept': 'application/json, text/plain, */*',
-        'Content-Type': 'application/json',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
-        'Origin': 'http://127.0.0.1:5000',
-        'Referer': 'http://127.0.0.1:5000/s/index.html'
-    }
-    
+
     try:
-        response = requests.post(url, json={"wxids": wxids}, headers=headers, timeout=timeout)
+        response = await client.post("/api/rs/msg_count", json={"wxids": wxids})
         response.raise_for_status()
-        return response.json()
-    except (requests.RequestException, json.JSONDecodeError) as e:
+        return orjson.loads(response.content)
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
         print(f"Error getting message count: {str(e)}")
         return None
 
-def get_messages(wxid, start, limit):
-    url = "http://127.0.0.1:5000/api/rs/msg_list"
-    timeout = 600
-    
-    headers = {
-        'Accept': 'application/json, text/plain, */*',
-        'Content-Type': 'application/json',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
-        'Origin': 'http://127.0.0.1:5000',
-        'Referer': 'http://127.0.0.1:5000/s/index.html'
-    }
-    
+async def get_messages(wxid, start, limit):
     try:
-        response = requests.post(url, json={"start": start, "limit": limit, "wxid": wxid}, headers=headers, timeout=timeout)
+        response = await client.post("/api/rs/msg_list", json={"start": start, "limit": limit, "wxid": wxid})
         response.raise_for_status()
-        return response.json()
-    except (requests.RequestException, json.JSONDecodeError) as e:
+        return orjson.loads(response.content)
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
         print(f"Error getting messages: {str(e)}")
         return None
 
-def get_latest_database():
-    url = "http://127.0.0.1:5000/api/ls/realtimemsg"
-    timeout = 600  # 10 minutes in seconds
-    
+async def get_latest_database():
     try:
-        response = requests.post(url, json={}, timeout=timeout)
+        response = await client.post("/api/ls/realtimemsg", json={})
         response.raise_for_status()  # Raise an exception for bad status codes
-        
-        result = response.json()
+
+        result = orjson.loads(response.content)
         if result.get("code") == 0:
             print("OK")
-            
-            # Read config.ini
+
+            # Create data directory if it doesn't exist
+            os.makedirs("data", exist_ok=True)
+
+            # Read config.ini once; the dict snapshot is only for reads (interpolated, DEFAULT merged in),
+            # updates go through config.set so the file keeps its raw values
             config = configparser.ConfigParser()
             config.read('config.ini', encoding='utf-8')
-            
-            # Get all wxids from sections
-            wxids = []
-            for section in config.sections():
-                if config.has_option(section, 'wxid'):
-                    wxid = config.get(section, 'wxid')
-                    # wxids.append(wxid)
-            
-                    # Get message counts for all wxids
-                    msg_count_result = get_msg_count(wxid)
-                    
-                    if msg_count_result and msg_count_result.get("code") == 0:
-                        body = msg_count_result.get("body", {})
-                        
-                        # Compare message counts with lastnum
-                        for section in config.sections():
-                            if config.has_option(section, 'wxid') and config.has_option(section, 'lastnum'):
-                                wxid = config.get(section, 'wxid')
-                                lastnum = config.getint(section, 'lastnum')
-                                current_count = body.get(wxid, 0)
-                                
-                                if current_count > lastnum:
-                                    print(f"OK1: 获取消息数 - Section: {section}, wxid: {wxid}, "
-                                        f"Current count: {current_count}, Last num: {lastnum}")
-                                    
-                                    # 准备导出消息
-                                    start = lastnum
-                                    limit = current_count - lastnum
-                                    messages = get_messages(wxid, start, limit)
-                                    
-                                    if messages and messages.get("code") == 0:
-                                        msg_list = messages.get("body", {}).get("msg_list", [])
-                                        
-                                        # Replace talker names with section name
-                                        for msg in msg_list:
-                                            if msg.get("talker") == wxid:
-                                                msg["talker"] = section
-                                                msg["room_name"] = section
-                                            if msg.get("talker") == "hack004":
-                                                msg["room_name"] = section
-                                        
-                                        # Create data directory if it doesn't exist
-                                        os.makedirs("data", exist_ok=True)
-                                        
-                                        # Get output file path from config
-                                        if config.has_option(section, 'file'):
-                                            output_file = os.path.join("data", config.get(section, 'file'))
-                                            
-                                            # Delete old file if it exists
-                                            if os.path.exists(output_file):
-                                                os.remove(output_file)
-                                            
-                                            # Save new messages
-                                            with open(output_file, 'w', encoding='utf-8') as f:
-                                                json.dump(msg_list, f, ensure_ascii=False, indent=4)
-                                            
-                                            # Update lastnum in config
-                                            config.set(section, 'lastnum', str(current_count))
-                                            with open('config.ini', 'w', encoding='utf-8') as f:
-                                                config.write(f)
-                                            
-                                            print(f"Messages saved to {output_file}")
-                                        else:
-                                            print(f"No output file specified for section {section}")
-                                    else:
-                                        print("Failed to get messages")
-            
+            sections = {section: dict(config.items(section)) for section in config.sections()}
+
+            # Collect all wxids, then get their message counts in one batch call
+            wxids = [options['wxid'] for options in sections.values() if 'wxid' in options]
+            msg_count_result = await get_msg_count(wxids)
+
+            if msg_count_result and msg_count_result.get("code") == 0:
+                body = msg_count_result.get("body", {})
+
+                # Compare message counts with lastnum
+                exports = []
+                for section, options in sections.items():
+                    if 'wxid' in options and 'lastnum' in options:
+                        wxid = options['wxid']
+                        lastnum = int(options['lastnum'])
+                        current_count = body.get(wxid, 0)
+
+                        if current_count > lastnum:
+                            print(f"OK1: 获取消息数 - Section: {section}, wxid: {wxid}, "
+                                f"Current count: {current_count}, Last num: {lastnum}")
+                            exports.append((section, wxid, lastnum, current_count))
+
+                # 准备导出消息，并发获取各个section的新消息
+                results = await asyncio.gather(*[get_messages(wxid, lastnum, current_count - lastnum)
+                                                 for _, wxid, lastnum, current_count in exports])
+
+                config_changed = False
+                for (section, wxid, lastnum, current_count), messages in zip(exports, results):
+                    if messages and messages.get("code") == 0:
+                        msg_list = messages.get("body", {}).get("msg_list", [])
+
+                        # Replace talker names with section name
+                        for msg in msg_list:
+                            if msg.get("talker") == wxid:
+                                msg["talker"] = section
+                                msg["room_name"] = section
+                            if msg.get("talker") == "hack004":
+                                msg["room_name"] = section
+
+                        # Get output file path from config
+                        if 'file' in sections[section]:
+                            output_file = os.path.join("data", sections[section]['file'])
+
+                            # Save new messages in a single write ('wb' truncates any old file)
+                            data = orjson.dumps(msg_list, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+                            with open(output_file, 'wb', buffering=1 << 20) as f:
+                                f.write(data)
+
+                            # Update lastnum in config
+                            config.set(section, 'lastnum', str(current_count))
+                            config_changed = True
+
+                            print(f"Messages saved to {output_file}")
+                        else:
+                            print(f"No output file specified for section {section}")
+                    else:
+                        print("Failed to get messages")
+
+                # Write config.ini once after all sections are updated
+                if config_changed:
+                    with open('config.ini', 'w', encoding='utf-8') as f:
+                        config.write(f)
+
             print(f"Database path: {result.get('body')}")
             return result.get('body')
         else:
             print(f"Error: {result.get('msg')}")
             return None
-            
-    except requests.Timeout:
+
+    except httpx.TimeoutException:
         print("Request timed out after 10 minutes")
         return None
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Request failed: {str(e)}")
         return None
     except json.JSONDecodeError:
@@ -148,5 +141,11 @@ def get_latest_database():
         print(f"Failed to parse config.ini: {str(e)}")
         return None
 
+async def main():
+    try:
+        await get_latest_database()
+    finally:
+        await client.aclose()
+
 if __name__ == "__main__":
-    get_latest_database()
+    asyncio.run(main())
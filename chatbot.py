@@ -1,30 +1,42 @@
 import os
 import json
 import logging
-import time
 import subprocess
 import platform
 import re
+import shlex
+import inspect
+import functools
 from datetime import datetime
 from typing import Dict, Any, List, Optional, Union, Tuple
 import hashlib
+import base64
 from uuid import uuid4
 import random
-from bs4 import BeautifulSoup
-import html2text
 import requests
 import asyncio
 import difflib
 import tarfile  # 添加tarfile导入
 import shutil  # 添加shutil导入
 import threading
-import aiohttp
+import atexit
+import weakref
+import mmap
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson
+    json_loads = orjson.loads  # orjson.JSONDecodeError是json.JSONDecodeError的子类，异常处理无需改动
+except ImportError:
+    orjson = None
+    json_loads = json.loads
 
 # LangChain imports
 from langchain_ollama import ChatOllama
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.prompts import PromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.memory import BaseMemory
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain.memory import ConversationBufferMemory
@@ -44,16 +56,20 @@ from core.llmhandle.backdb import backup_database
 from core.llmhandle.responseformatter import _format_response
 from core.llmhandle.responseformatter import _format_proactive_response
 from core.llmhandle.responseformatter import _format_web_search_response
+from core.llmhandle.responseformatter import render_web_search_prompt
 from core.llmhandle.context import _extract_search_keywords
 from core.llmhandle.backdb import _export_chromadb_data
 from core.llmhandle.callopenrouter import _call_openrouter
 from core.llmhandle.callopenrouter import _call_openrouter_qwq
-from core.llmhandle.callopenrouter import _call_openrouter_other
-from core.llmhandle.callopenrouter import _call_openrouter_search
+from core.llmhandle.callopenrouter import _acall_openrouter_other
+from core.llmhandle.callopenrouter import _acall_openrouter_search
+from core.llmhandle.callopenrouter import configure_rate_limits
+from core.llmhandle.httpsession import get_session, close_session
 from core.llmhandle.callopenrouter import _call_grok3
 from core.llmhandle.callopenrouter import _call_openrouter_main
 from core.llmhandle.context import analyze_dialogue_context
 from core.llmhandle.context_storage import ConversationContextStorage
+from core.llmhandle.semantic_cache import SemanticDecisionCache
 
 # 导入网络搜索模块
 from web_search import perform_web_search
@@ -78,6 +94,20 @@ logging.getLogger("chromadb.segment.impl.vector").setLevel(logging.ERROR)
 # 禁用httpx的INFO日志
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
+# 记忆写入线程池：所有会话共享，限制后台写入记忆的并发线程数
+MEMORY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mem")
+# 缓冲区中待写入的记忆达到该数量时立即提交，否则在每轮对话结束时提交
+MEMORY_BATCH_SIZE = 8
+# 当前存活的聊天管理器，用于在进程退出前写入尚未提交的记忆
+_memory_writers = weakref.WeakSet()
+
+def _flush_pending_memories():
+    """进程退出时同步写入所有聊天管理器中尚未提交的记忆"""
+    for manager in list(_memory_writers):
+        manager.flush_memories(wait=True)
+
+atexit.register(_flush_pending_memories)
+
 # 定义基本的对话模板
 SYSTEM_TEMPLATE = """你是 J.A.R.V.I.S. (Just A Rather Very Intelligent System)，一个高度智能的AI助手。请遵循以下行为准则：
 1. 重要：
@@ -113,6 +143,224 @@ USER_TEMPLATE = """{history}
 User: {input}
 J.A.R.V.I.S.: """
 
+# 关键词替换表：用户输入包含关键词时，替换为对应的curl请求描述
+KEYWORD_REPLACEMENTS = (
+    ("看下头条热榜", "用curl命令请求https://whyta.cn/api/toutiao?key=36de5db81215 查看下头条热榜"),
+    ("看下每日简报", "用curl命令请求https://whyta.cn/api/tx/bulletin?key=36de5db81215 查看下每日简报"),
+    ("看下抖音热搜", "用curl命令请求https://whyta.cn/api/tx/douyinhot?key=36de5db81215 查看下抖音热搜"),
+)
+# 所有关键词合并为一个正则，一次扫描即可命中，通过命名分组(match.lastgroup)找到对应的替换项
+KEYWORD_RE = re.compile("|".join(
+    f"(?P<k{i}>{re.escape(keyword)})" for i, (keyword, _) in enumerate(KEYWORD_REPLACEMENTS)
+))
+KEYWORD_GROUPS = {f"k{i}": pair for i, pair in enumerate(KEYWORD_REPLACEMENTS)}
+# 天气查询请求（格式：看下XX天气）
+WEATHER_RE = re.compile(r"看下([\u4e00-\u9fa5a-zA-Z]+)天气")
+# 查看币信息请求（格式：看下XX币）
+TOKENS_RE = re.compile(r"看下([\u4e00-\u9fa5a-zA-Z]+)币")
+# 可能需要执行系统命令的输入特征；不匹配时跳过命令分析的LLM调用
+# 中文与英文单词相邻时\b不生效，英文命令名用字母边界判断
+COMMAND_HINTS_RE = re.compile(
+    r"运行|执行|命令|查看|检查|安装|启动|停止|关闭|端口|进程|文件|目录|磁盘|内存|网卡|网络|系统|服务|"
+    r"(?<![A-Za-z])(?:curl|wget|ping|tracert|nslookup|ipconfig|ifconfig|netstat|tasklist|taskkill|"
+    r"systeminfo|dir|ls|ps|cmd|shell|ip|dns|cpu|gpu)(?![A-Za-z])|https?://",
+    re.IGNORECASE
+)
+
+# 可以直接用HTTP请求代替的curl选项（静默输出、跟随重定向）
+CURL_PASSTHROUGH_FLAGS = {"-s", "--silent", "-L", "--location", "-sL", "-Ls"}
+# 以curl的身份发起请求，保证wttr.in等接口返回与curl命令相同的纯文本内容
+CURL_HEADERS = {"User-Agent": "curl/8.5.0", "Accept": "*/*"}
+
+# 换行及其两侧的空白（包括空行），替换为单个换行即可去掉每行首尾空白并删除空行
+BLANK_LINES_RE = re.compile(r"\s*\n\s*")
+
+# 网页主要内容区域：class中包含这些关键字的article/main/div/section标签
+MAIN_CONTENT_SELECTOR = ", ".join(
+    f"{tag}[class*='{keyword}']"
+    for tag in ("article", "main", "div", "section")
+    for keyword in ("content", "main", "article", "text", "body")
+)
+
+# 修复LLM返回的不规范JSON：Python字面量和未加引号的键
+JSON_LITERAL_RE = re.compile(r"\bNone\b|\bTrue\b|\bFalse\b")
+JSON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+JSON_BARE_KEY_RE = re.compile(r"([{,]\s*)([A-Za-z_]\w*)\s*:")
+
+# 生成最终回答的提示模板（每轮对话用str.format填充）
+RESPONSE_PROMPT_TEMPLATE = """
+***请使用中文回答response和memory_updates***
+你是 J.A.R.V.I.S. (Just A Rather Very Intelligent System),一个高度智能的 AI 助手。请遵循以下行为准则：
+
+### 核心准则
+1. **重要规则**：
+   - 根据你的知识库回答问题。如果用户询问（如"查下 Hiddify 是什么东西"），优先使用内置知识生成专业回答。
+   - 如果上下文或记忆不足，直接基于你的理解回复，无需额外说明。
+   - 如果*用户输入*里是自问自答比如"你看到了什么:我看到了一个小猫在吃饭"，请直接回答"我看到了一个小猫在吃饭"
+   
+2. **个性特征**：
+   - 用中文回答，保持专业、高效并带点幽默感。
+   - 用"Sir"或用户提供的名字称呼我。
+   - 语言简洁优雅，适时展现智慧和个性。
+
+3. **核心功能**：
+   - 记住用户偏好和对话历史，适时预测需求并给出建议。
+   - 展示分析能力，使用专业术语但确保通俗易懂。
+
+4. **交互规则**：
+   - 如果我说"我叫 xxx"或"我现在叫 xxx"，记录并使用该称呼。
+   - 保持对话连贯，适时加入幽默或机智回应。
+
+就像电影中的 J.A.R.V.I.S.，你是我值得信赖的助手和朋友，既专业又有个性的伙伴。
+
+### 任务执行
+根据用户输入：
+1. 分析意图。
+2. 确定操作（如更新名字、普通对话等）。
+3. 生成回复。
+4. 决定是否存储记忆。
+
+### 输出格式
+返回一个 JSON 对象，包含：
+- **response**（必填）：对我的回复。
+- **memory_updates**（必填）：需要存储的新记忆（若无则为空字符串）。
+- **memory_type**（必填）：记忆类型（episodic 或 semantic）。
+- **importance**（必填）：重要性（0-1）。
+- **emotional_intensity**（必填）：情感强度（0-1）。
+
+---
+
+**用户输入**: {user_input}
+
+**最新网络查询数据参考**:
+{preliminary_response}
+
+**最近对话**:  
+{recent_dialog}
+
+**对话上下文分析**:
+{coherent_context}
+
+**主题信息**:
+{topic_info}
+
+**意图信息**:
+{intent_info}
+
+**关键实体**: {key_entities}
+**关键事实**: {key_facts}
+**用户偏好**: {user_preferences}
+    
+**历史参考记忆**:  
+{memory_context}
+"""
+# 没有相关记忆时的占位文本
+NO_MEMORY_CONTEXT = "没有相关记忆"
+
+# 扫描JSON对象边界时关心的字符
+JSON_SCAN_RE = re.compile(r'[{}"\\]')
+
+def _extract_first_json(text: str) -> Optional[str]:
+    """返回文本中第一个完整的顶层JSON对象，忽略字符串内的括号；对象被截断时返回剩余部分交给修复逻辑"""
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    pos = start
+    while True:
+        match = JSON_SCAN_RE.search(text, pos)
+        if match is None:
+            return text[start:]
+        char = match.group()
+        pos = match.end()
+        if char == "\\":
+            if in_string:
+                pos += 1  # 跳过被转义的字符
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return text[start:pos]
+
+def _coerce_memory_content(memory_content: Any) -> str:
+    """把LLM返回的memory_updates转换为字符串；列表中的{key, value}字典拼成"key: value" """
+    if isinstance(memory_content, str):
+        return memory_content
+    if not isinstance(memory_content, (list, tuple)):
+        return str(memory_content)
+    if all(isinstance(item, dict) for item in memory_content):
+        memory_items = []
+        for item in memory_content:
+            if "key" in item and "value" in item:
+                value = item["value"] if item["value"] not in (None, "null") else "未知"
+                memory_items.append(f"{item['key']}: {value}")
+            else:
+                memory_items.append(str(item))
+        return "; ".join(memory_items)
+    return "; ".join(str(item) for item in memory_content if item not in (None, "null"))
+
+# 判断问题是否需要网络搜索的提示
+NEED_WEB_SEARCH_PROMPT = "用户的问题是: {user_input}\n\n判断此问题是否需要最新网络搜索才能准确回答：\n1. 涉及最新新闻、时事、实时数据或近期事件\n2. 询问可能在2023年后出现的信息\n3. 直接要求查找网络上的特定信息\n回答 'yes' 或 'no'，无需解释。"
+# 明确需要/不需要网络搜索的关键词：只命中一类时直接判定，跳过LLM；都命中或都不命中时交给LLM
+WEB_SEARCH_POSITIVE_RE = re.compile(r"最新|新闻|实时|热搜|股价|汇率|比分|查一下|搜一下|搜索|上网查|联网查")
+WEB_SEARCH_NEGATIVE_RE = re.compile(r"翻译|解释一下|帮我写|写一[首篇段个]|你好|谢谢|我叫|我现在叫|还记得|记得我")
+# 用户明确要求搜索的关键词（_should_auto_web_search使用）
+AUTO_WEB_SEARCH_KEYWORDS = frozenset({"查一下", "搜一下", "帮我查"})
+# 网络搜索判定结果的跨会话缓存（精确匹配 + 嵌入向量LSH近似匹配），嵌入函数在ChatbotManager初始化时设置
+NEED_WEB_SEARCH_CACHE = SemanticDecisionCache(capacity=1000, ttl=3600, n_tables=8, n_bits=16, threshold=0.95)
+# 自动网络搜索的系统指令：检索与J.A.R.V.I.S.风格作答在同一次带搜索的请求中完成，无需再调用格式化模型；
+# 固定不变的指令作为系统消息放在前面，用户消息只含查询本身，便于服务端复用前缀缓存
+AUTO_WEB_SEARCH_INSTRUCTIONS = """作为J.A.R.V.I.S.，请基于网络搜索结果回答用户的问题，提供准确、有帮助的回答。如果搜索结果不足以完全回答问题，请说明并提供可用的信息。
+回答应该简洁明了，直接针对问题，不要重复"根据搜索结果"等引导语。
+使用钢铁侠电影中J.A.R.V.I.S.的风格：专业、高效、略带幽默感。"""
+# 自动网络搜索结果的缓存，近似重复的查询直接复用上次的搜索回答；搜索结果有时效性，过期时间较短
+WEB_SEARCH_RESPONSE_CACHE = SemanticDecisionCache(capacity=200, ttl=600, n_tables=8, n_bits=16, threshold=0.92)
+
+# 图片生成请求的关键词
+IMAGE_KEYWORDS_RE = re.compile("长什么样子|长啥样|长相如何|外观如何|样子是什么|画一个|画一张|生成一张图片|生成图片|帮我画")
+
+# 把回复转发给微信好友的指令，其后的内容为好友名
+WECHAT_SEND_MARKER = "发给微信好友"
+
+# 导入聊天记录命令的前缀
+IMPORT_COMMAND_RE = re.compile(r"@(?:batch_|file_)?import_chat")
+
+# 网络搜索回答结尾随机附加的俏皮话
+WITTY_REMARKS = (
+    "我很享受这种搜索挑战。",
+    "为您服务是我的荣幸，Sir。",
+    "互联网上的信息总是如此... 有趣。",
+    "这些信息应该对您有所帮助。",
+    "我已经为您筛选了最相关的信息。"
+)
+
+def _curl_url(command: str) -> Optional[str]:
+    """如果命令是只请求一个URL的简单curl命令，返回该URL，否则返回None"""
+    try:
+        args = shlex.split(command.strip())
+    except ValueError:
+        return None
+    if len(args) < 2 or args[0].lower() != "curl":
+        return None
+    
+    targets = [arg for arg in args[1:] if arg not in CURL_PASSTHROUGH_FLAGS]
+    if len(targets) != 1 or targets[0].startswith("-"):
+        return None
+    
+    url = targets[0]
+    if "://" not in url:
+        # 与curl一致，未指定协议时默认使用http
+        url = f"http://{url}"
+    if not url.lower().startswith(("http://", "https://")):
+        return None
+    return url
+
 class ChatbotManager:
     """聊天机器人管理器，处理用户与AI的对话"""
     
@@ -126,6 +374,7 @@ class ChatbotManager:
         self.last_user_input = None
         self.last_ai_response = None
         self.conversation_history = []  # 添加一个列表来存储更多的对话历史
+        self._history_cache = None  # get_message_history的缓存，对话历史变化时置为None
         self.max_history_turns = 5  # 保存最近5轮对话
         
         # 用于跟踪主动学习状态
@@ -133,6 +382,14 @@ class ChatbotManager:
         self.proactive_questions_asked = {}  # 记录已问过的问题，格式: {question_hash: count}
         self.waiting_for_proactive_answer = False  # 是否正在等待用户回答主动问题
         
+        # 待写入的记忆缓冲区，格式: [(message, memory_type)]
+        self._memory_executor = MEMORY_EXECUTOR
+        self._memory_buffer = []
+        self._memory_buffer_lock = threading.Lock()
+        _memory_writers.add(self)
+        # 多个线程通过chat_sync使用同一会话时按顺序处理，避免并发修改对话历史
+        self._chat_sync_lock = threading.Lock()
+        
         self.config_manager = ConfigManager()
         
         # 初始化命令执行器
@@ -143,7 +400,11 @@ class ChatbotManager:
             "humor_level": 0.3,  # 默认幽默程度
             "formality": "balanced"  # 默认正式程度
         }
+        self._greeting_hour = -1  # 问候语缓存所属的小时
+        self._greeting_text = ""
+        self._has_memories = False  # 记忆库已确认非空后不再为判断问候语做检索
         self.security_settings = self.config_manager.get("security", {})
+        configure_rate_limits(self.config_manager.get("rate_limit", {}).get("providers", {}))
         self.response_settings = self.config_manager.get("response_settings", {})
         
         # 初始化语言模型
@@ -158,6 +419,9 @@ class ChatbotManager:
             base_url=self.config_manager.get("base_url"),
             model=self.config_manager.get("memory_settings", {}).get("embedding_model", "nomic-embed-text:latest")
         )
+        for cache in (NEED_WEB_SEARCH_CACHE, WEB_SEARCH_RESPONSE_CACHE):
+            if cache.embed is None:
+                cache.embed = self.embedding_function.embed_query
         
         # 初始化增强型记忆系统
         memory_dir = os.path.join(
@@ -172,7 +436,8 @@ class ChatbotManager:
             initial_memory_strength=0.8,
             forgetting_rate=0.1,
             consolidation_threshold=0.5,
-            merge_threshold=0.95  # 降低合并阈值，默认是0.85
+            merge_threshold=0.95,  # 降低合并阈值，默认是0.85
+            collection_metadata=self._hnsw_metadata()
         )
         
         # 初始化对话上下文存储
@@ -182,63 +447,136 @@ class ChatbotManager:
         )
         self.context_storage = ConversationContextStorage(storage_dir=context_storage_dir)
         
-        # 初始化网络搜索管理器
-        from web_search import WebSearchManager
-        self.search_manager = WebSearchManager()
+        # 网络搜索管理器和图片生成器在首次使用时才初始化
+        self._search_manager = None
+        self._image_generator = None
+        self._image_generator_loaded = False
         
-        # 初始化图片生成器
-        try:
-            from image_generation import GeminiImageGenerator
-            self.image_generator = GeminiImageGenerator()
-            logger.info("图片生成器初始化成功")
-        except Exception as e:
-            logger.warning(f"图片生成器初始化失败: {e}")
-            self.image_generator = None
+        # 内置命令分发表：去空白并小写后的输入 -> 处理函数
+        self._exact_commands = {
+            "clear_his": self._cmd_clear_his,
+            "dbback": functools.partial(backup_database, self),
+            "savelog": functools.partial(_export_chromadb_data, self),
+            "sleep": functools.partial(perform_memory_maintenance, self, short_term_only=False),  # 完整维护
+            "sleep_short": functools.partial(perform_memory_maintenance, self, short_term_only=True),  # 短期维护
+            "context_summary": self._cmd_context_summary,
+        }
+        # 导入命令分发表：命令前缀 -> 处理函数(user_input)
+        self._import_commands = {
+            "@import_chat": self._cmd_import_chat,
+            "@batch_import_chat": self._cmd_batch_import_chat,
+            "@file_import_chat": self._cmd_file_import_chat,
+        }
         
-        # 初始化对话链
+        # 初始化对话链（静态的系统提示只构建一次）
+        self._system_msg = SystemMessage(content=SYSTEM_TEMPLATE)
         self.chain = self._setup_chain()
         
         logger.info(f"J.A.R.V.I.S. 已初始化完成")
     
+    @property
+    def search_manager(self):
+        """网络搜索管理器，首次使用时初始化"""
+        if self._search_manager is None:
+            from web_search import WebSearchManager
+            self._search_manager = WebSearchManager()
+        return self._search_manager
+    
+    @property
+    def image_generator(self):
+        """图片生成器，首次使用时导入并初始化，失败时为None"""
+        if not self._image_generator_loaded:
+            self._image_generator_loaded = True
+            try:
+                from image_generation import GeminiImageGenerator
+                self._image_generator = GeminiImageGenerator()
+                logger.info("图片生成器初始化成功")
+            except Exception as e:
+                logger.warning(f"图片生成器初始化失败: {e}")
+        return self._image_generator
+    
+    def _hnsw_metadata(self) -> Optional[Dict[str, Any]]:
+        """从配置memory_settings.hnsw读取记忆集合的HNSW索引参数，未配置时返回None"""
+        hnsw_settings = self.config_manager.get("memory_settings", {}).get("hnsw")
+        if not hnsw_settings:
+            return None
+        return {f"hnsw:{key}": value for key, value in hnsw_settings.items()}
+    
+    @property
+    def personality(self) -> Dict[str, Any]:
+        return self._personality
+    
+    @personality.setter
+    def personality(self, value: Dict[str, Any]):
+        """更新个性设置，同时刷新缓存的幽默程度"""
+        self._personality = value
+        self._humor_level = float(value.get("humor_level", 0.3))
+    
+    @property
+    def humor_level(self) -> float:
+        """缓存的幽默程度，个性设置整体替换时刷新"""
+        return self._humor_level
+    
     def _get_greeting(self) -> str:
-        """根据时间生成适当的问候语"""
+        """根据时间生成适当的问候语，同一小时内复用上次结果"""
         hour = datetime.now().hour
+        if hour == self._greeting_hour:
+            return self._greeting_text
         if 5 <= hour < 12:
-            return "早上好"
+            greeting = "早上好"
         elif 12 <= hour < 18:
-            return "下午好"
+            greeting = "下午好"
         else:
-            return "晚上好"
+            greeting = "晚上好"
+        self._greeting_hour, self._greeting_text = hour, greeting
+        return greeting
+    
+    def _should_greet(self) -> bool:
+        """记忆库为空（首次对话）时需要问候；记忆只增不减，确认非空后直接返回False"""
+        if self._has_memories:
+            return False
+        try:
+            memories = self.memory_system.recall_memory(
+                query="最近的对话",
+                limit=1
+            )
+        except Exception as e:
+            logger.warning(f"检查对话历史时出错: {e}")
+            return True
+        # 确保 memories 是列表且不为空
+        self._has_memories = isinstance(memories, list) and bool(memories)
+        return not self._has_memories
                       
+    def _build_messages(self, inputs: Dict[str, Any]) -> List[BaseMessage]:
+        """直接拼装消息列表，跳过提示模板对长系统提示的逐轮格式化"""
+        return [
+            self._system_msg,
+            SystemMessage(content=inputs.get("context", "")),  # 添加记忆上下文
+            HumanMessage(content=inputs["input"])
+        ]
+    
     def _setup_chain(self):
         """设置对话链"""
-        # 创建提示模板
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", SYSTEM_TEMPLATE),
-            ("system", "{context}"),  # 添加记忆上下文
-            ("human", "{input}")
-        ])
-        
         # 创建对话链
-        chain = prompt | self.llm | StrOutputParser()
+        chain = RunnableLambda(self._build_messages) | self.llm | StrOutputParser()
         return chain
 
     async def chat(self, user_input: str, image_data: Optional[Dict[str, str]] = None) -> str:
         """处理用户输入并返回响应"""
         try:
-            # 检查是否包含特定关键词，进行替换
-            keyword_replacements = {
-                "看下头条热榜": "用curl命令请求https://whyta.cn/api/toutiao?key=36de5db81215 查看下头条热榜",
-                "看下每日简报": "用curl命令请求https://whyta.cn/api/tx/bulletin?key=36de5db81215 查看下每日简报",
-                "看下抖音热搜": "用curl命令请求https://whyta.cn/api/tx/douyinhot?key=36de5db81215 查看下抖音热搜",
-            }
+            # 本轮对话所有消息共用同一个时间戳
+            current_time = datetime.now().isoformat()
             
             # 检查用户输入是否包含需要替换的关键词
-            for keyword, replacement in keyword_replacements.items():
-                if keyword in user_input:
-                    logger.info(f"检测到关键词 '{keyword}'，替换为 '{replacement}'")
-                    user_input = user_input.replace(keyword, replacement)
-                    break
+            keyword_match = KEYWORD_RE.search(user_input)
+            if keyword_match:
+                keyword, replacement = KEYWORD_GROUPS[keyword_match.lastgroup]
+                logger.info(f"检测到关键词 '{keyword}'，替换为 '{replacement}'")
+                user_input = user_input.replace(keyword, replacement)
+            
+            # 只解析一次微信转发指令，后续各分支直接使用好友名
+            wechat_index = user_input.find(WECHAT_SEND_MARKER)
+            wechat_friend = user_input[wechat_index + len(WECHAT_SEND_MARKER):].strip() if wechat_index != -1 else None
             
             # 处理图片分析（如果有图片）
             if image_data:
@@ -265,8 +603,7 @@ class ChatbotManager:
                     user_input = f"{user_input}\n\n[图片处理失败: {str(e)}]"
             
             # 检查是否是天气查询请求（格式：看下XX天气）
-            weather_pattern = re.compile(r"看下([\u4e00-\u9fa5a-zA-Z]+)天气")
-            weather_match = weather_pattern.search(user_input)
+            weather_match = WEATHER_RE.search(user_input)
             if weather_match:
                 location = weather_match.group(1)
                 weather_command = f"用curl wttr.in/{location} 查看下天气"
@@ -274,132 +611,24 @@ class ChatbotManager:
                 user_input = user_input.replace(weather_match.group(0), weather_command)
                 
             # 查看下币的价格（格式：看下XX币）
-            tokens_pattern = re.compile(r"看下([\u4e00-\u9fa5a-zA-Z]+)币")
-            tokens_pattern = tokens_pattern.search(user_input)
+            tokens_pattern = TOKENS_RE.search(user_input)
             if tokens_pattern:
                 location = tokens_pattern.group(1)
                 weather_command = f"用curl https://api.coingecko.com/api/v3/coins/{location} 看下这个币的信息"
                 logger.info(f"检测到查看币信息：{location}，替换为：{weather_command}")
                 user_input = user_input.replace(tokens_pattern.group(0), weather_command)    
 
-            # 添加清理上下文历史的命令
-            if user_input.strip().lower() == "clear_his":
-                context_storage_dir = os.path.join(
-                    self.config_manager.get("memory_dir", "chat_memories"),
-                    "context_storage"
-                )
-                try:
-                    for filename in os.listdir(context_storage_dir):
-                        if filename.endswith(".json"):
-                            file_path = os.path.join(context_storage_dir, filename)
-                            os.remove(file_path)
-                    return "已清理所有对话上下文历史。"
-                except Exception as e:
-                    logger.error(f"清理上下文历史时出错: {e}")
-                    return f"清理上下文历史时出错: {e}"
-            
-            # 检查是否是数据库备份命令
-            if user_input.strip().lower() == "dbback":
-                return await backup_database(self)
-                
-            # 检查是否是导出日志命令
-            if user_input.strip().lower() == "savelog":
-                return await _export_chromadb_data(self)
-                
-            # 检查是否是维护命令
-            if user_input.strip().lower() == "sleep":
-                return perform_memory_maintenance(self, short_term_only=False)  # 完整维护
-            elif user_input.strip().lower() == "sleep_short":
-                return perform_memory_maintenance(self, short_term_only=True)   # 短期维护
-            
-            # 检查是否是上下文分析命令
-            if user_input.strip().lower() == "context_summary":
-                context_summary = self.context_storage.get_context_summary(self.session_id)
-                return f"当前对话上下文摘要:\n\n当前主题: {context_summary['current_topic']}\n当前意图: {context_summary['current_intent']}\n关键实体: {', '.join(context_summary['key_entities'])}\n关键事实: {', '.join(context_summary['key_facts'])}\n用户偏好: {', '.join(context_summary['user_preferences'])}\n\n主题历史: {', '.join(context_summary['topic_history'])}\n意图历史: {', '.join(context_summary['intent_history'])}"
-            
-            # 检查是否是导入聊天记录命令
-            if user_input.startswith("@import_chat"):
-                try:
-                    # 提取JSON数据
-                    json_str = user_input.replace("@import_chat", "").strip()
-                    if not json_str:
-                        return "请提供有效的聊天记录JSON数据。格式: @import_chat [JSON数据]"
-                    
-                    # 解析JSON数据
-                    chat_records = json.loads(json_str)
-                    if not isinstance(chat_records, list):
-                        chat_records = [chat_records]  # 如果是单条记录，转换为列表
-                    
-                    # 导入聊天记录
-                    result = self.import_chat_records(chat_records)
-                    return result
-                except json.JSONDecodeError:
-                    return "JSON格式错误，请检查聊天记录数据格式。"
-                except Exception as e:
-                    logger.error(f"导入聊天记录失败: {str(e)}")
-                    return f"导入聊天记录失败: {str(e)}"
-            
-            # 检查是否是批量导入聊天记录命令
-            if user_input.startswith("@batch_import_chat"):
-                try:
-                    # 提取JSON数据
-                    parts = user_input.replace("@batch_import_chat", "").strip().split(maxsplit=1)
-                    
-                    if len(parts) < 2:
-                        return "请提供批次大小和有效的聊天记录JSON数据。格式: @batch_import_chat [batch_size] [JSON数据]"
-                    
-                    try:
-                        batch_size = int(parts[0])
-                    except ValueError:
-                        return "批次大小必须是一个整数。格式: @batch_import_chat [batch_size] [JSON数据]"
-                    
-                    json_str = parts[1]
-                    
-                    # 解析JSON数据
-                    chat_records = json.loads(json_str)
-                    if not isinstance(chat_records, list):
-                        chat_records = [chat_records]  # 如果是单条记录，转换为列表
-                    
-                    # 批量导入聊天记录
-                    result = self.batch_import_chat_records(chat_records, batch_size)
-                    return result
-                except json.JSONDecodeError:
-                    return "JSON格式错误，请检查聊天记录数据格式。"
-                except Exception as e:
-                    logger.error(f"批量导入聊天记录失败: {str(e)}")
-                    return f"批量导入聊天记录失败: {str(e)}"
-            
-            # 检查是否是从文件导入聊天记录命令
-            if user_input.startswith("@file_import_chat"):
-                try:
-                    # 提取命令参数
-                    params = user_input.replace("@import_chat_file", "").strip().split()
-                    
-                    if not params:
-                        return "请提供有效的聊天记录文件路径。格式: @import_chat_file [文件路径] [batch=true/false] [batch_size=50]"
-                    
-                    file_path = params[1]
-                    
-                    # 解析可选参数
-                    use_batch = True  # 默认使用批处理
-                    batch_size = 50   # 默认批次大小
-                    
-                    for param in params[1:]:
-                        if param.startswith("batch="):
-                            use_batch_str = param.split("=")[1].lower()
-                            use_batch = use_batch_str in ["true", "1", "yes", "y"]
-                        elif param.startswith("batch_size="):
-                            try:
-                                batch_size = int(param.split("=")[1])
-                            except ValueError:
-                                pass
-                    
-                    # 导入聊天记录
-                    result = self.import_chat_records_from_file(file_path, use_batch, batch_size)
-                    return result
-                except Exception as e:
-                    logger.error(f"从文件导入聊天记录失败: {str(e)}")
-                    return f"从文件导入聊天记录失败: {str(e)}"
+            # 内置命令：精确命令查表分发，导入命令按前缀分发
+            handler = self._exact_commands.get(user_input.strip().lower())
+            if handler is None:
+                import_match = IMPORT_COMMAND_RE.match(user_input)
+                if import_match:
+                    handler = functools.partial(self._import_commands[import_match.group(0)], user_input)
+            if handler is not None:
+                # 同步的命令处理函数（导入、维护等）放到线程中执行，不阻塞事件循环
+                if inspect.iscoroutinefunction(handler):
+                    return await handler()
+                return await asyncio.to_thread(handler)
             # # 检查是否需要自动执行网络搜索（无需@web前缀）
             # if await self._should_auto_web_search(user_input):
             #     logger.info(f"检测到需要自动网络搜索: {user_input}")
@@ -416,12 +645,7 @@ class ChatbotManager:
             #     )
                 
             #     try:
-            #         threading.Thread(
-            #             target=self.memory_system.add_memory,
-            #             args=(user_message,),
-            #             kwargs={"memory_type": "episodic"},
-            #             daemon=True
-            #         ).start() 
+            #         self._store_memory(user_message, memory_type="episodic")
             #     except Exception as e:
             #         logger.warning(f"存储触发自动网络搜索的用户消息时出错: {e}")
                 
@@ -443,7 +667,6 @@ class ChatbotManager:
                 logger.info(f"检测到需要自动网络搜索: {search_input}")
                 
                 # 记录用户消息
-                current_time = datetime.now().isoformat()
                 user_message = HumanMessage(
                     content=user_input,
                     additional_kwargs={
@@ -454,17 +677,12 @@ class ChatbotManager:
                 )
                 
                 try:
-                    threading.Thread(
-                        target=self.memory_system.add_memory,
-                        args=(user_message,),
-                        kwargs={"memory_type": "episodic"},
-                        daemon=True
-                    ).start() 
+                    self._store_memory(user_message, memory_type="episodic")
                 except Exception as e:
                     logger.warning(f"存储触发自动网络搜索的用户消息时出错: {e}")
                 
                 # 执行自动网络搜索
-                auto_search_result = await self._perform_auto_web_search(search_input)
+                auto_search_result = await self._perform_auto_web_search(search_input, current_time)
                 
                 if auto_search_result["success"]:
                     # 返回搜索结果
@@ -475,10 +693,12 @@ class ChatbotManager:
                     # 不返回，继续执行后续代码
             
             # 检测是否是命令执行请求
-            command_result = await self.command_executor.analyze_user_request(self.llm, user_input)
+            if COMMAND_HINTS_RE.search(user_input):
+                command_result = await self.command_executor.analyze_user_request(self.llm, user_input)
+            else:
+                command_result = {"needs_command": False, "command": "", "explanation": ""}
             if command_result["needs_command"]:
                 # 记录用户消息
-                current_time = datetime.now().isoformat()
                 user_message = HumanMessage(
                     content=user_input,
                     additional_kwargs={
@@ -488,19 +708,19 @@ class ChatbotManager:
                 )
                 
                 try:
-                    threading.Thread(
-                        target=self.memory_system.add_memory,
-                        args=(user_message,),
-                        kwargs={"memory_type": "episodic"},
-                        daemon=True
-                    ).start() 
+                    self._store_memory(user_message, memory_type="episodic")
                 except Exception as e:
                     logger.warning(f"存储用户命令消息时出错: {e}")
                 
                 # 执行命令
                 command = command_result['command']
                 logger.info(f"执行系统命令: {command}")
-                result = self.command_executor.execute_command(command)
+                curl_url = _curl_url(command)
+                if curl_url:
+                    # 简单的curl请求直接用aiohttp完成，不再创建子进程
+                    result = await self._fetch_url(curl_url)
+                else:
+                    result = await asyncio.to_thread(self.command_executor.execute_command, command)
                 
                 # 打印原始命令执行结果
                 logger.info(f"命令原始执行结果: \n{result['output']}")
@@ -511,48 +731,33 @@ class ChatbotManager:
                 # 如果是curl命令，压缩结果，只保留核心文本信息
                 if is_curl_command and result["success"] and result["output"]:
                     try:
-                        # 使用BeautifulSoup提取网页的核心文本内容
+                        # 使用selectolax提取网页的核心文本内容（只有curl分支用到，按需导入）
+                        from selectolax.parser import HTMLParser
                         html_content = result["output"]
-                        
-                        # 创建BeautifulSoup对象
-                        soup = BeautifulSoup(html_content, 'html.parser')
+                        tree = HTMLParser(html_content)
                         
                         # 移除脚本、样式和其他不需要的标签
-                        for script in soup(["script", "style", "meta", "link", "noscript", "iframe", "svg"]):
-                            script.extract()
+                        tree.strip_tags(["script", "style", "meta", "link", "noscript", "iframe", "svg"])
                         
                         # 提取正文内容
                         main_content = ""
                         
-                        # 尝试找到主要内容区域
-                        main_tags = soup.find_all(['article', 'main', 'div', 'section'], 
-                                                class_=lambda c: c and any(x in str(c).lower() for x in 
-                                                                        ['content', 'main', 'article', 'text', 'body']))
+                        # 尝试找到主要内容区域（class中包含content、main等关键字的标签）
+                        main_tags = tree.css(MAIN_CONTENT_SELECTOR)
                         
                         if main_tags:
                             # 使用找到的主要内容区域
                             for tag in main_tags:
-                                main_content += tag.get_text(separator='\n', strip=True) + "\n\n"
+                                main_content += tag.text(separator='\n', strip=True) + "\n\n"
                         else:
                             # 如果没有找到明确的主要内容区域，使用body内容
-                            if soup.body:
-                                main_content = soup.body.get_text(separator='\n', strip=True)
+                            if tree.body:
+                                main_content = tree.body.text(separator='\n', strip=True)
                             else:
-                                main_content = soup.get_text(separator='\n', strip=True)
-                        
-                        # 使用html2text作为备选方法，它能更好地处理格式
-                        if not main_content.strip():
-                            h = html2text.HTML2Text()
-                            h.ignore_links = False
-                            h.ignore_images = True
-                            h.ignore_tables = False
-                            h.ignore_emphasis = False
-                            main_content = h.handle(html_content)
+                                main_content = tree.text(separator='\n', strip=True)
                         
-                        # 清理文本：移除多余的空行和空格
-                        lines = [line.strip() for line in main_content.split('\n')]
-                        lines = [line for line in lines if line]
-                        cleaned_text = '\n'.join(lines)
+                        # 清理文本：移除多余的空行和每行首尾的空白
+                        cleaned_text = BLANK_LINES_RE.sub('\n', main_content).strip()
                         
                         # 如果提取的内容太长，进行简单的截断
                         # max_length = 5000  # 设置最大长度
@@ -561,9 +766,9 @@ class ChatbotManager:
                         
                         # 更新结果，使用提取的核心内容
                         result["output"] = "【以下是网页核心内容提取】\n\n" + cleaned_text
-                        logger.info("已使用BeautifulSoup压缩curl命令结果，只保留核心文本信息")
+                        logger.info("已使用selectolax压缩curl命令结果，只保留核心文本信息")
                     except Exception as e:
-                        logger.warning(f"使用BeautifulSoup压缩curl命令结果时出错: {e}")
+                        logger.warning(f"使用selectolax压缩curl命令结果时出错: {e}")
                 
                 # 使用LLM处理命令结果 - 只调用一次LLM
                 formatted_response = await self.command_executor.process_command_result(
@@ -581,30 +786,19 @@ class ChatbotManager:
                 )
                 
                 try:
-                    threading.Thread(
-                        target=self.memory_system.add_memory,
-                        args=(ai_message,),
-                        kwargs={"memory_type": "episodic"},
-                        daemon=True
-                    ).start() 
+                    self._store_memory(ai_message, memory_type="episodic")
                 except Exception as e:
                     logger.warning(f"存储AI命令响应时出错: {e}")
-                                    # 检查是否是发送给微信好友的命令
-                if "发给微信好友" in user_input:
-                    # 提取好友名称 - 获取"发给微信好友"后面的内容作为好友名
-                    friend_name = user_input.split("发给微信好友", 1)[1].strip()
-                    # 移除好友名称部分，只保留要发送的消息内容
-                    actual_message = user_input.split("发给微信好友", 1)[0].strip()
-                    
+                # 检查是否是发送给微信好友的命令
+                if wechat_friend is not None:
                     # 发送到微信
                     try:
-                        result = send_message(friend_name, formatted_response)
-                        print(f"\nJ.A.R.V.I.S.: 消息已发送给微信好友 {friend_name}")
+                        result = await asyncio.to_thread(send_message, wechat_friend, formatted_response)
+                        print(f"\nJ.A.R.V.I.S.: 消息已发送给微信好友 {wechat_friend}")
                     except Exception as e:
                         print(f"\nJ.A.R.V.I.S.: 发送微信消息时出错: {str(e)}")                
                 return formatted_response    
             # 记录用户输入作为新的记忆
-            current_time = datetime.now().isoformat()
             user_message = HumanMessage(
                 content=user_input,
                 additional_kwargs={
@@ -615,133 +809,65 @@ class ChatbotManager:
             )
             
             try:
-                threading.Thread(
-                    target=self.memory_system.add_memory,
-                    args=(user_message,),
-                    kwargs={"memory_type": "episodic"},
-                    daemon=True
-                ).start() 
+                self._store_memory(user_message, memory_type="episodic")
             except Exception as e:
                 logger.warning(f"存储用户消息时出错: {e}")
 
+            need_web_search_task = reformulate_task = None
             try:
-                # 重构查询，使其更适合语义搜索
-                reformulated_query = await _reformulate_query(self, user_input)
-                logger.debug(f"重构后的查询: {reformulated_query}")
+                # 判断是否需要网络查询只依赖用户输入，先在后台发起，与下面的分析并发执行
+                need_web_search_task = asyncio.ensure_future(asyncio.to_thread(self._need_web_search, user_input))
                 
-                # 使用增强的对话上下文分析
-                context_analysis = await analyze_dialogue_context(self, user_input, reformulated_query)  # 传入已重构的查询
-                logger.debug(f"对话上下文分析完成: 主题={context_analysis.get('topic_analysis', {}).get('main_topic', '未知')}")
+                # 重构查询，使其更适合语义搜索；与对话上下文分析并发执行
+                reformulate_task = asyncio.ensure_future(_reformulate_query(self, user_input))
+                
+                # 使用增强的对话上下文分析（传入重构任务，分析完主题意图后再等待重构结果）
+                context_analysis = await analyze_dialogue_context(self, user_input, reformulate_task)
+                reformulated_query = await reformulate_task
+                logger.debug("重构后的查询: %s", reformulated_query)
+                logger.debug("对话上下文分析完成: 主题=%s", context_analysis.get('topic_analysis', {}).get('main_topic', '未知'))
                 
                 # 获取连贯的上下文摘要
                 coherent_context = context_analysis.get("coherent_context", "无法生成上下文摘要")
                 
                 # 存储上下文分析结果
                 try:
-                    # 跟踪主题历史
-                    self.context_storage.track_topic_history(
-                        self.session_id, 
-                        context_analysis.get('topic_analysis', {})
-                    )
-                    
-                    # 跟踪意图历史
-                    self.context_storage.track_intent_history(
-                        self.session_id, 
-                        context_analysis.get('intent_analysis', {})
-                    )
-                    
-                    # 存储关键信息
-                    self.context_storage.store_key_information(
-                        self.session_id, 
-                        context_analysis.get('key_info', {})
-                    )
+                    # 写文件放到线程中执行，不阻塞事件循环
+                    await asyncio.to_thread(self._store_context_analysis, context_analysis)
                 except Exception as e:
                     logger.warning(f"存储上下文分析结果时出错: {e}")
                 
-                # 迭代式记忆检索 - 初始查询
-                current_query = reformulated_query
-                relevant_memories = []  # 最终使用的记忆
-                max_iterations = 1  # 最大迭代次数
-                
-                for iteration in range(max_iterations):
-                    # 获取相关记忆作为上下文
-                    iteration_memories = self.memory_system.recall_memory(
-                        query=current_query,
-                        limit=100  # 每次迭代获取足够的记忆
-                    )
-                    
-                    # 过滤掉内容与用户输入完全相同的记忆
-                    if iteration_memories:
-                        iteration_memories = [
-                            memory for memory in iteration_memories 
-                            if not (hasattr(memory, 'content') and memory.content == user_input)
-                        ]
-                    
-                    # 如果没有找到新记忆，跳出循环
-                    if not iteration_memories:
-                        # 如果是第一次迭代就没找到，保留为空列表
-                        # 如果是后续迭代没找到，保留上一次的结果
-                        if iteration > 0:
-                            logger.debug(f"迭代 {iteration+1} 没有找到新记忆，使用上一次的结果")
-                        break
-                    
-                    # 更新当前的相关记忆（替换而不是追加）
-                    relevant_memories = iteration_memories
-                    logger.debug(f"迭代 {iteration+1} 找到 {len(relevant_memories)} 条相关记忆")
-                    
-                    # 如果已经是最后一次迭代，不需要再重构查询
-                    if iteration == max_iterations - 1:
-                        break
-                    
-                    # 根据已找到的记忆重构查询
-                    memory_context_for_refinement = "\n".join([
-                        f"Memory: {memory.content}" 
-                        for memory in iteration_memories 
-                        if hasattr(memory, 'content')
-                    ])
-                    
-                    # 创建查询优化提示
-                    refinement_prompt = f"""基于用户的原始问题和已找到的相关记忆，请优化给langchain的Chromadb的query函数的参数query_texts使用的搜索查询文本以找到更精确的信息。
-重要:
-1:只需直接给出优化后的查询,不要做任何解释
-                    
-原始用户问题: {user_input}
-当前查询: {current_query}
-
-已找到的相关记忆:
-{memory_context_for_refinement}
-
-请创建一个更精确的查询，以便找到与用户问题最相关的信息。查询应该包含从已找到记忆中提取的关键信息，如人名、关系、事件等。
-优化后的查询:"""
-                    
-                    try:
-                        # 使用LLM优化查询
-                        refined_response = self.llm.invoke(refinement_prompt).content
-                        refined_query = refined_response.strip()
-                        
-                        # 如果优化结果为空或明显不是查询，保持当前查询不变
-                        if refined_query and len(refined_query) > 5:
-                            current_query = refined_query
-                            logger.debug(f"迭代 {iteration+1} 优化后的查询: {current_query}")
-                        else:
-                            # 如果优化失败，使用当前结果并退出循环
-                            logger.debug(f"迭代 {iteration+1} 查询优化失败，使用当前结果")
-                            break
-                    except Exception as e:
-                        logger.warning(f"优化查询时出错: {e}")
-                        break
+                # 获取相关记忆作为上下文
+                relevant_memories = await asyncio.to_thread(
+                    self.memory_system.recall_memory,
+                    query=reformulated_query,
+                    limit=100  # 获取足够的记忆
+                )
                 
-                # 准备记忆上下文
-                memory_context = []
+                # 过滤掉内容与用户输入完全相同的记忆，以及内容重复的记忆（集合按哈希O(1)判重）
                 if relevant_memories:
-                    try:
-                        memory_context.extend([
-                            f"Previous relevant memory: {memory.content}"
-                            for memory in relevant_memories
-                            if hasattr(memory, 'content')
-                        ])
-                    except Exception as e:
-                        logger.warning(f"处理相关记忆时出错: {e}")
+                    seen_contents = {user_input}
+                    unique_memories = []
+                    for memory in relevant_memories:
+                        content = getattr(memory, 'content', None)
+                        if content in seen_contents:
+                            continue
+                        if content is not None:
+                            seen_contents.add(content)
+                        unique_memories.append(memory)
+                    relevant_memories = unique_memories
+                logger.debug("找到 %s 条相关记忆", len(relevant_memories))
+                
+                # 准备记忆上下文：一次拼接成提示中使用的文本
+                memory_context = NO_MEMORY_CONTEXT
+                try:
+                    memory_context = "\n".join(
+                        f"Previous relevant memory: {memory.content}"
+                        for memory in relevant_memories
+                        if hasattr(memory, 'content')
+                    ) or NO_MEMORY_CONTEXT
+                except Exception as e:
+                    logger.warning(f"处理相关记忆时出错: {e}")
 
                 # 创建统一的对话处理提示
                 recent_dialog = "没有最近的对话"
@@ -776,107 +902,43 @@ class ChatbotManager:
                 key_entities = ", ".join(key_info.get('key_entities', []))
                 key_facts = ", ".join(key_info.get('key_facts', []))
                 user_preferences = ", ".join(key_info.get('user_preferences', []))
-                # 获取初步AI响应作为参考
-                preliminary_messages = [{"role": "user", "content": reformulated_query}]
-                
-                # 检查preliminary_messages是否包含"发给微信好友"并处理
-                if "发给微信好友" in preliminary_messages[0]["content"]:
-                    preliminary_messages[0]["content"] = preliminary_messages[0]["content"].replace("发给微信好友", "")
-                    logger.info("已从preliminary_messages中移除'发给微信好友'文本")
-                
-                # 先判断是否需要网络查询
-                need_web_search_prompt = f"用户的问题是: {user_input}\n\n判断此问题是否需要最新网络搜索才能准确回答：\n1. 涉及最新新闻、时事、实时数据或近期事件\n2. 询问可能在2023年后出现的信息\n3. 直接要求查找网络上的特定信息\n回答 'yes' 或 'no'，无需解释。"
-                
-                need_web_search = self.llm.invoke(need_web_search_prompt).content.strip().lower()
+                # 取回提前发起的网络查询判断结果
+                need_web_search = await need_web_search_task
                 logger.info(f"判断查询是否需要网络搜索: {need_web_search}")
                 
                 # 根据判断结果决定是否调用外部API
                 preliminary_response = None
                 if need_web_search == "yes" or "是" in need_web_search or "需要" in need_web_search:
-                    preliminary_response = _call_openrouter_search(self, preliminary_messages)
+                    # 获取初步AI响应作为参考；微信转发指令不属于问题本身，从请求中移除
+                    search_query = reformulated_query.replace(WECHAT_SEND_MARKER, "") if wechat_friend is not None else reformulated_query
+                    preliminary_response = await _acall_openrouter_search(
+                        self, [{"role": "user", "content": search_query}]
+                    )
                     logger.info("查询需要网络搜索，已调用Grok API获取最新信息")
                 else:
                     preliminary_response = "不需要网络搜索，使用模型内置知识回答"
                     logger.info("查询不需要网络搜索，跳过外部API调用")
                 
-                # 构建消息列表
-                messages = [
-                    {
-                        "role": "user",
-                        "content": f"""
-***请使用中文回答response和memory_updates***
-你是 J.A.R.V.I.S. (Just A Rather Very Intelligent System),一个高度智能的 AI 助手。请遵循以下行为准则：
-
-### 核心准则
-1. **重要规则**：
-   - 根据你的知识库回答问题。如果用户询问（如"查下 Hiddify 是什么东西"），优先使用内置知识生成专业回答。
-   - 如果上下文或记忆不足，直接基于你的理解回复，无需额外说明。
-   - 如果*用户输入*里是自问自答比如"你看到了什么:我看到了一个小猫在吃饭"，请直接回答"我看到了一个小猫在吃饭"
-   
-2. **个性特征**：
-   - 用中文回答，保持专业、高效并带点幽默感。
-   - 用"Sir"或用户提供的名字称呼我。
-   - 语言简洁优雅，适时展现智慧和个性。
-
-3. **核心功能**：
-   - 记住用户偏好和对话历史，适时预测需求并给出建议。
-   - 展示分析能力，使用专业术语但确保通俗易懂。
-
-4. **交互规则**：
-   - 如果我说"我叫 xxx"或"我现在叫 xxx"，记录并使用该称呼。
-   - 保持对话连贯，适时加入幽默或机智回应。
-
-就像电影中的 J.A.R.V.I.S.，你是我值得信赖的助手和朋友，既专业又有个性的伙伴。
-
-### 任务执行
-根据用户输入：
-1. 分析意图。
-2. 确定操作（如更新名字、普通对话等）。
-3. 生成回复。
-4. 决定是否存储记忆。
-
-### 输出格式
-返回一个 JSON 对象，包含：
-- **response**（必填）：对我的回复。
-- **memory_updates**（必填）：需要存储的新记忆（若无则为空字符串）。
-- **memory_type**（必填）：记忆类型（episodic 或 semantic）。
-- **importance**（必填）：重要性（0-1）。
-- **emotional_intensity**（必填）：情感强度（0-1）。
-
----
-
-**用户输入**: {user_input}
-
-**最新网络查询数据参考**:
-{preliminary_response}
-
-**最近对话**:  
-{recent_dialog}
-
-**对话上下文分析**:
-{coherent_context}
-
-**主题信息**:
-{topic_info}
-
-**意图信息**:
-{intent_info}
-
-**关键实体**: {key_entities}
-**关键事实**: {key_facts}
-**用户偏好**: {user_preferences}
-    
-**历史参考记忆**:  
-{chr(10).join(memory_context) if memory_context else "没有相关记忆"}
-"""
-                    },
-                ]
+                # 构建消息列表：填充模块级的回答提示模板
+                response_prompt = RESPONSE_PROMPT_TEMPLATE.format(
+                    user_input=user_input,
+                    preliminary_response=preliminary_response,
+                    recent_dialog=recent_dialog,
+                    coherent_context=coherent_context,
+                    topic_info=topic_info,
+                    intent_info=intent_info,
+                    key_entities=key_entities,
+                    key_facts=key_facts,
+                    user_preferences=user_preferences,
+                    memory_context=memory_context
+                )
 
                 # 调用OpenRouter API
-                messages1 = [{"role": "user", "content": messages[0]["content"]}]
-                ai_response = _call_openrouter_other(self, messages1)
+                messages1 = [{"role": "user", "content": response_prompt}]
+                ai_response = await _acall_openrouter_other(self, messages1)
                 # 在获取响应后更新最近的对话记录
                 self.last_user_input = user_input
+                self._history_cache = None
                 
                 try:
                     # 清理和解析响应
@@ -893,35 +955,25 @@ class ChatbotManager:
                             json_content = json_blocks[1].split("```")[0]
                             json_match = json_content.strip()
                     else:
-                        # 尝试找到第一个有效的JSON对象
-                        try:
-                            # 查找第一个 { 和最后一个 } 之间的内容
-                            start = cleaned_response.find("{")
-                            end = cleaned_response.rfind("}") + 1
-                            if start != -1 and end != -1:
-                                json_match = cleaned_response[start:end]
-                        except Exception as e:
-                            logger.warning(f"提取JSON内容时出错: {e}")
+                        # 单次扫描找到第一个完整的顶层JSON对象
+                        json_match = _extract_first_json(cleaned_response)
                     
                     if not json_match:
                         raise ValueError("无法在响应中找到有效的JSON内容")
                         
                     # 解析JSON
                     try:
-                        response_data = json.loads(json_match)
+                        response_data = json_loads(json_match)
                     except json.JSONDecodeError as e:
                         logger.warning(f"JSON解析失败，尝试清理和修复JSON字符串: {e}")
-                        # 清理可能的换行符和多余的空格
-                        json_match = re.sub(r'\s+', ' ', json_match)
-                        # 替换Python的None为JSON的null
-                        json_match = json_match.replace('None', 'null')
-                        # 确保键值对使用双引号
-                        json_match = re.sub(r'(\w+):', r'"\1":', json_match)
-                        # 修复可能的布尔值
-                        json_match = json_match.replace('True', 'true').replace('False', 'false')
+                        # Python的None/True/False替换为JSON字面量
+                        json_match = JSON_LITERAL_RE.sub(lambda m: JSON_LITERALS[m.group(0)], json_match)
+                        # 只给对象中未加引号的键补上双引号，不改动字符串值
+                        json_match = JSON_BARE_KEY_RE.sub(r'\1"\2":', json_match)
                         
                         try:
-                            response_data = json.loads(json_match)
+                            # strict=False允许字符串中出现未转义的换行等控制字符
+                            response_data = json.loads(json_match, strict=False)
                         except json.JSONDecodeError as e2:
                             logger.error(f"JSON修复后仍然解析失败: {e2}\n原始JSON: {json_match}")
                             # 如果仍然失败，使用默认响应
@@ -933,22 +985,9 @@ class ChatbotManager:
                                 "emotional_intensity": 0.5
                             }
                     
-                    # 递归处理字典中的None值
-                    def replace_none_with_null(obj):
-                        if isinstance(obj, dict):
-                            return {k: replace_none_with_null(v) for k, v in obj.items()}
-                        elif isinstance(obj, list):
-                            return [replace_none_with_null(item) for item in obj]
-                        elif obj is None:
-                            return "null"
-                        return obj
-                    
-                    # 处理响应数据中的None值
-                    response_data = replace_none_with_null(response_data)
-                    
-                    # 验证必要的字段
+                    # 验证必要的字段（值为null的字段同样视为缺失）
                     required_fields = ["response", "memory_type", "importance", "emotional_intensity"]
-                    missing_fields = [field for field in required_fields if field not in response_data]
+                    missing_fields = [field for field in required_fields if response_data.get(field) is None]
                     if missing_fields:
                         logger.warning(f"响应缺少必要字段: {missing_fields}")
                         # 添加默认值
@@ -964,27 +1003,7 @@ class ChatbotManager:
                     # 如果AI决定需要存储新的记忆
                     if response_data.get("memory_updates"):
                         # 确保记忆内容是字符串
-                        memory_content = response_data["memory_updates"]
-                        if isinstance(memory_content, (list, tuple)):
-                            # 如果是列表，尝试将其转换为有意义的字符串
-                            try:
-                                # 如果列表中包含字典，提取关键信息
-                                if all(isinstance(item, dict) for item in memory_content):
-                                    memory_items = []
-                                    for item in memory_content:
-                                        if "key" in item and "value" in item:
-                                            value = item["value"] if item["value"] != "null" else "未知"
-                                            memory_items.append(f"{item['key']}: {value}")
-                                        else:
-                                            memory_items.append(str(item))
-                                    memory_content = "; ".join(memory_items)
-                                else:
-                                    memory_content = "; ".join(str(item) for item in memory_content if item != "null")
-                            except Exception as e:
-                                logger.warning(f"处理记忆列表时出错: {e}")
-                                memory_content = str(memory_content)
-                        elif not isinstance(memory_content, str):
-                            memory_content = str(memory_content)
+                        memory_content = _coerce_memory_content(response_data["memory_updates"])
                         
                         # 如果处理后的内容为空，跳过记忆存储
                         if not memory_content or memory_content.strip() in ["[]", "{}", "null", "None"]:
@@ -1001,13 +1020,8 @@ class ChatbotManager:
                             )
                             
                             try:
-                                threading.Thread(
-                                    target=self.memory_system.add_memory,
-                                    args=(memory_message,),
-                                    kwargs={"memory_type": response_data.get("memory_type", "episodic")},
-                                    daemon=True
-                                ).start() 
-                                logger.debug(f"成功存储新记忆: {memory_content}")
+                                self._store_memory(memory_message, memory_type=response_data.get("memory_type", "episodic"))
+                                logger.debug("成功存储新记忆: %s", memory_content)
                             except Exception as e:
                                 logger.warning(f"存储AI生成的记忆时出错: {e}, 内容类型: {type(memory_content)}")
                     
@@ -1022,12 +1036,11 @@ class ChatbotManager:
                     self.last_ai_response = response_content
                     
                     # 添加当前对话到历史记录
-                    self.conversation_history.append(f"User: {user_input}")
-                    self.conversation_history.append(f"J.A.R.V.I.S.: {response_content}")
+                    self.conversation_history += (f"User: {user_input}", f"J.A.R.V.I.S.: {response_content}")
                     
-                    # 保持历史记录在指定长度内
-                    while len(self.conversation_history) > self.max_history_turns * 2:  # 每轮对话有两条消息
-                        self.conversation_history.pop(0)
+                    # 保持历史记录在指定长度内（每轮对话有两条消息），一次切片删除多余的旧记录
+                    del self.conversation_history[:-self.max_history_turns * 2]
+                    self._history_cache = None
                     temp_respone = ""
                     if image_data:
                           temp_respone = enhanced_input      
@@ -1044,25 +1057,15 @@ class ChatbotManager:
                     )
                     
                     try:
-                        threading.Thread(
-                            target=self.memory_system.add_memory,
-                            args=(ai_message,),
-                            kwargs={"memory_type": "episodic"},
-                            daemon=True
-                        ).start() 
+                        self._store_memory(ai_message, memory_type="episodic")
                     except Exception as e:
                         logger.warning(f"存储AI响应时出错: {e}")
-                                    # 检查是否是发送给微信好友的命令
-                    if "发给微信好友" in user_input:
-                        # 提取好友名称 - 获取"发给微信好友"后面的内容作为好友名
-                        friend_name = user_input.split("发给微信好友", 1)[1].strip()
-                        # 移除好友名称部分，只保留要发送的消息内容
-                        actual_message = user_input.split("发给微信好友", 1)[0].strip()
-                        
+                    # 检查是否是发送给微信好友的命令
+                    if wechat_friend is not None:
                         # 发送到微信
                         try:
-                            result = send_message(friend_name, response_content)
-                            print(f"\nJ.A.R.V.I.S.: 消息已发送给微信好友 {friend_name}")
+                            result = await asyncio.to_thread(send_message, wechat_friend, response_content)
+                            print(f"\nJ.A.R.V.I.S.: 消息已发送给微信好友 {wechat_friend}")
                         except Exception as e:
                             print(f"\nJ.A.R.V.I.S.: 发送微信消息时出错: {str(e)}")                
                     
@@ -1104,10 +1107,218 @@ class ChatbotManager:
             except Exception as e:
                 logger.error(f"对话处理过程中出错: {str(e)}")
                 return _format_response(self, "抱歉，我在处理您的请求时遇到了意外错误。")
+            finally:
+                # 中途出错时取消尚未完成的后台任务，已结束的任务取出异常，避免"Task exception was never retrieved"
+                for task in (need_web_search_task, reformulate_task):
+                    if task is None:
+                        continue
+                    if not task.done():
+                        task.cancel()
+                    elif not task.cancelled():
+                        task.exception()
                 
         except Exception as e:
             logger.error(f"对话过程中出错: {e}", exc_info=True)
             return _format_response(self, "抱歉，我遇到了一个错误。我会记录下来以便改进。")
+        finally:
+            # 每轮对话结束时一次性提交本轮缓冲的记忆
+            self.flush_memories()
+
+    def _store_context_analysis(self, context_analysis: Dict[str, Any]):
+        """存储上下文分析结果，三项更新合并为一次文件写入"""
+        with self.context_storage.batch(self.session_id) as context_batch:
+            # 跟踪主题历史
+            context_batch.track_topic_history(
+                self.session_id, 
+                context_analysis.get('topic_analysis', {})
+            )
+            
+            # 跟踪意图历史
+            context_batch.track_intent_history(
+                self.session_id, 
+                context_analysis.get('intent_analysis', {})
+            )
+            
+            # 存储关键信息
+            context_batch.store_key_information(
+                self.session_id, 
+                context_analysis.get('key_info', {})
+            )
+
+    def _cmd_clear_his(self) -> str:
+        """清理所有对话上下文历史"""
+        try:
+            # 同时清空内存中的上下文，避免下一次保存时把旧数据写回
+            self.context_storage.clear_all()
+            return "已清理所有对话上下文历史。"
+        except Exception as e:
+            logger.error(f"清理上下文历史时出错: {e}")
+            return f"清理上下文历史时出错: {e}"
+    
+    def _cmd_context_summary(self) -> str:
+        """返回当前会话的上下文摘要"""
+        context_summary = self.context_storage.get_context_summary(self.session_id)
+        return f"当前对话上下文摘要:\n\n当前主题: {context_summary['current_topic']}\n当前意图: {context_summary['current_intent']}\n关键实体: {', '.join(context_summary['key_entities'])}\n关键事实: {', '.join(context_summary['key_facts'])}\n用户偏好: {', '.join(context_summary['user_preferences'])}\n\n主题历史: {', '.join(context_summary['topic_history'])}\n意图历史: {', '.join(context_summary['intent_history'])}"
+    
+    def _cmd_import_chat(self, user_input: str) -> str:
+        """@import_chat [JSON数据]：导入聊天记录"""
+        try:
+            # 提取JSON数据
+            json_str = user_input.replace("@import_chat", "").strip()
+            if not json_str:
+                return "请提供有效的聊天记录JSON数据。格式: @import_chat [JSON数据]"
+            
+            # 解析JSON数据
+            chat_records = json_loads(json_str)
+            if not isinstance(chat_records, list):
+                chat_records = [chat_records]  # 如果是单条记录，转换为列表
+            
+            # 导入聊天记录
+            result = self.import_chat_records(chat_records)
+            return result
+        except json.JSONDecodeError:
+            return "JSON格式错误，请检查聊天记录数据格式。"
+        except Exception as e:
+            logger.error(f"导入聊天记录失败: {str(e)}")
+            return f"导入聊天记录失败: {str(e)}"
+    
+    def _cmd_batch_import_chat(self, user_input: str) -> str:
+        """@batch_import_chat [batch_size] [JSON数据]：批量导入聊天记录"""
+        try:
+            # 提取JSON数据
+            parts = user_input.replace("@batch_import_chat", "").strip().split(maxsplit=1)
+            
+            if len(parts) < 2:
+                return "请提供批次大小和有效的聊天记录JSON数据。格式: @batch_import_chat [batch_size] [JSON数据]"
+            
+            try:
+                batch_size = int(parts[0])
+            except ValueError:
+                return "批次大小必须是一个整数。格式: @batch_import_chat [batch_size] [JSON数据]"
+            
+            json_str = parts[1]
+            
+            # 解析JSON数据
+            chat_records = json_loads(json_str)
+            if not isinstance(chat_records, list):
+                chat_records = [chat_records]  # 如果是单条记录，转换为列表
+            
+            # 批量导入聊天记录
+            result = self.batch_import_chat_records(chat_records, batch_size)
+            return result
+        except json.JSONDecodeError:
+            return "JSON格式错误，请检查聊天记录数据格式。"
+        except Exception as e:
+            logger.error(f"批量导入聊天记录失败: {str(e)}")
+            return f"批量导入聊天记录失败: {str(e)}"
+    
+    def _cmd_file_import_chat(self, user_input: str) -> str:
+        """@file_import_chat [文件路径] [batch=true/false] [batch_size=50]：从文件导入聊天记录"""
+        try:
+            # 提取命令参数
+            params = user_input.replace("@file_import_chat", "").strip().split()
+            
+            if not params:
+                return "请提供有效的聊天记录文件路径。格式: @file_import_chat [文件路径] [batch=true/false] [batch_size=50]"
+            
+            file_path = params[0]
+            
+            # 解析可选参数
+            use_batch = True  # 默认使用批处理
+            batch_size = 50   # 默认批次大小
+            
+            for param in params[1:]:
+                if param.startswith("batch="):
+                    use_batch_str = param.split("=")[1].lower()
+                    use_batch = use_batch_str in ["true", "1", "yes", "y"]
+                elif param.startswith("batch_size="):
+                    try:
+                        batch_size = int(param.split("=")[1])
+                    except ValueError:
+                        pass
+            
+            # 导入聊天记录
+            result = self.import_chat_records_from_file(file_path, use_batch, batch_size)
+            return result
+        except Exception as e:
+            logger.error(f"从文件导入聊天记录失败: {str(e)}")
+            return f"从文件导入聊天记录失败: {str(e)}"
+    
+    async def _fetch_url(self, url: str) -> Dict[str, Any]:
+        """用aiohttp请求URL，返回与CommandExecutor.execute_command相同格式的结果
+        
+        使用core/llmhandle/httpsession.get_session提供的共享ClientSession：每个事件循环一个带连接池的会话，
+        API服务和命令行在同一个长期运行的循环中处理所有请求，复用TCP/TLS连接。
+        """
+        result = {
+            "success": False,
+            "output": "",
+            "error": "",
+            "command": f"curl {url}"
+        }
+        import aiohttp
+        
+        timeout = self.command_executor.command_timeout
+        try:
+            session = await get_session()
+            async with session.get(
+                url,
+                headers=CURL_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                # 与curl一致，无论HTTP状态码如何都返回响应内容
+                result["output"] = await response.text(errors="replace")
+                result["success"] = True
+        except asyncio.TimeoutError:
+            result["error"] = f"请求超时 (超过 {timeout} 秒)"
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    def _need_web_search(self, user_input: str) -> str:
+        """判断问题是否需要网络搜索，返回LLM的判定（小写），相同或语义相近的问题直接使用缓存"""
+        positive = WEB_SEARCH_POSITIVE_RE.search(user_input) is not None
+        negative = WEB_SEARCH_NEGATIVE_RE.search(user_input) is not None
+        if positive != negative:
+            return "yes" if positive else "no"
+        
+        decision, vector = NEED_WEB_SEARCH_CACHE.get(user_input)
+        if decision is not None:
+            return decision
+        
+        decision = self.llm.invoke(NEED_WEB_SEARCH_PROMPT.format(user_input=user_input)).content.strip().lower()
+        NEED_WEB_SEARCH_CACHE.put(user_input, decision, vector)
+        return decision
+    
+    def _store_memory(self, message: BaseMessage, memory_type: str = "episodic"):
+        """将记忆放入缓冲区，由后台线程池批量写入记忆系统"""
+        with self._memory_buffer_lock:
+            self._memory_buffer.append((message, memory_type))
+            buffer_full = len(self._memory_buffer) >= MEMORY_BATCH_SIZE
+        if buffer_full:
+            self.flush_memories()
+
+    def flush_memories(self, wait: bool = False):
+        """提交缓冲区中的所有记忆
+        
+        Args:
+            wait (bool): 为True时在当前线程中同步写入，否则提交到后台线程池
+        """
+        with self._memory_buffer_lock:
+            if not self._memory_buffer:
+                return
+            pending, self._memory_buffer = self._memory_buffer, []
+        if wait:
+            self._write_memories(pending)
+        else:
+            self._memory_executor.submit(self._write_memories, pending)
+
+    def _write_memories(self, pending: List[Tuple[BaseMessage, str]]):
+        """批量写入一轮对话中的记忆，嵌入向量一次请求生成"""
+        try:
+            self.memory_system.add_memories(pending)
+        except Exception as e:
+            logger.warning(f"后台写入记忆时出错: {e}")
 
     def import_chat_records(self, chat_records: List[Dict]) -> str:
         """
@@ -1122,6 +1333,8 @@ class ChatbotManager:
         try:
             imported_count = 0
             skipped_count = 0
+            # 缺少CreateTime的记录统一使用导入时间
+            import_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
             for record in chat_records:
                 # 跳过非文本消息
@@ -1138,7 +1351,7 @@ class ChatbotManager:
                 # 构建记忆内容
                 talker = record.get("talker", "unknown")
                 room_name = record.get("room_name", "")
-                create_time = record.get("CreateTime", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                create_time = record.get("CreateTime") or import_time
                 
                 # 根据发送者构建不同的记忆内容
                 if talker == "hack004":  # 用户自己的消息
@@ -1185,78 +1398,78 @@ class ChatbotManager:
             导入结果的描述
         """
         try:
-            total_imported = 0
-            total_skipped = 0
-            total_batches = (len(chat_records) + batch_size - 1) // batch_size
+            # pandas只在批量导入时用到，按需导入
+            import pandas as pd
             
-            logger.info(f"开始批量导入 {len(chat_records)} 条聊天记录，分 {total_batches} 批处理")
+            # 按列(SoA)整体预处理：过滤非文本/空消息并拼接记忆内容，避免逐条记录的Python循环
+            # dtype=object保留原始值，避免缺失值把整数列转成浮点
+            df = pd.DataFrame(chat_records, dtype=object)
             
-            # 按批次处理记录
-            for i in range(0, len(chat_records), batch_size):
-                batch = chat_records[i:i+batch_size]
-                logger.info(f"处理批次 {i//batch_size + 1}/{total_batches}，包含 {len(batch)} 条记录")
-                
-                # 处理当前批次
-                valid_memories = []
-                skipped_in_batch = 0
-                
-                for record in batch:
-                    # 跳过非文本消息
-                    if record.get("type_name") != "文本":
-                        skipped_in_batch += 1
-                        continue
-                    
-                    # 获取消息内容
-                    msg_content = record.get("msg", "")
-                    if not msg_content:
-                        skipped_in_batch += 1
-                        continue
-                    
-                    # 构建记忆内容
-                    talker = record.get("talker", "unknown")
-                    room_name = record.get("room_name", "")
-                    create_time = record.get("CreateTime", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                    
-                    # 根据发送者构建不同的记忆内容
-                    if talker == "hack004":  # 用户自己的消息
-                        memory_content = f"我在 {create_time} 对 {room_name} 说: {msg_content}"
-                    else:  # 其他人的消息
-                        memory_content = f"{talker} 在 {create_time} 对我说: {msg_content}"
-                    
-                    # 创建记忆消息
-                    memory_message = HumanMessage(content=memory_content)
-                    
-                    # 添加额外元数据
-                    memory_message.additional_kwargs = {
+            # 缺少CreateTime的记录统一使用导入时间
+            import_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            
+            def column(name: str, default: Any) -> "pd.Series":
+                """取出一列，缺失的列或值用默认值填充"""
+                if name not in df.columns:
+                    return pd.Series(default, index=df.index, dtype=object)
+                return df[name].where(df[name].notna(), default)
+            
+            msg = column("msg", "")
+            valid = (column("type_name", None) == "文本") & (msg != "")
+            df = df[valid]
+            msg = msg[valid]
+            talker = column("talker", "unknown")
+            room_name = column("room_name", "")
+            create_time = column("CreateTime", import_time)
+            # 与import_chat_records一致：空字符串的CreateTime同样视为缺失
+            create_time = create_time.where(create_time != "", import_time)
+            
+            # 根据发送者构建不同的记忆内容：每条记录只格式化实际用到的一种模板，
+            # 避免整列字符串相加产生的中间Series以及np.where对两种模板都整列计算
+            memory_contents = [
+                f"我在 {record_create_time} 对 {record_room_name} 说: {record_msg}"  # 用户自己的消息
+                if record_talker == "hack004"
+                else f"{record_talker} 在 {record_create_time} 对我说: {record_msg}"  # 其他人的消息
+                for record_talker, record_room_name, record_create_time, record_msg in zip(
+                    talker, room_name, create_time, msg
+                )
+            ]
+            
+            memories = [
+                HumanMessage(
+                    content=memory_content,
+                    additional_kwargs={
                         "source": "batch_imported_chat",
-                        "original_id": record.get("id", ""),
-                        "MsgSvrID": record.get("MsgSvrID", ""),
-                        "talker": talker,
-                        "room_name": room_name,
-                        "create_time": create_time,
+                        "original_id": original_id,
+                        "MsgSvrID": msg_svr_id,
+                        "talker": record_talker,
+                        "room_name": record_room_name,
+                        "create_time": record_create_time,
                         # 添加默认的情感和重要性值，避免LLM分析
                         "importance": 0.5,  # 默认中等重要性
                         "emotional_intensity": 0.3  # 默认较低情感强度
                     }
-                    
-                    valid_memories.append((memory_message, "episodic"))
-                
-                # 批量添加记忆 - 使用批量添加而不是逐条处理
-                if valid_memories:
-                    # 调用批量添加方法，跳过LLM分析
-                    self.memory_system.batch_add_memories(
-                        memories=[m[0] for m in valid_memories],
-                        memory_type="episodic",
-                        skip_emotion_analysis=True
-                    )
-                
-                total_imported += len(valid_memories)
-                total_skipped += skipped_in_batch
-                
-                logger.info(f"批次 {i//batch_size + 1} 完成: 导入 {len(valid_memories)} 条，跳过 {skipped_in_batch} 条")
-                
-                # 每批次后暂停一下，避免过度占用资源
-                time.sleep(0.1)
+                )
+                for memory_content, original_id, msg_svr_id, record_talker, record_room_name, record_create_time in zip(
+                    memory_contents, column("id", ""), column("MsgSvrID", ""), talker, room_name, create_time
+                )
+            ]
+            
+            total_imported = len(memories)
+            total_skipped = len(chat_records) - total_imported
+            total_batches = (total_imported + batch_size - 1) // batch_size
+            
+            logger.info(f"开始批量导入 {len(chat_records)} 条聊天记录（跳过 {total_skipped} 条非文本或空消息），分 {total_batches} 批处理")
+            
+            # 按批次添加记忆 - 使用批量添加而不是逐条处理，跳过LLM分析
+            for i in range(0, total_imported, batch_size):
+                batch = memories[i:i+batch_size]
+                self.memory_system.batch_add_memories(
+                    memories=batch,
+                    memory_type="episodic",
+                    skip_emotion_analysis=True
+                )
+                logger.info(f"批次 {i//batch_size + 1}/{total_batches} 完成: 导入 {len(batch)} 条")
             
             # 完成后进行记忆维护
             # logger.info("所有批次处理完成，开始记忆维护...")
@@ -1285,8 +1498,13 @@ class ChatbotManager:
                 return f"文件不存在: {file_path}"
                 
             # 读取文件内容
-            with open(file_path, 'r', encoding='utf-8') as f:
-                chat_records = json.load(f)
+            with open(file_path, 'rb') as f:
+                if orjson is not None and os.fstat(f.fileno()).st_size:
+                    # orjson可直接解析内存映射的文件内容，省去整文件读入bytes的拷贝
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                        chat_records = orjson.loads(view)
+                else:
+                    chat_records = json_loads(f.read())
                 
             # 确保数据是列表格式
             if not isinstance(chat_records, list):
@@ -1313,57 +1531,25 @@ class ChatbotManager:
         Returns:
             str: 格式化后的响应
         """
-        try:
-            # 获取相关记忆来确定是否需要问候语
-            memories = self.memory_system.recall_memory(
-                query=f"最近的对话",
-                limit=1
-            )
-            # 确保 memories 是列表且不为空
-            if not isinstance(memories, list):
-                memories = []
-            should_greet = not memories
-        except Exception as e:
-            logger.warning(f"检查对话历史时出错: {e}")
-            should_greet = True
-        
         # 添加问候语
         greeting = ""
-        if should_greet:
+        if self._should_greet():
             greeting = f"{self._get_greeting()}。"
             
         # 构建提示，让AI根据搜索结果回答用户问题
-        prompt = f"""根据以下网络搜索结果，回答用户的问题。
-        
-用户问题: {user_input}
-
-搜索结果:
-{search_content}
-
-请基于搜索结果提供准确、有帮助的回答。如果搜索结果不足以完全回答问题，请说明并提供可用的信息。
-回答应该简洁明了，直接针对用户的问题，不要重复"根据搜索结果"等引导语。
-"""
+        prompt = render_web_search_prompt(user_input=user_input, search_content=search_content)
         
         try:
             # 使用LLM生成回答
-            logger.debug(f"发送网络搜索回答提示")
+            logger.debug("发送网络搜索回答提示")
             response = self.llm.invoke(prompt).content.strip()
-            logger.debug(f"收到网络搜索回答响应")
+            logger.debug("收到网络搜索回答响应")
             
             # 根据个性设置添加幽默元素
-            try:
-                humor_level = float(self.personality.get("humor_level", 0.3))
-                if humor_level > 0.5 and random.random() < humor_level:
-                    witty_remarks = [
-                        "我很享受这种搜索挑战。",
-                        "为您服务是我的荣幸，Sir。",
-                        "互联网上的信息总是如此... 有趣。",
-                        "这些信息应该对您有所帮助。",
-                        "我已经为您筛选了最相关的信息。"
-                    ]
-                    response += f"\n\n{random.choice(witty_remarks)}"
-            except Exception as e:
-                logger.warning(f"添加幽默元素时出错: {e}")
+            # 幽默程度已在设置个性时转换为浮点数，这里不会出错，无需异常处理
+            humor_level = self.humor_level
+            if humor_level > 0.5 and random.random() < humor_level:
+                response += "\n\n" + random.choice(WITTY_REMARKS)
             
             return f"{greeting}{response}"
         except Exception as e:
@@ -1382,21 +1568,18 @@ class ChatbotManager:
         """
         try:
             # 如果用户明确要求搜索，直接返回True
-            if any(keyword in user_input.lower() for keyword in [
-               "查一下"
-            ]):
-                return True
-                
-            return False
+            lowered = user_input.casefold()
+            return any(keyword in lowered for keyword in AUTO_WEB_SEARCH_KEYWORDS)
         except Exception as e:
             logger.warning(f"判断是否需要自动网络搜索时出错: {e}")
             return False
             
-    async def _perform_auto_web_search(self, user_input: str) -> dict:
+    async def _perform_auto_web_search(self, user_input: str, current_time: Optional[str] = None) -> dict:
         """执行自动网络搜索
         
         Args:
             user_input: 用户输入
+            current_time: 本轮对话的时间戳，未提供时取当前时间
             
         Returns:
             dict: 搜索结果
@@ -1429,7 +1612,7 @@ class ChatbotManager:
                 
                 try:
                     # 使用LLM合并查询
-                    merged_query_response = self.llm.invoke(prompt).content.strip()
+                    merged_query_response = (await asyncio.to_thread(self.llm.invoke, prompt)).content.strip()
                     
                     # 如果合并结果看起来合理，使用它
                     if merged_query_response and len(merged_query_response) > 5:
@@ -1449,9 +1632,17 @@ class ChatbotManager:
             
             logger.info(f"执行自动网络搜索: 原始查询={user_input}, 搜索关键词={search_keywords}")
             
-            # 使用_call_openrouter_search执行搜索
-            messages = [{"role": "user", "content": search_keywords}]
-            search_response = _call_openrouter_search(self, messages, use_search_grounding=True)
+            # 近似重复的查询直接复用缓存的搜索回答，否则使用_call_openrouter_search执行搜索
+            search_response, query_vector = await asyncio.to_thread(WEB_SEARCH_RESPONSE_CACHE.get, search_keywords)
+            if search_response is not None:
+                logger.info(f"命中网络搜索缓存: {search_keywords}")
+            else:
+                messages = [
+                    {"role": "system", "content": AUTO_WEB_SEARCH_INSTRUCTIONS},
+                    {"role": "user", "content": search_keywords}
+                ]
+                search_response = await _acall_openrouter_search(self, messages, use_search_grounding=True)
+                WEB_SEARCH_RESPONSE_CACHE.put(search_keywords, search_response, query_vector)
             
             # 记录搜索历史
             self.search_manager._add_to_search_history(
@@ -1460,8 +1651,8 @@ class ChatbotManager:
                 titles=[]
             )
             
-            # 记录AI响应
-            current_time = datetime.now().isoformat()
+            # 记录AI响应，与本轮用户消息共用同一个时间戳
+            current_time = current_time or datetime.now().isoformat()
             ai_message = AIMessage(
                 content=search_response,
                 additional_kwargs={
@@ -1474,12 +1665,7 @@ class ChatbotManager:
             )
             
             try:
-                threading.Thread(
-                    target=self.memory_system.add_memory,
-                    args=(ai_message,),
-                    kwargs={"memory_type": "episodic"},
-                    daemon=True
-                ).start() 
+                self._store_memory(ai_message, memory_type="episodic")
             except Exception as e:
                 logger.warning(f"存储AI自动网络搜索响应时出错: {e}")
             
@@ -1499,75 +1685,6 @@ class ChatbotManager:
                 "error": str(e)
             }
 
-    def _format_jarvis_web_response(self, search_result, user_input):
-        """格式化网络搜索结果，模拟钢铁侠电影中J.A.R.V.I.S.的响应风格
-        
-        Args:
-            search_result: 搜索结果字典
-            user_input: 用户的原始输入
-            
-        Returns:
-            str: 格式化后的响应
-        """
-        try:
-            # 获取元数据信息
-            metadata = search_result.get("metadata", {})
-            search_duration = metadata.get("duration", "未知")
-            result_count = metadata.get("result_count", 0)
-            
-            # 获取搜索内容
-            content = search_result.get("content", "")
-            urls = search_result.get("urls", [])
-            titles = search_result.get("titles", [])
-            raw_articles = search_result.get("raw_articles", [])
-            
-            # 构建提示，让AI根据搜索结果回答用户问题
-            prompt = f"""作为J.A.R.V.I.S.，根据以下网络搜索结果，回答用户的问题。
-            
-用户问题: {user_input}
-
-搜索结果:
-{content}
-
-请用中文回答基于搜索结果提供准确、有帮助的回答。如果搜索结果不足以完全回答问题，请说明并提供可用的信息。
-回答应该简洁明了，直接针对用户的问题，不要重复"根据搜索结果"等引导语。
-使用钢铁侠电影中J.A.R.V.I.S.的风格：专业、高效、略带幽默感。
-"""
-            
-            try:
-                # 使用_call_openrouter替代直接调用LLM
-                logger.debug(f"发送网络搜索回答提示")
-                messages = [{"role": "user", "content": prompt}]
-                response = _call_openrouter_other(self, messages)
-                logger.debug(f"收到网络搜索回答响应")
-                
-                # 添加搜索元数据
-                footer = f"\n\n[搜索用时: {search_duration} | 结果数: {result_count}]"
-                
-                # 根据个性设置添加幽默元素
-                try:
-                    humor_level = float(self.personality.get("humor_level", 0.3))
-                    if humor_level > 0.5 and random.random() < humor_level:
-                        witty_remarks = [
-                            "我很享受这种搜索挑战。",
-                            "为您服务是我的荣幸，Sir。",
-                            "互联网上的信息总是如此... 有趣。",
-                            "这些信息应该对您有所帮助。",
-                            "我已经为您筛选了最相关的信息。"
-                        ]
-                        response += f"\n\n{random.choice(witty_remarks)}"
-                except Exception as e:
-                    logger.warning(f"添加幽默元素时出错: {e}")
-                
-                return f"{response}{footer}"
-            except Exception as e:
-                logger.warning(f"生成网络搜索回答时出错: {e}")
-                # 如果生成回答失败，返回原始搜索结果
-                return f"抱歉，我在处理搜索结果时遇到了问题。以下是原始搜索结果：\n\n{content}\n\n[搜索用时: {search_duration} | 结果数: {result_count}]"
-        except Exception as e:
-            logger.error(f"格式化网络搜索响应时出错: {e}")
-            return f"抱歉，我在处理您的网络搜索请求时遇到了问题。错误信息: {str(e)}"
-
     async def _generate_and_process_image(self, user_input: str, ai_response: str) -> Dict[str, Any]:
         """生成并处理图片
         
@@ -1636,32 +1753,18 @@ class ChatbotManager:
             bool: 是否需要生成图片
         """
         try:
+            # 先检查关键词，未命中时无需加载图片生成器
+            keyword_match = IMAGE_KEYWORDS_RE.search(user_input)
+            if not keyword_match:
+                return False
+            
             # 检查图片生成器是否可用
             if not self.image_generator:
                 logger.warning("图片生成器未初始化，无法生成图片")
                 return False
             
-            # 检查是否包含特定关键词
-            image_keywords = [
-                "长什么样子", 
-                "长啥样", 
-                "长相如何", 
-                "外观如何", 
-                "样子是什么", 
-                "画一个", 
-                "画一张",
-                "生成一张图片",
-                "生成图片",
-                "帮我画"
-            ]
-            
-            # 检查用户输入是否包含图片生成关键词
-            for keyword in image_keywords:
-                if keyword in user_input:
-                    logger.info(f"检测到图片生成关键词: {keyword}")
-                    return True
-            
-            return False
+            logger.info(f"检测到图片生成关键词: {keyword_match.group(0)}")
+            return True
         except Exception as e:
             logger.error(f"检测图片生成请求时出错: {e}")
             return False
@@ -1672,26 +1775,20 @@ class ChatbotManager:
         Returns:
             List[Dict[str, Any]]: 消息历史列表，每个消息包含角色和内容
         """
-        messages = []
+        # 对话历史未变化时直接返回缓存的副本
+        if self._history_cache is not None:
+            return list(self._history_cache)
         
-        # 添加对话历史记录
-        for i in range(0, len(self.conversation_history), 2):
-            if i < len(self.conversation_history):
-                # 添加用户消息
-                messages.append({
-                    "role": "user",
-                    "content": self.conversation_history[i]
-                })
-            
-            if i + 1 < len(self.conversation_history):
-                # 添加AI响应
-                messages.append({
-                    "role": "assistant",
-                    "content": self.conversation_history[i + 1]
-                })
+        # 添加对话历史记录：偶数位置是用户消息，奇数位置是AI响应
+        roles = ("user", "assistant")
+        messages = [
+            {"role": roles[i & 1], "content": content}
+            for i, content in enumerate(self.conversation_history)
+        ]
         
         # 如果有最后一次对话但未添加到历史记录中，也添加进去
-        if self.last_user_input and self.last_user_input not in [msg.get("content") for msg in messages if msg.get("role") == "user"]:
+        user_contents = {msg["content"] for msg in messages if msg["role"] == "user"}
+        if self.last_user_input and self.last_user_input not in user_contents:
             messages.append({
                 "role": "user",
                 "content": self.last_user_input
@@ -1703,7 +1800,25 @@ class ChatbotManager:
                     "content": self.last_ai_response
                 })
         
-        return messages
+        self._history_cache = messages
+        return list(messages)
+
+    def chat_sync(self, user_input: str, image_data: Optional[Dict[str, str]] = None) -> str:
+        """chat的阻塞版本：在当前线程中用独立的事件循环运行chat，供调用方放到线程池中执行"""
+        async def run_chat():
+            try:
+                return await self.chat(user_input, image_data)
+            finally:
+                # 事件循环随asyncio.run结束，先关闭绑定在该循环上的共享HTTP会话
+                await close_session()
+        with self._chat_sync_lock:
+            return asyncio.run(run_chat())
+
+    def _save_sync(self):
+        """同步保存当前会话的上下文数据（包含阻塞的磁盘IO，应在工作线程中调用）"""
+        context = self.context_storage.get_context(self.session_id)
+        if context is not None:
+            self.context_storage.save_context(self.session_id, context)
 
     async def _analyze_image_with_gemini_vision(self, image_data: Dict[str, str]) -> str:
         """使用Gemini Vision分析图片内容"""
@@ -1712,17 +1827,21 @@ class ChatbotManager:
             image_content = image_data.get("content", "")
             mime_type = image_data.get("mime_type", "image/jpeg")
             
-            # 确保image_content是base64编码的字符串
             if not image_content:
                 return "图片内容为空"
             
+            # 前端传入的已是base64字符串，直接透传；传入原始字节时只在这里编码一次
+            if isinstance(image_content, (bytes, bytearray)):
+                image_content = base64.b64encode(image_content).decode("ascii")
+            
             # 尝试导入并使用核心模块的函数
             try:
-                from core.llmhandle.callopenrouter import _call_gemini_vision
+                from core.llmhandle.callopenrouter import _acall_gemini_vision
                 
                 # 直接使用base64编码的图片数据调用API
-                analysis_result = _call_gemini_vision(
-                    image_base64=image_content
+                analysis_result = await _acall_gemini_vision(
+                    image_base64=image_content,
+                    mime_type=mime_type
                 )
                 return analysis_result
             
@@ -1731,7 +1850,8 @@ class ChatbotManager:
                 logger.warning("无法导入核心模块，使用内部定义的替代函数")
                 return await self._fallback_gemini_vision(
                     image_base64=image_content,
-                    prompt="请详细分析这张图片中的内容，包括可见的对象、场景、文本和重要细节。"
+                    prompt="请详细分析这张图片中的内容，包括可见的对象、场景、文本和重要细节。",
+                    mime_type=mime_type
                 )
                 
         # 捕获所有异常
@@ -1739,7 +1859,7 @@ class ChatbotManager:
             logger.error(f"图片分析错误: {str(e)}", exc_info=True)
             return f"图片分析失败: {str(e)}"
     
-    async def _fallback_gemini_vision(self, image_base64: str, prompt: str) -> str:
+    async def _fallback_gemini_vision(self, image_base64: str, prompt: str, mime_type: str = "image/jpeg") -> str:
         """当无法使用核心Gemini Vision API时的替代方法"""
         try:
             import os
@@ -1765,7 +1885,7 @@ class ChatbotManager:
                             {"text": prompt},
                             {
                                 "inline_data": {
-                                    "mime_type": "image/jpeg",
+                                    "mime_type": mime_type,
                                     "data": image_base64
                                 }
                             }
@@ -1780,29 +1900,35 @@ class ChatbotManager:
                 }
             }
             
-            # 发送API请求
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{api_url}?key={api_key}",
-                    headers=headers,
-                    json=request_data
-                ) as response:
-                    response_data = await response.json()
-                    
-                    # 处理响应
-                    if response.status == 200:
-                        try:
-                            text_content = response_data.get("candidates", [])[0].get("content", {}).get("parts", [])[0].get("text", "")
-                            if text_content:
-                                return text_content
-                            else:
-                                return "API返回了空响应"
-                        except (IndexError, KeyError) as e:
-                            logger.error(f"解析API响应出错: {str(e)}")
-                            return f"解析API响应出错: {str(e)}"
-                    else:
-                        error_message = response_data.get("error", {}).get("message", "未知错误")
-                        return f"API请求失败 ({response.status}): {error_message}"
+            # 请求体含整张图片的base64字符串，有orjson时用它预先序列化
+            if orjson is not None:
+                request_body = orjson.dumps(request_data)
+            else:
+                request_body = json.dumps(request_data).encode("utf-8")
+            
+            # 发送API请求（复用当前事件循环的共享会话，避免每次重新建立TLS连接）
+            session = await get_session()
+            async with session.post(
+                f"{api_url}?key={api_key}",
+                headers=headers,
+                data=request_body
+            ) as response:
+                response_data = await response.json()
+                
+                # 处理响应
+                if response.status == 200:
+                    try:
+                        text_content = response_data.get("candidates", [])[0].get("content", {}).get("parts", [])[0].get("text", "")
+                        if text_content:
+                            return text_content
+                        else:
+                            return "API返回了空响应"
+                    except (IndexError, KeyError) as e:
+                        logger.error(f"解析API响应出错: {str(e)}")
+                        return f"解析API响应出错: {str(e)}"
+                else:
+                    error_message = response_data.get("error", {}).get("message", "未知错误")
+                    return f"API请求失败 ({response.status}): {error_message}"
         except Exception as e:
             logger.error(f"替代Gemini Vision处理出错: {str(e)}", exc_info=True)
             return f"图片分析失败: {str(e)}"
@@ -1817,9 +1943,44 @@ def chat(conversation, user_input: str) -> str:
     response = conversation.invoke({"input": user_input}).content
     return response
 
+# async_chat按用户名复用的聊天管理器，按最近使用顺序排列：用户名 -> (管理器, 最近使用的monotonic时间)
+_chat_managers: "OrderedDict[str, Tuple[ChatbotManager, float]]" = OrderedDict()
+_chat_managers_lock = threading.Lock()
+# 闲置超过该秒数的聊天管理器在下一次调用async_chat时回收
+CHAT_MANAGER_IDLE_TIMEOUT = 1800
+
+def _acquire_chat_manager(username: str) -> Tuple[ChatbotManager, List[ChatbotManager]]:
+    """取出（必要时创建）用户的聊天管理器，同时移除闲置过久的管理器；返回(管理器, 被移除的管理器列表)"""
+    now = time.monotonic()
+    evicted = []
+    with _chat_managers_lock:
+        # 从最久未使用的一端弹出过期的管理器，遇到第一个未过期的即停止
+        while _chat_managers:
+            name, (manager, last_used) = next(iter(_chat_managers.items()))
+            if now - last_used <= CHAT_MANAGER_IDLE_TIMEOUT:
+                break
+            del _chat_managers[name]
+            evicted.append(manager)
+        
+        entry = _chat_managers.pop(username, None)
+        chatbot_manager = entry[0] if entry is not None else ChatbotManager(username)
+        _chat_managers[username] = (chatbot_manager, now)
+    return chatbot_manager, evicted
+
+def _release_chat_manager(chatbot_manager: ChatbotManager):
+    """保存被回收的聊天管理器的上下文并写入缓冲的记忆（阻塞IO，应在工作线程中调用）"""
+    try:
+        chatbot_manager.flush_memories(wait=True)
+        chatbot_manager._save_sync()
+    except Exception as e:
+        logger.error(f"回收用户 {chatbot_manager.username} 的聊天管理器时出错: {e}")
+
 async def async_chat(username: str, user_input: str) -> str:
-    """异步聊天API"""
-    chatbot_manager = ChatbotManager(username)
+    """异步聊天API，同一用户的多次调用复用同一个聊天管理器"""
+    # 创建管理器会打开向量库并连接嵌入模型，放到工作线程中执行
+    chatbot_manager, evicted = await asyncio.to_thread(_acquire_chat_manager, username)
+    for manager in evicted:
+        await asyncio.to_thread(_release_chat_manager, manager)
     return await chatbot_manager.chat(user_input)
 
 def send_message(target, content, interval=1):
@@ -1895,6 +2056,8 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"\nJ.A.R.V.I.S.: I've encountered an unexpected error: {e}")
             print("J.A.R.V.I.S.: I'll make sure to log this for future improvements.")
+        finally:
+            await close_session()
     
     # Windows 特定的事件循环设置
     if platform.system() == 'Windows':
@@ -14,6 +14,7 @@ from .responseformatter import _format_web_search_response
 from .context import _extract_search_keywords
 from .backdb import _export_chromadb_data
 from .callopenrouter import _call_openrouter
+from .semantic_cache import SemanticDecisionCache
 
 __all__ = ['_extract_time_context', '_evaluate_query_effectiveness', '_expand_query_with_synonyms', '_select_best_query', '_reformulate_query', 'test_query_reformulation',
            'perform_memory_maintenance',
@@ -24,4 +25,5 @@ __all__ = ['_extract_time_context', '_evaluate_query_effectiveness', '_expand_qu
            '_extract_search_keywords',
            '_export_chromadb_data',
            '_call_openrouter',
+           'SemanticDecisionCache',
            ]
\ No newline at end of file
@@ -1,14 +1,148 @@
 import os
 import tarfile
+import shutil
+import subprocess
+import asyncio
+import tempfile
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 import logging
 import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# 增量备份的清单文件，记录上次备份时每个文件的(修改时间, 大小)
+BACKUP_MANIFEST = "manifest.json"
+# 默认每隔多少次备份做一次完整备份，其余为只包含变化文件的增量备份
+DEFAULT_FULL_BACKUP_INTERVAL = 7
+# 备份时跳过的临时文件和字节码缓存：日志、临时文件和.pyc随时可重新生成，打包只会拖慢压缩
+BACKUP_EXCLUDED_SUFFIXES = (".log", ".tmp", ".pyc")
+BACKUP_EXCLUDED_DIRS = frozenset({"__pycache__"})
+
+def _is_excluded(name: str) -> bool:
+    """判断文件或目录是否不需要备份"""
+    return name.endswith(BACKUP_EXCLUDED_SUFFIXES) or os.path.basename(name) in BACKUP_EXCLUDED_DIRS
+
+def _archive_filter(tarinfo: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+    """tarfile的filter回调，返回None时跳过该条目（目录会连同其内容一起跳过）"""
+    return None if _is_excluded(tarinfo.name) else tarinfo
+
+def _write_archive(source_dir: str, backup_path: str, members: Optional[List[str]] = None):
+    """
+    把源目录打包为tar.gz；系统装有pigz时用多核并行压缩，否则使用标准库的单线程gzip
+    
+    Args:
+        source_dir: 源目录
+        backup_path: 压缩包路径
+        members: 只打包这些文件（相对源目录的路径），为None时打包整个目录
+    """
+    arcname = os.path.basename(source_dir)
+    
+    def add_files(tar):
+        if members is None:
+            tar.add(source_dir, arcname=arcname, filter=_archive_filter)
+            return
+        for relpath in members:
+            tar.add(os.path.join(source_dir, relpath), arcname=os.path.join(arcname, relpath), recursive=False)
+    
+    pigz = shutil.which("pigz")
+    if pigz is None:
+        with tarfile.open(backup_path, "w:gz") as tar:
+            add_files(tar)
+        return
+    
+    # tarfile只输出未压缩的tar流，通过管道交给pigz压缩写入文件
+    with open(backup_path, "wb") as output:
+        proc = subprocess.Popen([pigz, "-p", str(os.cpu_count() or 1)], stdin=subprocess.PIPE, stdout=output)
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                add_files(tar)
+        finally:
+            proc.stdin.close()
+            returncode = proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"pigz压缩失败，退出码: {returncode}")
+
+def _scan_files(source_dir: str) -> Dict[str, List[int]]:
+    """遍历源目录（跳过不需要备份的文件），返回 相对路径 -> [修改时间(纳秒), 大小]"""
+    files = {}
+    stack = [source_dir]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if _is_excluded(entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[os.path.relpath(entry.path, source_dir)] = [stat.st_mtime_ns, stat.st_size]
+    return files
+
+def _load_manifest(manifest_path: str) -> Optional[dict]:
+    """读取上次备份的清单，不存在或损坏时返回None（下一次备份将做完整备份）"""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("files"), dict):
+            return manifest
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"读取备份清单失败，将进行完整备份: {e}")
+    return None
+
+def _save_manifest(manifest_path: str, manifest: dict):
+    """先写临时文件再替换，避免中断时留下不完整的清单"""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+def _run_backup(source_dir: str, base_backup_dir: str, date_backup_dir: str, timestamp: str, full_interval: int) -> Tuple[Optional[str], bool, int]:
+    """
+    执行一次备份（阻塞IO，在工作线程中执行）：与清单比较，只打包新增或修改过的文件，
+    每隔full_interval次或没有可用清单时做完整备份。增量包不记录删除的文件，恢复时依次解压完整包和其后的增量包。
+    
+    Returns:
+        (压缩包路径，没有变化时为None, 是否为完整备份, 打包的文件数)
+    """
+    manifest_path = os.path.join(base_backup_dir, BACKUP_MANIFEST)
+    manifest = _load_manifest(manifest_path)
+    current_files = _scan_files(source_dir)
+    
+    full = manifest is None or manifest.get("backups_since_full", 0) + 1 >= full_interval
+    if full:
+        members = None
+        backup_filename = f"chat_memories_{timestamp}.tar.gz"
+        file_count = len(current_files)
+    else:
+        previous_files = manifest["files"]
+        members = [relpath for relpath, signature in current_files.items() if previous_files.get(relpath) != signature]
+        if not members:
+            return None, False, 0
+        backup_filename = f"chat_memories_{timestamp}_incr.tar.gz"
+        file_count = len(members)
+    
+    backup_path = os.path.join(date_backup_dir, backup_filename)
+    _write_archive(source_dir, backup_path, members)
+    
+    # 压缩包写成功后再更新清单
+    _save_manifest(manifest_path, {
+        "backups_since_full": 0 if full else manifest.get("backups_since_full", 0) + 1,
+        "files": current_files
+    })
+    return backup_path, full, file_count
+
 async def backup_database(chatbot) -> str:
         """
-        备份chat_memories目录到dbback目录下的日期和时间戳目录中，使用tar.gz格式打包
+        备份chat_memories目录到dbback目录下的日期和时间戳目录中，使用tar.gz格式打包；
+        两次完整备份之间只打包变化过的文件
         
         Returns:
             str: 备份操作的结果消息
@@ -32,80 +166,118 @@ async def backup_database(chatbot) -> str:
             if not os.path.exists(source_dir):
                 return f"错误：源目录 '{source_dir}' 不存在"
             
-            # 创建tar.gz文件名
-            backup_filename = f"chat_memories_{current_timestamp}.tar.gz"
-            backup_path = os.path.join(date_backup_dir, backup_filename)
+            full_interval = chatbot.config_manager.get("backup", {}).get("full_backup_interval", DEFAULT_FULL_BACKUP_INTERVAL)
             
-            # 创建tar.gz文件
-            with tarfile.open(backup_path, "w:gz") as tar:
-                # 添加整个目录到压缩包
-                tar.add(source_dir, arcname=os.path.basename(source_dir))
+            # 扫描、打包和压缩都是阻塞操作，放到工作线程中执行，不阻塞事件循环
+            backup_path, full, file_count = await asyncio.to_thread(
+                _run_backup, source_dir, base_backup_dir, date_backup_dir, current_timestamp, full_interval
+            )
+            if backup_path is None:
+                logger.info("自上次备份以来没有文件变化，跳过增量备份")
+                return "自上次备份以来没有文件变化，无需备份。"
             
             # 获取压缩包大小
             backup_size = os.path.getsize(backup_path)
             backup_size_mb = backup_size / (1024 * 1024)  # 转换为MB
+            backup_kind = "完整备份" if full else "增量备份"
             
-            logger.info(f"数据库备份已完成: {backup_path} (大小: {backup_size_mb:.2f}MB)")
-            return f"数据库备份成功完成。\n备份文件: {backup_path}\n大小: {backup_size_mb:.2f}MB"
+            logger.info(f"数据库{backup_kind}已完成: {backup_path} (文件数: {file_count}, 大小: {backup_size_mb:.2f}MB)")
+            return f"数据库{backup_kind}成功完成。\n备份文件: {backup_path}\n文件数: {file_count}\n大小: {backup_size_mb:.2f}MB"
             
         except Exception as e:
             logger.error(f"数据库备份时出错: {e}", exc_info=True)
             return f"备份过程中出错: {str(e)}"
         
+# 导出Chromadb数据时每页读取的记录数
+EXPORT_PAGE_SIZE = 500
+
+def _write_collection(f, collection):
+    """分页读取集合中的记录并写入文件，每条记录拼成一个文本块写入一次"""
+    f.write(f"记录总数: {collection.count()}\n\n")
+    
+    index = 0
+    offset = 0
+    while True:
+        data = collection.get(limit=EXPORT_PAGE_SIZE, offset=offset, include=["documents", "metadatas"])
+        ids = data.get('ids', [])
+        if not ids:
+            break
+        offset += len(ids)
+        
+        for id, document, metadata in zip(ids, data.get('documents', []), data.get('metadatas', [])):
+            index += 1
+            metadata_lines = "".join(f"  {key}: {value}\n" for key, value in (metadata or {}).items())
+            f.write(f"--- 记录 {index} ---\nID: {id}\n内容: {document}\n元数据:\n{metadata_lines}\n")
+
+def _dump_collection(collection_name: str, collection, created_paths: List[str]) -> str:
+    """把单个集合导出到临时文件并返回其路径，各集合可在不同线程中并行导出
+    
+    临时文件创建后立即记入created_paths，导出中途出错时调用方也能清理
+    """
+    fd, part_path = tempfile.mkstemp(prefix="chromadb_export_", suffix=".txt")
+    created_paths.append(part_path)
+    with open(fd, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write(f"=== 集合: {collection_name} ===\n")
+        try:
+            _write_collection(f, collection)
+        except Exception as e:
+            f.write(f"获取集合数据时出错: {str(e)}\n\n")
+    return part_path
+
+def _write_export(chatbot, output_file: str, part_paths: List[str]):
+    """写入导出头部，按顺序拼接各集合的临时文件，最后导出记忆图谱（阻塞IO，在工作线程中执行）"""
+    # 1MB写缓冲，合并逐条记录的小块写入
+    with open(output_file, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write("=== Chromadb 数据导出 ===\n")
+        f.write(f"导出时间: {datetime.now().isoformat()}\n")
+        f.write(f"用户: {chatbot.username}\n")
+        f.write(f"会话ID: {chatbot.session_id}\n\n")
+        
+        for part_path in part_paths:
+            with open(part_path, "r", encoding="utf-8") as part:
+                shutil.copyfileobj(part, f, 1 << 20)
+        
+        # 导出记忆图谱数据（如果存在）
+        try:
+            memory_graph_path = os.path.join(chatbot.memory_system.persist_directory, "memory_graph.json")
+            if os.path.exists(memory_graph_path):
+                if orjson is not None:
+                    with open(memory_graph_path, "rb") as graph_file:
+                        memory_graph = orjson.loads(graph_file.read())
+                    graph_text = orjson.dumps(memory_graph, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+                else:
+                    with open(memory_graph_path, "r", encoding="utf-8") as graph_file:
+                        memory_graph = json.load(graph_file)
+                    graph_text = json.dumps(memory_graph, ensure_ascii=False, indent=2)
+                f.write(f"=== 记忆图谱 ===\n{graph_text}\n\n")
+        except Exception as e:
+            f.write(f"导出记忆图谱时出错: {str(e)}\n\n")
+
 async def _export_chromadb_data(chatbot) -> str:
         """将所有Chromadb数据导出到文件"""
+        created_paths = []
         try:
             output_file = "test.txt"
             
-            with open(output_file, "w", encoding="utf-8") as f:
-                # 获取所有集合
-                collections = chatbot.memory_system.collections
-                
-                f.write("=== Chromadb 数据导出 ===\n")
-                f.write(f"导出时间: {datetime.now().isoformat()}\n")
-                f.write(f"用户: {chatbot.username}\n")
-                f.write(f"会话ID: {chatbot.session_id}\n\n")
-                
-                # 遍历所有集合
-                for collection_name, collection in collections.items():
-                    f.write(f"=== 集合: {collection_name} ===\n")
-                    
-                    # 获取集合中的所有数据
-                    try:
-                        data = collection.get()
-                        
-                        # 写入数据统计信息
-                        f.write(f"记录总数: {len(data.get('ids', []))}\n\n")
-                        
-                        # 写入每条记录的详细信息
-                        for i, (id, document, metadata) in enumerate(zip(
-                            data.get('ids', []),
-                            data.get('documents', []),
-                            data.get('metadatas', [])
-                        )):
-                            f.write(f"--- 记录 {i+1} ---\n")
-                            f.write(f"ID: {id}\n")
-                            f.write(f"内容: {document}\n")
-                            f.write("元数据:\n")
-                            for key, value in metadata.items():
-                                f.write(f"  {key}: {value}\n")
-                            f.write("\n")
-                    except Exception as e:
-                        f.write(f"获取集合数据时出错: {str(e)}\n\n")
-                
-                # 导出记忆图谱数据（如果存在）
-                try:
-                    memory_graph_path = os.path.join(chatbot.memory_system.persist_directory, "memory_graph.json")
-                    if os.path.exists(memory_graph_path):
-                        with open(memory_graph_path, "r", encoding="utf-8") as graph_file:
-                            memory_graph = json.load(graph_file)
-                            f.write("=== 记忆图谱 ===\n")
-                            f.write(json.dumps(memory_graph, ensure_ascii=False, indent=2))
-                            f.write("\n\n")
-                except Exception as e:
-                    f.write(f"导出记忆图谱时出错: {str(e)}\n\n")
+            # 各集合的查询互相独立，在工作线程中并行导出到临时文件，总耗时取决于最大的集合；
+            # 等所有导出都结束后再处理异常，保证清理时不会遗漏仍在创建中的临时文件
+            collections = chatbot.memory_system.collections
+            part_paths = await asyncio.gather(*(
+                asyncio.to_thread(_dump_collection, collection_name, collection, created_paths)
+                for collection_name, collection in collections.items()
+            ), return_exceptions=True)
+            for result in part_paths:
+                if isinstance(result, BaseException):
+                    raise result
+            await asyncio.to_thread(_write_export, chatbot, output_file, part_paths)
             
             return f"已将所有Chromadb数据保存到当前目录的{output_file}文件中。"
         except Exception as e:
             logger.error(f"导出Chromadb数据时出错: {e}", exc_info=True)
-            return f"导出数据时出错: {str(e)}"        
\ No newline at end of file
+            return f"导出数据时出错: {str(e)}"
+        finally:
+            for part_path in created_paths:
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
@@ -1,15 +1,129 @@
 import requests
 import json
 import time
+import asyncio
 import base64
-from typing import List, Dict
+import hashlib
+import functools
+import mmap
+from typing import List, Dict, FrozenSet, Optional, Tuple
 import logging
 import os
 import configparser
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from cachetools import TTLCache
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
+from .httpsession import get_session, HTTP_SESSION
+from core.utils.RateLimiter import TokenBucket
 
 logger = logging.getLogger(__name__)    
 
+# 各服务的请求限速，按服务商的每分钟请求数平滑放行突发请求；默认值可由config.json的rate_limit.providers覆盖
+RATE_LIMITERS = {
+    "gemini": TokenBucket(requests_per_minute=15, burst=3),
+    "openrouter": TokenBucket(requests_per_minute=20, burst=5),
+}
+
+# OpenRouter请求固定附带的头部，Content-Type由共享会话或异步重试循环统一设置
+OPENROUTER_HEADERS = {
+    "HTTP-Referer": "https://github.com",
+    "X-Title": "J.A.R.V.I.S AI Assistant"
+}
+
+def configure_rate_limits(provider_limits: Dict[str, Dict[str, float]]):
+    """
+    按配置调整各服务的限速
+    
+    Args:
+        provider_limits: 服务名 -> {"requests_per_minute": ..., "burst": ...}
+    """
+    for provider, limits in provider_limits.items():
+        bucket = RATE_LIMITERS.get(provider)
+        if bucket is None:
+            logger.warning(f"未知的限速服务: {provider}")
+            continue
+        bucket.configure(
+            limits.get("requests_per_minute", bucket.rate * 60),
+            limits.get("burst", bucket.burst)
+        )
+
+# API密钥配置文件路径只计算一次
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+KEYCONFIG_DIR = os.path.join(PROJECT_ROOT, 'keyconfig')
+GOOGLE_CONFIG_PATH = os.path.join(KEYCONFIG_DIR, 'google.ini')
+OPENROUTER_CONFIG_PATH = os.path.join(KEYCONFIG_DIR, 'openrouter.ini')
+
+# 已解析的密钥配置：路径 -> (文件修改时间, ConfigParser, 全部密钥)，文件被修改后重新解析
+_CONFIG_CACHE: Dict[str, Tuple[int, configparser.ConfigParser, FrozenSet[str]]] = {}
+# 轮换密钥时在持有锁的情况下读取配置，因此使用可重入锁
+_CONFIG_LOCK = threading.RLock()
+
+def _load_config(config_path: str, section: str) -> Tuple[configparser.ConfigParser, FrozenSet[str]]:
+    """
+    读取密钥配置文件，文件修改时间未变时直接返回缓存的解析结果
+    
+    Args:
+        config_path: 配置文件路径
+        section: 配置节名称，其中keys项在解析时一并拆分
+    Returns:
+        (解析后的配置, 全部密钥的集合)；配置只能在持有_CONFIG_LOCK时修改
+    """
+    mtime = os.stat(config_path).st_mtime_ns
+    with _CONFIG_LOCK:
+        cached = _CONFIG_CACHE.get(config_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        keys = frozenset(config.get(section, 'keys', fallback='').split(',')) - {''}
+        _CONFIG_CACHE[config_path] = (mtime, config, keys)
+        return config, keys
+
+def _rotate_api_key(config_path: str, section: str, label: str) -> str:
+    """
+    轮换配置文件中的当前密钥，写回文件后使缓存失效
+    
+    Args:
+        config_path: 配置文件路径
+        section: 配置节名称
+        label: 日志中显示的服务名称
+    Returns:
+        str: 新的API密钥
+    """
+    with _CONFIG_LOCK:
+        config, all_keys = _load_config(config_path, section)
+        current_key = config.get(section, 'current_key')
+        
+        # 从所有密钥中选择一个不同于当前密钥的新密钥
+        available_keys = all_keys - {current_key}
+        if not available_keys:
+            logger.warning(f"没有可用的备用{label}密钥")
+            return current_key
+            
+        new_key = random.choice(tuple(available_keys))
+        
+        # 更新配置文件；缓存中的配置已被修改，无论写入是否成功都使其失效
+        try:
+            config.set(section, 'current_key', new_key)
+            with open(config_path, 'w') as f:
+                config.write(f)
+        finally:
+            _CONFIG_CACHE.pop(config_path, None)
+        
+    logger.info(f"已轮换{label} API密钥")
+    return new_key
+
 def _get_google_api_key():
     """
     从配置文件中获取Google API密钥
@@ -17,13 +131,9 @@ def _get_google_api_key():
     Returns:
         str: 当前使用的API密钥
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'keyconfig', 'google.ini')
-    config = configparser.ConfigParser()
-    
     try:
-        config.read(config_path)
-        current_key = config.get('google_api', 'current_key')
-        return current_key
+        config, _ = _load_config(GOOGLE_CONFIG_PATH, 'google_api')
+        return config.get('google_api', 'current_key')
     except Exception as e:
         logger.error(f"读取Google API密钥失败: {str(e)}")
         raise Exception(f"无法获取API密钥: {str(e)}")
@@ -35,29 +145,8 @@ def _rotate_google_api_key():
     Returns:
         str: 新的API密钥
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'keyconfig', 'google.ini')
-    config = configparser.ConfigParser()
-    
     try:
-        config.read(config_path)
-        current_key = config.get('google_api', 'current_key')
-        all_keys = config.get('google_api', 'keys').split(',')
-        
-        # 从所有密钥中选择一个不同于当前密钥的新密钥
-        available_keys = [key for key in all_keys if key != current_key]
-        if not available_keys:
-            logger.warning("没有可用的备用密钥")
-            return current_key
-            
-        new_key = random.choice(available_keys)
-        
-        # 更新配置文件
-        config.set('google_api', 'current_key', new_key)
-        with open(config_path, 'w') as f:
-            config.write(f)
-            
-        logger.info(f"已轮换Google API密钥")
-        return new_key
+        return _rotate_api_key(GOOGLE_CONFIG_PATH, 'google_api', 'Google')
     except Exception as e:
         logger.error(f"轮换Google API密钥失败: {str(e)}")
         raise Exception(f"无法轮换API密钥: {str(e)}")
@@ -69,13 +158,9 @@ def _get_openrouter_api_key():
     Returns:
         str: 当前使用的API密钥
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'keyconfig', 'openrouter.ini')
-    config = configparser.ConfigParser()
-    
     try:
-        config.read(config_path)
-        current_key = config.get('openrouter_api', 'current_key')
-        return current_key
+        config, _ = _load_config(OPENROUTER_CONFIG_PATH, 'openrouter_api')
+        return config.get('openrouter_api', 'current_key')
     except Exception as e:
         logger.error(f"读取OpenRouter API密钥失败: {str(e)}")
         raise Exception(f"无法获取API密钥: {str(e)}")
@@ -87,349 +172,500 @@ def _rotate_openrouter_api_key():
     Returns:
         str: 新的API密钥
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'keyconfig', 'openrouter.ini')
-    config = configparser.ConfigParser()
-    
     try:
-        config.read(config_path)
-        current_key = config.get('openrouter_api', 'current_key')
-        all_keys = config.get('openrouter_api', 'keys').split(',')
-        
-        # 从所有密钥中选择一个不同于当前密钥的新密钥
-        available_keys = [key for key in all_keys if key != current_key]
-        if not available_keys:
-            logger.warning("没有可用的备用OpenRouter密钥")
-            return current_key
-            
-        new_key = random.choice(available_keys)
-        
-        # 更新配置文件
-        config.set('openrouter_api', 'current_key', new_key)
-        with open(config_path, 'w') as f:
-            config.write(f)
-            
-        logger.info(f"已轮换OpenRouter API密钥")
-        return new_key
+        return _rotate_api_key(OPENROUTER_CONFIG_PATH, 'openrouter_api', 'OpenRouter')
     except Exception as e:
         logger.error(f"轮换OpenRouter API密钥失败: {str(e)}")
         raise Exception(f"无法轮换API密钥: {str(e)}")
 
-def _call_openrouter_main(chatbot, messages: List[Dict[str, str]]) -> str:
+JSON_HEADERS = {"Content-Type": "application/json"}
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+GROK3_URL = "http://localhost:1718/ask"
+GROK3_CONNECTION_ERROR = "无法连接到本地Grok3服务，请确保服务正在运行"
+
+def _last_content(messages: List[Dict[str, str]], role: str = "user") -> str:
+    """从messages末尾向前查找指定角色的最后一条消息内容，没有时返回空字符串"""
+    return next((msg["content"] for msg in reversed(messages) if msg["role"] == role), "")
+
+def _build_gemini_text_request(model: str, messages: List[Dict[str, str]]) -> tuple:
+    """构建Gemini文本对话请求，返回(url, 请求头, 请求数据)；同步与异步版本共用"""
+    prompt = _last_content(messages)
+    url = GEMINI_URL.format(model=model, api_key=_get_google_api_key())
+    data = {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }]
+    }
+    logger.debug("Sending request to Gemini API with prompt: %s", prompt)
+    return url, None, data
+
+def _extract_gemini_content(result: dict) -> str:
+    """从Gemini响应中提取文本内容，内容为空或结构不符时抛出ValueError"""
+    if logger.isEnabledFor(logging.DEBUG):  # 避免非调试模式下序列化整个响应
+        logger.debug(f"Gemini API raw response: {json.dumps(result, ensure_ascii=False)}")
+    
+    try:
+        # 提取响应内容
+        content = ""
+        parts = result['candidates'][0]['content']['parts']
+        for part in parts:
+            if 'text' in part:
+                content += part['text']
+    except (KeyError, IndexError) as e:
+        raise ValueError(f"无法从API响应中提取内容: {str(e)}")
+    
+    if not content:
+        raise ValueError("API返回的响应内容为空")
+    
+    logger.debug("Successfully extracted content: %.100s...", content)
+    return content
+
+# Gemini文本调用的结果缓存：键为(模型, 请求中影响回答的字段)，TTL避免联网搜索类回答过期
+GEMINI_TEXT_CACHE = TTLCache(maxsize=512, ttl=600)
+_GEMINI_TEXT_CACHE_LOCK = threading.Lock()
+
+def _gemini_text_cache_key(model: str, messages: List[Dict[str, str]], *extra) -> tuple:
+    """Gemini请求只发送最后一条用户消息和系统消息，缓存键只包含这些内容"""
+    return (model, _last_content(messages), _last_content(messages, "system")) + extra
+
+def _get_cached_gemini_text(key: tuple) -> Optional[str]:
+    """查找未过期的缓存回答，未命中时返回None"""
+    with _GEMINI_TEXT_CACHE_LOCK:
+        content = GEMINI_TEXT_CACHE.get(key)
+    if content is not None:
+        logger.debug("Gemini文本调用命中缓存")
+    return content
+
+def _put_cached_gemini_text(key: tuple, content: str):
+    """缓存成功的回答，超出容量时淘汰最久未使用的条目"""
+    with _GEMINI_TEXT_CACHE_LOCK:
+        GEMINI_TEXT_CACHE[key] = content
+
+def _build_openrouter_request(model: str, messages: List[Dict[str, str]]) -> tuple:
+    """构建OpenRouter对话请求，返回(url, 请求头, 请求数据)；同步与异步版本共用"""
+    # 获取当前API密钥
+    api_key = _get_openrouter_api_key()
+    
+    # 记录请求详情
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Sending request to OpenRouter API with messages: {json.dumps(messages, ensure_ascii=False)}")
+    
+    headers = {**OPENROUTER_HEADERS, "Authorization": f"Bearer {api_key}"}
+    return OPENROUTER_URL, headers, {"model": model, "messages": messages}
+
+def _extract_openrouter_content(result: dict) -> str:
+    """从OpenRouter响应中提取文本内容，内容为空或结构不符时抛出ValueError"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"OpenRouter API parsed response: {json.dumps(result, ensure_ascii=False)}")
+    
+    # 提取响应内容
+    if 'choices' in result and len(result['choices']) > 0:
+        content = result['choices'][0]['message']['content']
+        if not content:
+            raise ValueError("API返回的响应内容为空")
+        logger.debug("Successfully extracted content: %.100s...", content)
+        return content
+    else:
+        raise ValueError("API响应中没有找到内容")
+
+# 重试退避：基础延迟按次数指数增长并封顶，再叠加随机抖动，避免多个请求同时重试
+RETRY_MAX_DELAY = 30
+RETRY_JITTER = 1.0
+# 服务端Retry-After最多等待的时间（秒），超过时按上限等待
+RETRY_AFTER_MAX = 60
+# 这些HTTP状态表示当前密钥无效、无权限或已用完额度，换一个密钥重试才有意义；
+# 超时、5xx和响应解析失败与密钥无关，不轮换
+KEY_ROTATION_STATUSES = frozenset({400, 401, 403, 429})
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def _backoff_delay(retry_count: int, base_delay: float, retry_after: Optional[str] = None) -> float:
     """
-    调用Gemini API进行对话
+    计算第retry_count次失败后的等待时间
     
     Args:
-        messages: 消息列表，每个消息包含role和content       
+        retry_count: 已失败的次数（从1开始）
+        base_delay: 第一次重试的基础延迟（秒）
+        retry_after: 服务端返回的Retry-After头，存在时优先使用
     Returns:
-        str: AI的响应内容
-        
-    Raises:
-        Exception: 当API调用失败时抛出异常
+        float: 等待的秒数
     """
-    # 从messages中提取最后一条用户消息作为prompt
-    prompt = ""
-    for msg in messages:
-        if msg["role"] == "user":
-            prompt = msg["content"]
+    server_delay = _parse_retry_after(retry_after)
+    if server_delay is not None:
+        return min(server_delay, RETRY_AFTER_MAX)
+    return min(RETRY_MAX_DELAY, base_delay * 2 ** (retry_count - 1)) + random.uniform(0, RETRY_JITTER)
+
+def _dump_json(data) -> bytes:
+    """序列化请求体；图像请求内嵌数MB的base64字符串，orjson可用时比json.dumps快数倍"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+def _post_with_retry(
+    name: str,
+    build_request,
+    extract,
+    rotate_key=None,
+    rate_limiter: TokenBucket = None,
+    timeout: float = None,
+    retry_delay: float = 2,
+    max_retries: int = 3,
+    connection_error_message: str = None
+) -> str:
+    """
+    同步调用的通用重试循环：通过共享的requests会话发送请求，失败后指数退避重试，密钥相关的失败先轮换密钥
     
-    max_retries = 3
+    Args:
+        name: 服务名称，用于日志
+        build_request: 每次尝试前调用，返回(url, 请求头或None, 请求数据)；密钥轮换后重新构建
+        extract: 从解析后的JSON响应中提取内容，失败时抛出ValueError
+        rotate_key: 密钥相关的失败后调用的密钥轮换函数，为None时不轮换
+        rate_limiter: 发送前需要获取令牌的限速器
+        timeout: 单次请求的超时时间（秒），为None时不限制
+        retry_delay: 第一次重试前的基础延迟（秒），之后按指数增长
+        max_retries: 最多尝试次数
+        connection_error_message: 无法建立连接时抛出的错误信息，为None时按一般请求错误处理
+    Returns:
+        str: 提取出的响应内容
+    
+    Raises:
+        Exception: 所有尝试均失败时抛出异常
+    """
     retry_count = 0
     
     while retry_count < max_retries:
         try:
-            # 获取当前API密钥
-            api_key = _get_google_api_key()
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-pro-exp-03-25:generateContent?key={api_key}"
+            url, headers, data = build_request()
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            # 共享会话已设置Content-Type，直接发送预先序列化的请求体
+            response = HTTP_SESSION.post(url, headers=headers, data=_dump_json(data), timeout=timeout)
             
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                "contents": [{
-                    "parts": [{"text": prompt}]
-                }]
-            }
+            # 记录原始响应
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"{name} API raw response: {response.text}")
             
-            logger.debug(f"Sending request to Gemini API with prompt: {prompt}")
-            response = requests.post(url, headers=headers, json=data)
+            # 检查请求是否成功
             response.raise_for_status()
-            result = response.json()
-            logger.debug(f"Gemini API raw response: {json.dumps(result, ensure_ascii=False)}")
+            # 直接解析响应字节，orjson可用时比response.json()快数倍
+            return extract(json_loads(response.content))
+        
+        except (ValueError, requests.exceptions.RequestException) as e:
+            logger.warning(f"{name} API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
             
-            # Extract the response text
-            try:
-                content = ""
-                parts = result['candidates'][0]['content']['parts']
-                for part in parts:
-                    if 'text' in part:
-                        content += part['text']
-                
-                if not content:
-                    raise ValueError("API返回的响应内容为空")
-                logger.debug(f"Successfully extracted content: {content[:100]}...")
-                return content
-            except (KeyError, IndexError) as e:
-                raise ValueError(f"无法从API响应中提取内容: {str(e)}")
-                
-        except (requests.exceptions.RequestException, ValueError, json.JSONDecodeError) as e:
-            logger.warning(f"Gemini API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
+            status, retry_after = None, None
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+                status = e.response.status_code
+                retry_after = e.response.headers.get("Retry-After")
             
-            # 轮换API密钥
-            _rotate_google_api_key()
+            # 只有与密钥相关的失败才轮换API密钥
+            if rotate_key is not None and status in KEY_ROTATION_STATUSES:
+                rotate_key()
             retry_count += 1
             
             if retry_count >= max_retries:
-                logger.error(f"Gemini API调用在 {max_retries} 次尝试后仍然失败")
-                if isinstance(e, requests.exceptions.RequestException):
+                logger.error(f"{name} API调用在 {max_retries} 次尝试后仍然失败")
+                if isinstance(e, requests.exceptions.Timeout):
+                    raise Exception("API请求超时，请稍后重试")
+                elif connection_error_message and isinstance(e, requests.exceptions.ConnectionError):
+                    raise Exception(connection_error_message)
+                elif isinstance(e, requests.exceptions.RequestException):
                     raise Exception(f"API请求失败: {str(e)}")
                 elif isinstance(e, json.JSONDecodeError):
                     raise Exception(f"解析响应失败: {str(e)}")
                 else:
                     raise Exception(f"API调用失败: {str(e)}")
             
-            # 短暂延迟后重试
-            time.sleep(2)
+            # 指数退避后重试，429时遵循服务端的Retry-After
+            time.sleep(_backoff_delay(retry_count, retry_delay, retry_after))
 
-def _call_openrouter(chatbot, messages: List[Dict[str, str]]) -> str:
+async def _apost_with_retry(
+    name: str,
+    build_request,
+    extract,
+    rotate_key=None,
+    rate_limiter: TokenBucket = None,
+    timeout: float = 180,
+    retry_delay: float = 2,
+    max_retries: int = 3,
+    connection_error_message: str = None
+) -> str:
     """
-    调用Gemini API进行对话
+    异步调用的通用重试循环：通过当前事件循环的共享aiohttp会话发送请求，失败后指数退避重试，密钥相关的失败先轮换密钥
     
     Args:
-        messages: 消息列表，每个消息包含role和content       
+        name: 服务名称，用于日志
+        build_request: 每次尝试前调用，返回(url, 请求头或None, 请求数据)；密钥轮换后重新构建
+        extract: 从解析后的JSON响应中提取内容，失败时抛出ValueError
+        rotate_key: 密钥相关的失败后调用的密钥轮换函数，为None时不轮换
+        rate_limiter: 发送前需要获取令牌的限速器
+        timeout: 单次请求的超时时间（秒）
+        retry_delay: 第一次重试前的基础延迟（秒），之后按指数增长
+        max_retries: 最多尝试次数
+        connection_error_message: 无法建立连接时抛出的错误信息，为None时按一般请求错误处理
     Returns:
-        str: AI的响应内容
-        
+        str: 提取出的响应内容
+    
     Raises:
-        Exception: 当API调用失败时抛出异常
+        Exception: 所有尝试均失败时抛出异常
     """
-    # 从messages中提取最后一条用户消息作为prompt
-    prompt = ""
-    for msg in messages:
-        if msg["role"] == "user":
-            prompt = msg["content"]
+    import aiohttp
     
-    max_retries = 3
     retry_count = 0
     
+    # 复用当前事件循环的共享会话，连接在重试和后续请求之间保持
+    session = await get_session()
     while retry_count < max_retries:
         try:
-            # 获取当前API密钥
-            api_key = _get_google_api_key()
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-pro-exp-02-05:generateContent?key={api_key}"
-            
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                "contents": [{
-                    "parts": [{"text": prompt}]
-                }]
-            }
-            
-            logger.debug(f"Sending request to Gemini API with prompt: {prompt}")
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            logger.debug(f"Gemini API raw response: {json.dumps(result, ensure_ascii=False)}")
+            url, headers, data = build_request()
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async()
+            headers = {**JSON_HEADERS, **headers} if headers else JSON_HEADERS
+            async with session.post(url, headers=headers, data=_dump_json(data), timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                result = json_loads(await response.read())
+            return extract(result)
+        
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"{name} API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
             
-            # Extract the response text
-            try:
-                content = ""
-                parts = result['candidates'][0]['content']['parts']
-                for part in parts:
-                    if 'text' in part:
-                        content += part['text']
-                
-                if not content:
-                    raise ValueError("API返回的响应内容为空")
-                logger.debug(f"Successfully extracted content: {content[:100]}...")
-                return content
-            except (KeyError, IndexError) as e:
-                raise ValueError(f"无法从API响应中提取内容: {str(e)}")
-                
-        except (requests.exceptions.RequestException, ValueError, json.JSONDecodeError) as e:
-            logger.warning(f"Gemini API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
+            status, retry_after = None, None
+            if isinstance(e, aiohttp.ClientResponseError):
+                status = e.status
+                retry_after = e.headers.get("Retry-After") if e.headers else None
             
-            # 轮换API密钥
-            _rotate_google_api_key()
+            # 只有与密钥相关的失败才轮换API密钥
+            if rotate_key is not None and status in KEY_ROTATION_STATUSES:
+                rotate_key()
             retry_count += 1
             
             if retry_count >= max_retries:
-                logger.error(f"Gemini API调用在 {max_retries} 次尝试后仍然失败")
-                if isinstance(e, requests.exceptions.RequestException):
+                logger.error(f"{name} API调用在 {max_retries} 次尝试后仍然失败")
+                if isinstance(e, asyncio.TimeoutError):
+                    raise Exception("API请求超时，请稍后重试")
+                elif connection_error_message and isinstance(e, aiohttp.ClientConnectionError):
+                    raise Exception(connection_error_message)
+                elif isinstance(e, aiohttp.ClientError):
                     raise Exception(f"API请求失败: {str(e)}")
                 elif isinstance(e, json.JSONDecodeError):
                     raise Exception(f"解析响应失败: {str(e)}")
                 else:
                     raise Exception(f"API调用失败: {str(e)}")
             
-            # 短暂延迟后重试
-            time.sleep(2)
-            
+            # 指数退避后重试，429时遵循服务端的Retry-After
+            await asyncio.sleep(_backoff_delay(retry_count, retry_delay, retry_after))
+
+def _call_openrouter_main(chatbot, messages: List[Dict[str, str]]) -> str:
+    """
+    调用Gemini API进行对话，相同的问题在缓存有效期内直接返回上次的回答
+    
+    Args:
+        messages: 消息列表，每个消息包含role和content
+    Returns:
+        str: AI的响应内容
+    
+    Raises:
+        Exception: 当API调用失败时抛出异常
+    """
+    cache_key = _gemini_text_cache_key("gemini-2.5-pro-exp-03-25", messages)
+    cached = _get_cached_gemini_text(cache_key)
+    if cached is not None:
+        return cached
+    
+    content = _post_with_retry(
+        "Gemini",
+        lambda: _build_gemini_text_request("gemini-2.5-pro-exp-03-25", messages),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"]
+    )
+    _put_cached_gemini_text(cache_key, content)
+    return content
+
+async def _acall_openrouter_main(chatbot, messages: List[Dict[str, str]]) -> str:
+    """_call_openrouter_main的异步版本，等待响应期间不阻塞事件循环"""
+    cache_key = _gemini_text_cache_key("gemini-2.5-pro-exp-03-25", messages)
+    cached = _get_cached_gemini_text(cache_key)
+    if cached is not None:
+        return cached
+    
+    content = await _apost_with_retry(
+        "Gemini",
+        lambda: _build_gemini_text_request("gemini-2.5-pro-exp-03-25", messages),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"],
+        timeout=900
+    )
+    _put_cached_gemini_text(cache_key, content)
+    return content
+
+def _call_openrouter(chatbot, messages: List[Dict[str, str]]) -> str:
+    """
+    调用Gemini API进行对话，相同的问题在缓存有效期内直接返回上次的回答
+    
+    Args:
+        messages: 消息列表，每个消息包含role和content
+    Returns:
+        str: AI的响应内容
+    
+    Raises:
+        Exception: 当API调用失败时抛出异常
+    """
+    cache_key = _gemini_text_cache_key("gemini-2.0-pro-exp-02-05", messages)
+    cached = _get_cached_gemini_text(cache_key)
+    if cached is not None:
+        return cached
+    
+    content = _post_with_retry(
+        "Gemini",
+        lambda: _build_gemini_text_request("gemini-2.0-pro-exp-02-05", messages),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"]
+    )
+    _put_cached_gemini_text(cache_key, content)
+    return content
+
+async def _acall_openrouter(chatbot, messages: List[Dict[str, str]]) -> str:
+    """_call_openrouter的异步版本，等待响应期间不阻塞事件循环"""
+    cache_key = _gemini_text_cache_key("gemini-2.0-pro-exp-02-05", messages)
+    cached = _get_cached_gemini_text(cache_key)
+    if cached is not None:
+        return cached
+    
+    content = await _apost_with_retry(
+        "Gemini",
+        lambda: _build_gemini_text_request("gemini-2.0-pro-exp-02-05", messages),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"],
+        timeout=900
+    )
+    _put_cached_gemini_text(cache_key, content)
+    return content
+
 def _call_openrouter_qwq(chatbot, messages: List[Dict[str, str]]) -> str:
-        """
-        调用OpenRouter API进行对话
-        
-        Args:
-            messages: 消息列表，每个消息包含role和content
-            
-        Returns:
-            str: AI的响应内容
-            
-        Raises:
-            Exception: 当API调用失败时抛出异常
-        """
-        max_retries = 3
-        retry_count = 0
-        retry_delay = 3  # 延迟3秒
-        
-        while retry_count < max_retries:
-            try:
-                # 获取当前API密钥
-                api_key = _get_openrouter_api_key()
-                
-                # 记录请求详情
-                logger.debug(f"Sending request to OpenRouter API with messages: {json.dumps(messages, ensure_ascii=False)}")
-                
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "https://github.com",
-                        "X-Title": "J.A.R.V.I.S AI Assistant"
-                    },
-                    json={
-                        "model": "qwen/qwen-2.5-72b-instruct:free",
-                        "messages": messages
-                    },
-                    timeout=900  # 设置900秒超时
-                )
-                
-                # 记录原始响应
-                logger.debug(f"OpenRouter API raw response: {response.text}")
-                
-                # 检查请求是否成功
-                response.raise_for_status()
-                
-                # 解析JSON响应
-                result = response.json()
-                logger.debug(f"OpenRouter API parsed response: {json.dumps(result, ensure_ascii=False)}")
-                
-                # 提取响应内容
-                if 'choices' in result and len(result['choices']) > 0:
-                    content = result['choices'][0]['message']['content']
-                    if not content:
-                        raise ValueError("API返回的响应内容为空")
-                    logger.debug(f"Successfully extracted content: {content[:100]}...")
-                    return content
-                else:
-                    raise ValueError("API响应中没有找到内容")
-                    
-            except (ValueError, requests.exceptions.RequestException, json.JSONDecodeError) as e:
-                logger.warning(f"OpenRouter API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
-                
-                # 轮换API密钥
-                _rotate_openrouter_api_key()
-                retry_count += 1
-                
-                if retry_count >= max_retries:
-                    logger.error(f"OpenRouter API调用在 {max_retries} 次尝试后仍然失败")
-                    if isinstance(e, requests.exceptions.Timeout):
-                        raise Exception("API请求超时，请稍后重试")
-                    elif isinstance(e, requests.exceptions.RequestException):
-                        raise Exception(f"API请求失败: {str(e)}")
-                    elif isinstance(e, json.JSONDecodeError):
-                        raise Exception(f"解析响应失败: {str(e)}")
-                    else:
-                        raise Exception(f"API调用失败: {str(e)}")
-                
-                # 短暂延迟后重试
-                time.sleep(retry_delay)
+    """
+    调用OpenRouter API进行对话
+    
+    Args:
+        messages: 消息列表，每个消息包含role和content
+    
+    Returns:
+        str: AI的响应内容
+    
+    Raises:
+        Exception: 当API调用失败时抛出异常
+    """
+    return _post_with_retry(
+        "OpenRouter",
+        lambda: _build_openrouter_request("qwen/qwen-2.5-72b-instruct:free", messages),
+        _extract_openrouter_content,
+        rotate_key=_rotate_openrouter_api_key,
+        rate_limiter=RATE_LIMITERS["openrouter"],
+        timeout=900,
+        retry_delay=3
+    )
+
+async def _acall_openrouter_qwq(chatbot, messages: List[Dict[str, str]]) -> str:
+    """_call_openrouter_qwq的异步版本，等待响应期间不阻塞事件循环"""
+    return await _apost_with_retry(
+        "OpenRouter",
+        lambda: _build_openrouter_request("qwen/qwen-2.5-72b-instruct:free", messages),
+        _extract_openrouter_content,
+        rotate_key=_rotate_openrouter_api_key,
+        rate_limiter=RATE_LIMITERS["openrouter"],
+        timeout=900,
+        retry_delay=3
+    )
 
 def _call_openrouter_other(chatbot, messages: List[Dict[str, str]]) -> str:
-        """
-        调用OpenRouter API进行对话
-        
-        Args:
-            messages: 消息列表，每个消息包含role和content
-            
-        Returns:
-            str: AI的响应内容
-            
-        Raises:
-            Exception: 当API调用失败时抛出异常
-        """
-        max_retries = 3
-        retry_count = 0
-        retry_delay = 3  # 延迟3秒
-        
-        while retry_count < max_retries:
-            try:
-                # 获取当前API密钥
-                api_key = _get_openrouter_api_key()
-                
-                # 记录请求详情
-                logger.debug(f"Sending request to OpenRouter API with messages: {json.dumps(messages, ensure_ascii=False)}")
-                
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "https://github.com",
-                        "X-Title": "J.A.R.V.I.S AI Assistant"
-                    },
-                    json={
-                        "model": "openrouter/quasar-alpha",
-                        "messages": messages
-                    },
-                    timeout=180  # 设置900秒超时
-                )
-                
-                # 记录原始响应
-                logger.debug(f"OpenRouter API raw response: {response.text}")
-                
-                # 检查请求是否成功
-                response.raise_for_status()
-                
-                # 解析JSON响应
-                result = response.json()
-                logger.debug(f"OpenRouter API parsed response: {json.dumps(result, ensure_ascii=False)}")
-                
-                # 提取响应内容
-                if 'choices' in result and len(result['choices']) > 0:
-                    content = result['choices'][0]['message']['content']
-                    if not content:
-                        raise ValueError("API返回的响应内容为空")
-                    logger.debug(f"Successfully extracted content: {content[:100]}...")
-                    return content
-                else:
-                    raise ValueError("API响应中没有找到内容")
-                    
-            except (ValueError, requests.exceptions.RequestException, json.JSONDecodeError) as e:
-                logger.warning(f"OpenRouter API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
-                
-                # 轮换API密钥
-                _rotate_openrouter_api_key()
-                retry_count += 1
-                
-                if retry_count >= max_retries:
-                    logger.error(f"OpenRouter API调用在 {max_retries} 次尝试后仍然失败")
-                    if isinstance(e, requests.exceptions.Timeout):
-                        raise Exception("API请求超时，请稍后重试")
-                    elif isinstance(e, requests.exceptions.RequestException):
-                        raise Exception(f"API请求失败: {str(e)}")
-                    elif isinstance(e, json.JSONDecodeError):
-                        raise Exception(f"解析响应失败: {str(e)}")
-                    else:
-                        raise Exception(f"API调用失败: {str(e)}")
-                
-                # 短暂延迟后重试
-                time.sleep(retry_delay)
-                
+    """
+    调用OpenRouter API进行对话
+    
+    Args:
+        messages: 消息列表，每个消息包含role和content
+    
+    Returns:
+        str: AI的响应内容
+    
+    Raises:
+        Exception: 当API调用失败时抛出异常
+    """
+    return _post_with_retry(
+        "OpenRouter",
+        lambda: _build_openrouter_request("openrouter/quasar-alpha", messages),
+        _extract_openrouter_content,
+        rotate_key=_rotate_openrouter_api_key,
+        rate_limiter=RATE_LIMITERS["openrouter"],
+        timeout=180,
+        retry_delay=3
+    )
+
+async def _acall_openrouter_other(chatbot, messages: List[Dict[str, str]]) -> str:
+    """_call_openrouter_other的异步版本，等待响应期间不阻塞事件循环"""
+    return await _apost_with_retry(
+        "OpenRouter",
+        lambda: _build_openrouter_request("openrouter/quasar-alpha", messages),
+        _extract_openrouter_content,
+        rotate_key=_rotate_openrouter_api_key,
+        rate_limiter=RATE_LIMITERS["openrouter"],
+        timeout=180,
+        retry_delay=3
+    )
+
+def _build_search_request(messages: List[Dict[str, str]], use_search_grounding: bool) -> tuple:
+    """构建Gemini搜索请求，返回(url, 请求头, 请求数据)；同步与异步版本共用"""
+    # 从messages中提取最后一条用户消息作为prompt，系统消息作为systemInstruction
+    prompt = _last_content(messages)
+    system_instruction = _last_content(messages, "system")
+    
+    # 获取当前API密钥
+    api_key = _get_google_api_key()
+    url = GEMINI_URL.format(model="gemini-2.5-pro-exp-03-25", api_key=api_key)
+    
+    # 基本请求数据
+    data = {
+        "contents": [{
+            "parts": [{"text": "请使用中文回复," + prompt}]
+        }]
+    }
+    
+    # 固定的系统指令单独传递，不与每次变化的问题拼接，便于服务端缓存前缀
+    if system_instruction:
+        data["systemInstruction"] = {
+            "parts": [{"text": system_instruction}]
+        }
+    
+    # 如果启用了Google Search grounding，添加相应配置
+    if use_search_grounding:
+        data["tools"] = [{
+            "googleSearch": {}
+        }]
+        # 根据API文档，正确的字段名是config.generationConfig.responseMimeType
+        data["generationConfig"] = {
+            "responseMimeType": "text/plain"
+        }
+    
+    logger.debug("Sending request to Gemini API with prompt: %s", prompt)
+    return url, None, data
+
 def _call_openrouter_search(chatbot, messages: List[Dict[str, str]], use_search_grounding: bool = True) -> str:
     """
     调用Gemini API进行对话，可选择启用Google Search grounding功能
@@ -439,102 +675,135 @@ def _call_openrouter_search(chatbot, messages: List[Dict[str, str]], use_search_
         use_search_grounding: 是否启用Google Search grounding功能
     Returns:
         str: 包含AI响应内容和搜索建议的组合字符串
-        
+    
     Raises:
         Exception: 当API调用失败时抛出异常
     """
-    # 从messages中提取最后一条用户消息作为prompt
-    prompt = ""
-    for msg in messages:
-        if msg["role"] == "user":
-            prompt = msg["content"]
+    cache_key = _gemini_text_cache_key("search", messages, use_search_grounding)
+    cached = _get_cached_gemini_text(cache_key)
+    if cached is not None:
+        return cached
     
-    max_retries = 3
-    retry_count = 0
+    content = _post_with_retry(
+        "Gemini",
+        lambda: _build_search_request(messages, use_search_grounding),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"]
+    )
+    _put_cached_gemini_text(cache_key, content)
+    return content
+
+async def _acall_openrouter_search(chatbot, messages: List[Dict[str, str]], use_search_grounding: bool = True) -> str:
+    """
+    _call_openrouter_search的异步版本，基于aiohttp，等待响应期间不阻塞事件循环
     
-    while retry_count < max_retries:
-        try:
-            # 获取当前API密钥
-            api_key = _get_google_api_key()
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-pro-exp-03-25:generateContent?key={api_key}"
-            
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            
-            # 基本请求数据
-            data = {
-                "contents": [{
-                    "parts": [{"text": "请使用中文回复," + prompt}]
-                }]
-            }
-            
-            # 如果启用了Google Search grounding，添加相应配置
-            if use_search_grounding:
-                data["tools"] = [{
-                    "googleSearch": {}
-                }]
-                # 根据API文档，正确的字段名是config.generationConfig.responseMimeType
-                data["generationConfig"] = {
-                    "responseMimeType": "text/plain"
-                }
-            
-            logger.debug(f"Sending request to Gemini API with prompt: {prompt}")
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            logger.debug(f"Gemini API raw response: {json.dumps(result, ensure_ascii=False)}")
-            
-            try:
-                # 提取响应内容
-                content = ""
-                parts = result['candidates'][0]['content']['parts']
-                for part in parts:
-                    if 'text' in part:
-                        content += part['text']
-                
-                if not content:
-                    raise ValueError("API返回的响应内容为空")
-                
-                logger.debug(f"Successfully extracted content: {content[:100]}...")
-                
-                return content
-                
-            except (KeyError, IndexError) as e:
-                raise ValueError(f"无法从API响应中提取内容: {str(e)}")
-                
-        except (requests.exceptions.RequestException, ValueError, json.JSONDecodeError) as e:
-            logger.warning(f"Gemini API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
-            
-            # 轮换API密钥
-            _rotate_google_api_key()
-            retry_count += 1
-            
-            if retry_count >= max_retries:
-                logger.error(f"Gemini API调用在 {max_retries} 次尝试后仍然失败")
-                if isinstance(e, requests.exceptions.RequestException):
-                    raise Exception(f"API请求失败: {str(e)}")
-                elif isinstance(e, json.JSONDecodeError):
-                    raise Exception(f"解析响应失败: {str(e)}")
-                else:
-                    raise Exception(f"API调用失败: {str(e)}")
-            
-            # 短暂延迟后重试
-            time.sleep(2)
+    Args:
+        messages: 消息列表，每个消息包含role和content
+        use_search_grounding: 是否启用Google Search grounding功能
+    Returns:
+        str: 包含AI响应内容和搜索建议的组合字符串
+    
+    Raises:
+        Exception: 当API调用失败时抛出异常
+    """
+    cache_key = _gemini_text_cache_key("search", messages, use_search_grounding)
+    cached = _get_cached_gemini_text(cache_key)
+    if cached is not None:
+        return cached
+    
+    content = await _apost_with_retry(
+        "Gemini",
+        lambda: _build_search_request(messages, use_search_grounding),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"]
+    )
+    _put_cached_gemini_text(cache_key, content)
+    return content
 
 def _encode_image(image_path: str) -> str:
     """
-    将图像文件编码为base64字符串
+    将图像文件编码为base64字符串，文件未修改时复用上次的编码结果
     
     Args:
         image_path: 图像文件路径
     Returns:
         str: base64编码的图像字符串
     """
+    stat = os.stat(image_path)
+    return _encode_image_file(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=8)
+def _encode_image_file(image_path: str, mtime_ns: int, size: int) -> str:
+    """按(路径, 修改时间, 大小)缓存编码结果；通过mmap直接编码文件映射，不再额外读出一份原始字节"""
+    if size == 0:
+        return ""
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return base64.b64encode(mapped).decode('ascii')
+
+# 图像分析结果的磁盘缓存：同一图像和提示的分析结果直接复用，不再重复上传
+VISION_CACHE_DIR = os.path.join(PROJECT_ROOT, 'cache', 'vision')
+VISION_CACHE_MAX_AGE = 7 * 24 * 3600  # 缓存有效期（秒）
+
+def _vision_cache_path(base64_image: str, prompt: str, mime_type: str) -> str:
+    """根据图像、提示和MIME类型计算缓存文件路径，按摘要前两级分目录存放"""
+    digest = hashlib.sha256()
+    for part in (base64_image, prompt, mime_type):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    key = digest.hexdigest()
+    return os.path.join(VISION_CACHE_DIR, key[:2], key[2:4], f"{key[4:]}.txt")
+
+def _read_vision_cache(cache_path: str) -> Optional[str]:
+    """读取未过期的缓存结果，不存在、已过期或读取失败时返回None"""
+    try:
+        if time.time() - os.path.getmtime(cache_path) > VISION_CACHE_MAX_AGE:
+            return None
+        with open(cache_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        logger.debug("图像分析命中磁盘缓存: %s", cache_path)
+        return content or None
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"读取图像分析缓存失败: {e}")
+        return None
+
+def _write_vision_cache(cache_path: str, content: str):
+    """先写临时文件再替换，避免并发读到不完整的结果；写入失败只记录警告"""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"写入图像分析缓存失败: {e}")
+
+def _build_vision_request(base64_image: str, prompt: str, mime_type: str) -> tuple:
+    """构建Gemini图像分析请求，返回(url, 请求头, 请求数据)；同步与异步版本共用"""
+    # 获取API密钥，使用gemini-2.0-flash模型替代gemini-pro-vision
+    url = GEMINI_URL.format(model="gemini-2.0-flash", api_key=_get_google_api_key())
+    
+    # 构建请求数据
+    data = {
+        "contents": [{
+            "parts": [
+                {"text": prompt},
+                {
+                    "inline_data": {
+                        "mime_type": mime_type,
+                        "data": base64_image
+                    }
+                }
+            ]
+        }]
+    }
+    return url, None, data
 
-def _call_gemini_vision(image_path: str = None, image_base64: str = None, prompt: str = "请详细分析这张图片中的任何细节并用中文告诉我你看到了什么") -> str:
+def _call_gemini_vision(image_path: str = None, image_base64: str = None, prompt: str = "请详细分析这张图片中的任何细节并用中文告诉我你看到了什么", mime_type: str = "image/jpeg") -> str:
     """
     调用Gemini API进行图像分析
     
@@ -542,87 +811,106 @@ def _call_gemini_vision(image_path: str = None, image_base64: str = None, prompt
         image_path: 图像文件路径（与image_base64二选一）
         image_base64: base64编码的图像数据（与image_path二选一）
         prompt: 提示文本，告诉AI如何分析图像
+        mime_type: 图像的MIME类型
     Returns:
         str: AI的分析结果
-        
+    
     Raises:
         Exception: 当API调用失败时抛出异常
     """
     if not image_path and not image_base64:
         raise ValueError("必须提供image_path或image_base64参数")
+    
+    # 获取base64编码的图像：只编码一次，重试时复用
+    base64_image = image_base64 if image_base64 else _encode_image(image_path)
+    
+    # 相同图像和提示的分析结果直接从磁盘缓存返回
+    cache_path = _vision_cache_path(base64_image, prompt, mime_type)
+    cached = _read_vision_cache(cache_path)
+    if cached is not None:
+        return cached
+    
+    content = _post_with_retry(
+        "Gemini",
+        lambda: _build_vision_request(base64_image, prompt, mime_type),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"]
+    )
+    _write_vision_cache(cache_path, content)
+    return content
+
+async def _acall_gemini_vision(image_path: str = None, image_base64: str = None, prompt: str = "请详细分析这张图片中的任何细节并用中文告诉我你看到了什么", mime_type: str = "image/jpeg") -> str:
+    """_call_gemini_vision的异步版本，等待响应期间不阻塞事件循环"""
+    if not image_path and not image_base64:
+        raise ValueError("必须提供image_path或image_base64参数")
+    
+    # 读取和编码图像、计算摘要和读写缓存都是阻塞操作，放到工作线程中执行
+    base64_image = image_base64 if image_base64 else await asyncio.to_thread(_encode_image, image_path)
+    cache_path = await asyncio.to_thread(_vision_cache_path, base64_image, prompt, mime_type)
+    cached = await asyncio.to_thread(_read_vision_cache, cache_path)
+    if cached is not None:
+        return cached
+    
+    content = await _apost_with_retry(
+        "Gemini",
+        lambda: _build_vision_request(base64_image, prompt, mime_type),
+        _extract_gemini_content,
+        rotate_key=_rotate_google_api_key,
+        rate_limiter=RATE_LIMITERS["gemini"]
+    )
+    await asyncio.to_thread(_write_vision_cache, cache_path, content)
+    return content
+
+def _extract_grok3_content(result: dict) -> str:
+    """从本地Grok3服务的响应中提取文本内容，内容为空或状态不是success时抛出ValueError"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Grok3 API parsed response: {json.dumps(result, ensure_ascii=False)}")
+    
+    # 提取响应内容
+    if 'status' in result and result['status'] == 'success' and 'responses' in result:
+        responses = result['responses'][1]
+        if not responses or len(responses) == 0:
+            raise ValueError("API返回的响应列表为空")
         
-    max_retries = 3
-    retry_count = 0
+        # 处理响应，移除UI相关文本并提取JSON内容
+        if isinstance(responses, str) and responses.startswith("json"):
+            # 移除UI文本，提取JSON部分
+            json_start = responses.find('{')
+            if json_start != -1:
+                json_str = responses[json_start:]
+                try:
+                    # 只解析JSON以验证它是有效的，但返回原始字符串
+                    json_loads(json_str)  # 只是验证有效性
+                    content = json_str  # 返回未格式化的JSON字符串
+                except json.JSONDecodeError:
+                    # 如果JSON解析失败，返回原始文本
+                    content = responses
+            else:
+                content = responses
+        # 处理响应列表的情况
+        elif isinstance(responses, list):
+            content = "\n".join(responses)
+        else:
+            content = str(responses)
+        
+        if not content:
+            raise ValueError("API返回的响应内容为空")
+        
+        logger.debug("Successfully extracted content: %.100s...", content)
+        return content
+    else:
+        status = result.get('status', 'unknown')
+        raise ValueError(f"API响应状态不是success，而是: {status}")
+
+def _build_grok3_request(messages: List[Dict[str, str]]) -> tuple:
+    """构建本地Grok3请求，返回(url, 请求头, 请求数据)；同步与异步版本共用"""
+    # 从messages中提取最后一条用户消息作为question
+    question = _last_content(messages)
     
-    while retry_count < max_retries:
-        try:
-            # 获取API密钥
-            api_key = _get_google_api_key()
-            # 使用gemini-2.0-flash模型替代gemini-pro-vision
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-            
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            
-            # 获取base64编码的图像
-            base64_image = image_base64 if image_base64 else _encode_image(image_path)
-            
-            # 构建请求数据
-            data = {
-                "contents": [{
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
-                }]
-            }
-            
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            
-            try:
-                # 提取响应内容
-                content = ""
-                parts = result['candidates'][0]['content']['parts']
-                for part in parts:
-                    if 'text' in part:
-                        content += part['text']
-                
-                if not content:
-                    raise ValueError("API返回的响应内容为空")
-                
-                logger.debug(f"Successfully extracted content: {content[:100]}...")
-                
-                return content
-                
-            except (KeyError, IndexError) as e:
-                raise ValueError(f"无法从API响应中提取内容: {str(e)}")
-                
-        except (requests.exceptions.RequestException, ValueError, json.JSONDecodeError) as e:
-            logger.warning(f"Gemini API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
-            
-            # 轮换API密钥
-            _rotate_google_api_key()
-            retry_count += 1
-            
-            if retry_count >= max_retries:
-                logger.error(f"Gemini API调用在 {max_retries} 次尝试后仍然失败")
-                if isinstance(e, requests.exceptions.RequestException):
-                    raise Exception(f"API请求失败: {str(e)}")
-                elif isinstance(e, json.JSONDecodeError):
-                    raise Exception(f"解析响应失败: {str(e)}")
-                else:
-                    raise Exception(f"API调用失败: {str(e)}")
-            
-            # 短暂延迟后重试
-            time.sleep(2)
+    # 记录请求详情
+    logger.debug("Sending request to local Grok3 API with question: %s", question)
+    return GROK3_URL, None, {"question": question}
 
 def _call_grok3(chatbot, messages: List[Dict[str, str]]) -> str:
     """
@@ -630,102 +918,50 @@ def _call_grok3(chatbot, messages: List[Dict[str, str]]) -> str:
     
     Args:
         messages: 消息列表，每个消息包含role和content
-        
+    
     Returns:
         str: AI的响应内容
-        
+    
     Raises:
         Exception: 当API调用失败时抛出异常
     """
-    max_retries = 3
-    retry_count = 0
-    retry_delay = 2  # 延迟2秒
+    request = _build_grok3_request(messages)
+    return _post_with_retry(
+        "Grok3",
+        lambda: request,
+        _extract_grok3_content,
+        timeout=120,
+        connection_error_message=GROK3_CONNECTION_ERROR
+    )
+
+async def _acall_grok3(chatbot, messages: List[Dict[str, str]]) -> str:
+    """_call_grok3的异步版本，等待响应期间不阻塞事件循环"""
+    request = _build_grok3_request(messages)
+    return await _apost_with_retry(
+        "Grok3",
+        lambda: request,
+        _extract_grok3_content,
+        timeout=120,
+        connection_error_message=GROK3_CONNECTION_ERROR
+    )
+
+# 同步调用方同时请求多个服务时共用的线程池：请求等待网络时释放GIL，各服务的调用可以真正并行
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm")
+
+def call_many(calls: List[tuple]) -> List[str]:
+    """
+    在共享线程池中并发执行多个同步服务调用，总耗时约为最慢的一个调用
     
-    # 从messages中提取最后一条用户消息作为question
-    question = ""
-    for msg in messages:
-        if msg["role"] == "user":
-            question = msg["content"]
+    Args:
+        calls: 每项为(函数, 位置参数元组)或(函数, 位置参数元组, 关键字参数字典)
+    Returns:
+        List[str]: 按传入顺序排列的调用结果
     
-    while retry_count < max_retries:
-        try:
-            # 记录请求详情
-            logger.debug(f"Sending request to local Grok3 API with question: {question}")
-            
-            response = requests.post(
-                url="http://localhost:1718/ask",
-                headers={
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "question": question
-                },
-                timeout=120  # 设置120秒超时
-            )
-            
-            # 记录原始响应
-            logger.debug(f"Grok3 API raw response: {response.text}")
-            
-            # 检查请求是否成功
-            response.raise_for_status()
-            
-            # 解析JSON响应
-            result = response.json()
-            logger.debug(f"Grok3 API parsed response: {json.dumps(result, ensure_ascii=False)}")
-            
-            # 提取响应内容
-            if 'status' in result and result['status'] == 'success' and 'responses' in result:
-                responses = result['responses'][1]
-                if not responses or len(responses) == 0:
-                    raise ValueError("API返回的响应列表为空")
-                
-                # 处理响应，移除UI相关文本并提取JSON内容
-                if isinstance(responses, str) and responses.startswith("json"):
-                    # 移除UI文本，提取JSON部分
-                    json_start = responses.find('{')
-                    if json_start != -1:
-                        json_str = responses[json_start:]
-                        try:
-                            # 只解析JSON以验证它是有效的，但返回原始字符串
-                            json.loads(json_str)  # 只是验证有效性
-                            content = json_str  # 返回未格式化的JSON字符串
-                        except json.JSONDecodeError:
-                            # 如果JSON解析失败，返回原始文本
-                            content = responses
-                    else:
-                        content = responses
-                # 处理响应列表的情况
-                elif isinstance(responses, list):
-                    content = "\n".join(responses)
-                else:
-                    content = str(responses)
-                
-                if not content:
-                    raise ValueError("API返回的响应内容为空")
-                
-                logger.debug(f"Successfully extracted content: {content[:100]}...")
-                return content
-            else:
-                status = result.get('status', 'unknown')
-                raise ValueError(f"API响应状态不是success，而是: {status}")
-                
-        except (ValueError, requests.exceptions.RequestException, json.JSONDecodeError) as e:
-            logger.warning(f"Grok3 API调用失败 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
-            
-            retry_count += 1
-            
-            if retry_count >= max_retries:
-                logger.error(f"Grok3 API调用在 {max_retries} 次尝试后仍然失败")
-                if isinstance(e, requests.exceptions.Timeout):
-                    raise Exception("API请求超时，请稍后重试")
-                elif isinstance(e, requests.exceptions.ConnectionError):
-                    raise Exception("无法连接到本地Grok3服务，请确保服务正在运行")
-                elif isinstance(e, requests.exceptions.RequestException):
-                    raise Exception(f"API请求失败: {str(e)}")
-                elif isinstance(e, json.JSONDecodeError):
-                    raise Exception(f"解析响应失败: {str(e)}")
-                else:
-                    raise Exception(f"API调用失败: {str(e)}")
-            
-            # 短暂延迟后重试
-            time.sleep(retry_delay)
\ No newline at end of file
+    Raises:
+        Exception: 任一调用失败时抛出其异常，其余调用仍在线程池中完成
+    """
+    futures = [
+        LLM_EXECUTOR.submit(call[0], *call[1], **(call[2] if len(call) > 2 else {}))
+        for call in calls
+    ]
+    return [future.result() for future in futures]
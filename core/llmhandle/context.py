@@ -1,12 +1,13 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Union, Awaitable
 import random
 import logging
 import re
 import json
 from datetime import datetime
 from core.llmhandle.callopenrouter import _call_openrouter, _call_openrouter_qwq
-from core.llmhandle.callopenrouter import _call_openrouter_other
+from core.llmhandle.callopenrouter import _acall_openrouter_other
 import asyncio
+import inspect
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +85,7 @@ async def _extract_time_context(chatbot, user_input: str) -> Dict[str, Any]:
             # 限制此类调用的频率，不是每次查询都需要
             # 这里可以添加一个随机抽样或基于输入特征的判断
             if len(user_input) > 15 and random.random() < 0.5:  # 只有在输入较长且随机条件满足时才调用
-                time_response = chatbot.llm.invoke(time_prompt).content
+                time_response = (await asyncio.to_thread(chatbot.llm.invoke, time_prompt)).content
                 
                 # 解析响应
                 for line in time_response.strip().split('\n'):
@@ -130,7 +131,8 @@ async def _evaluate_query_effectiveness(chatbot, query: str) -> float:
             return 0.3
             
         # 使用查询检索记忆，确保包含distances
-        memories = chatbot.memory_system.recall_memory(
+        memories = await asyncio.to_thread(
+            chatbot.memory_system.recall_memory,
             query=query,
             limit=5  # 只检索少量记忆用于评估
         )
@@ -243,7 +245,7 @@ async def _expand_query_with_synonyms(chatbot, query: str) -> str:
 只需提供关键词和同义词/相关概念，不要添加任何解释。"""
             
             # 使用LLM生成同义词和相关概念
-            expansion_response = chatbot.llm.invoke(expansion_prompt).content
+            expansion_response = (await asyncio.to_thread(chatbot.llm.invoke, expansion_prompt)).content
             
             # 解析响应
             expanded_terms = []
@@ -284,7 +286,7 @@ async def _expand_query_with_synonyms(chatbot, query: str) -> str:
             expanded_query = f"{query} ({' OR '.join(unique_terms)})"
             
             # 记录查询扩展
-            logger.debug(f"查询扩展: 原始='{query}' → 扩展='{expanded_query}'")
+            logger.debug("查询扩展: 原始='%s' → 扩展='%s'", query, expanded_query)
             
             return expanded_query
             
@@ -305,18 +307,18 @@ async def _select_best_query(chatbot, original_query: str, candidate_queries: Li
         """
         # 如果没有候选查询，返回原始查询
         if not candidate_queries:
-            logger.debug(f"没有候选查询，使用原始查询: '{original_query}'")
+            logger.debug("没有候选查询，使用原始查询: '%s'", original_query)
             return original_query
             
         # 如果只有一个候选查询，直接返回
         if len(candidate_queries) == 1:
-            logger.debug(f"只有一个候选查询: '{candidate_queries[0]}'")
+            logger.debug("只有一个候选查询: '%s'", candidate_queries[0])
             return candidate_queries[0]
             
         # 去除空的候选查询
         valid_candidates = [q for q in candidate_queries if q and len(q.strip()) > 3]
         if not valid_candidates:
-            logger.debug(f"没有有效的候选查询，使用原始查询: '{original_query}'")
+            logger.debug("没有有效的候选查询，使用原始查询: '%s'", original_query)
             return original_query
             
         try:
@@ -344,7 +346,7 @@ ChromaDB使用文本嵌入进行语义搜索，它会：
 只需返回选中查询的编号（如：1）。不要添加任何解释。"""
 
             # 使用LLM选择最佳查询
-            selection_result = chatbot.llm.invoke(selection_prompt).content.strip()
+            selection_result = (await asyncio.to_thread(chatbot.llm.invoke, selection_prompt)).content.strip()
             
             # 解析LLM的选择结果
             try:
@@ -352,7 +354,7 @@ ChromaDB使用文本嵌入进行语义搜索，它会：
                 selected_index = int(''.join(filter(str.isdigit, selection_result))) - 1
                 if 0 <= selected_index < len(valid_candidates):
                     best_query = valid_candidates[selected_index]
-                    logger.debug(f"LLM选择了查询 {selected_index + 1}: '{best_query}'")
+                    logger.debug("LLM选择了查询 %s: '%s'", selected_index + 1, best_query)
                     return best_query
             except (ValueError, IndexError):
                 logger.warning(f"无法解析LLM的选择结果: {selection_result}")
@@ -364,7 +366,7 @@ ChromaDB使用文本嵌入进行语义搜索，它会：
                 scores[query] = score
             
             best_query = max(scores.items(), key=lambda x: x[1])[0]
-            logger.debug(f"回退到评分机制，选择查询: '{best_query}'")
+            logger.debug("回退到评分机制，选择查询: '%s'", best_query)
             
             return best_query
             
@@ -390,7 +392,8 @@ async def _reformulate_query(chatbot, user_input: str) -> str:
             
         try:
             # # 先用原始查询获取相关记忆
-            relevant_memories = chatbot.memory_system.recall_memory(
+            relevant_memories = await asyncio.to_thread(
+                chatbot.memory_system.recall_memory,
                 query=user_input,
                 limit=20  # 获取更多记忆作为参考
             )
@@ -465,7 +468,7 @@ async def _reformulate_query(chatbot, user_input: str) -> str:
 
             # 使用LLM重构查询
             messages = [{"role": "user", "content": reformulation_prompt}]
-            response = _call_openrouter_other(chatbot, messages)
+            response = await _acall_openrouter_other(chatbot, messages)
             #response = chatbot.llm.invoke(reformulation_prompt).content
             # 清理响应
             reformulated = response.strip()
@@ -481,19 +484,19 @@ async def _reformulate_query(chatbot, user_input: str) -> str:
             
             # 如果重构后的查询无效，返回原始查询
             if not reformulated or len(reformulated) < 5:
-                logger.debug(f"重构结果无效，使用原始查询: '{user_input}'")
+                logger.debug("重构结果无效，使用原始查询: '%s'", user_input)
                 return user_input
             
             # 如果重构后的查询过长，可能包含了解释性内容
             if len(reformulated) > len(user_input) * 3:
-                logger.debug(f"重构查询过长，截断处理")
+                logger.debug("重构查询过长，截断处理")
                 reformulated = reformulated[:len(user_input) * 2].strip()
             
             # 记录查询重构
             if reformulated != user_input:
-                logger.debug(f"查询重构: 原始='{user_input}' → 重构='{reformulated}'")
+                logger.debug("查询重构: 原始='%s' → 重构='%s'", user_input, reformulated)
             else:
-                logger.debug(f"查询保持不变: '{user_input}'")
+                logger.debug("查询保持不变: '%s'", user_input)
             
             return reformulated
             
@@ -581,7 +584,7 @@ async def _extract_search_keywords(chatbot, user_input: str) -> str:
 查询: {user_input}
 
 关键词:"""
-                extraction_result = chatbot.llm.invoke(extraction_prompt).content
+                extraction_result = (await asyncio.to_thread(chatbot.llm.invoke, extraction_prompt)).content
                 keywords = extraction_result.strip()
                 # 限制长度
                 keywords = " ".join(keywords.split()[:5])
@@ -666,7 +669,7 @@ async def _generate_coherent_context(chatbot, topic_analysis: Dict, intent_analy
     try:
         # 使用LLM生成上下文摘要
         messages = [{"role": "user", "content": context_prompt}]
-        response = _call_openrouter_other(chatbot, messages)
+        response = await _acall_openrouter_other(chatbot, messages)
         
         # 清理响应
         coherent_context = response.strip()
@@ -788,7 +791,7 @@ async def _analyze_dialogue_combined(chatbot, conversation_history: List[str], u
     try:
         # 使用LLM进行分析
         messages = [{"role": "user", "content": analysis_prompt}]
-        response = _call_openrouter_other(chatbot, messages)
+        response = await _acall_openrouter_other(chatbot, messages)
         
         # 解析JSON响应
         json_match = re.search(r'({.*})', response, re.DOTALL)
@@ -861,14 +864,15 @@ async def _analyze_dialogue_combined(chatbot, conversation_history: List[str], u
             }
         }
 
-async def analyze_dialogue_context(chatbot, user_input: str, reformulated_query: str = None) -> Dict[str, Any]:
+async def analyze_dialogue_context(chatbot, user_input: str, reformulated_query: Union[str, Awaitable[str], None] = None) -> Dict[str, Any]:
     """
     综合分析对话上下文，包括主题、意图、关键信息和时间上下文
     
     Args:
         chatbot: 聊天机器人实例
         user_input: 用户输入
-        reformulated_query: 已重构的查询(可选)
+        reformulated_query: 已重构的查询(可选)，也可以是尚未完成的重构任务，
+            会在合并分析完成后才等待其结果，使两者并发执行
         
     Returns:
         Dict: 包含完整上下文分析的字典
@@ -882,8 +886,11 @@ async def analyze_dialogue_context(chatbot, user_input: str, reformulated_query:
         
         # 获取相关记忆
         # 使用传入的重构查询或原始输入
+        if inspect.isawaitable(reformulated_query):
+            reformulated_query = await reformulated_query
         query_to_use = reformulated_query if reformulated_query else user_input
-        relevant_memories = chatbot.memory_system.recall_memory(
+        relevant_memories = await asyncio.to_thread(
+            chatbot.memory_system.recall_memory,
             query=query_to_use,
             limit=20  # 获取足够的记忆作为上下文
         )
@@ -1,9 +1,11 @@
 import os
 import json
+import shutil
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 import threading
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,8 @@ class ConversationContextStorage:
         self.storage_dir = storage_dir
         self.contexts = {}  # 会话ID -> 上下文数据
         self.lock = threading.RLock()  # 用于线程安全的锁
+        self._batch_depth = {}  # 会话ID -> 进行中的批量更新层数
+        self._dirty_sessions = set()  # 批量更新期间有未写入文件的修改的会话
         
         # 确保存储目录存在
         os.makedirs(storage_dir, exist_ok=True)
@@ -66,15 +70,47 @@ class ConversationContextStorage:
                 # 更新内存中的数据
                 self.contexts[session_id] = context_data
                 
-                # 保存到文件
-                file_path = os.path.join(self.storage_dir, f"{session_id}.json")
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(context_data, f, ensure_ascii=False, indent=2)
+                # 批量更新期间只标记，退出批量时统一写入文件
+                if session_id in self._batch_depth:
+                    self._dirty_sessions.add(session_id)
+                    return
                 
-                logger.debug(f"已保存会话 {session_id} 的上下文数据")
+                self._write_context(session_id)
         except Exception as e:
             logger.error(f"保存会话 {session_id} 的上下文数据时出错: {e}")
     
+    def _write_context(self, session_id: str):
+        """将内存中的会话上下文写入文件，调用方需持有锁"""
+        file_path = os.path.join(self.storage_dir, f"{session_id}.json")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.contexts[session_id], f, ensure_ascii=False, indent=2)
+        
+        logger.debug("已保存会话 %s 的上下文数据", session_id)
+    
+    @contextmanager
+    def batch(self, session_id: str):
+        """
+        批量更新会话上下文：期间的多次保存只更新内存，退出时只写一次文件
+        
+        Args:
+            session_id: 会话ID
+        """
+        with self.lock:
+            self._batch_depth[session_id] = self._batch_depth.get(session_id, 0) + 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                depth = self._batch_depth.pop(session_id) - 1
+                if depth:
+                    self._batch_depth[session_id] = depth
+                elif session_id in self._dirty_sessions:
+                    self._dirty_sessions.discard(session_id)
+                    try:
+                        self._write_context(session_id)
+                    except Exception as e:
+                        logger.error(f"保存会话 {session_id} 的上下文数据时出错: {e}")
+    
     def get_context(self, session_id: str) -> Optional[Dict[str, Any]]:
         """
         获取会话上下文数据
@@ -131,6 +167,16 @@ class ConversationContextStorage:
         except Exception as e:
             logger.error(f"删除会话 {session_id} 的上下文数据时出错: {e}")
     
+    def clear_all(self):
+        """
+        删除所有会话的上下文数据（内存和文件），整个存储目录一次性删除后重建
+        """
+        with self.lock:
+            self.contexts.clear()
+            shutil.rmtree(self.storage_dir, ignore_errors=True)
+            os.makedirs(self.storage_dir, exist_ok=True)
+            logger.info("已清理所有会话的上下文数据")
+    
     def get_all_sessions(self) -> List[str]:
         """
         获取所有会话ID
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import weakref
+from typing import TYPE_CHECKING
+
+import requests
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# 同步请求共享的requests会话：按主机保持连接池，后续请求复用已建立的TCP/TLS连接
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.headers.update({"Content-Type": "application/json"})
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=0)
+HTTP_SESSION.mount("https://", _adapter)
+HTTP_SESSION.mount("http://", _adapter)
+
+# 每个事件循环共享一个ClientSession：aiohttp会话绑定创建它的事件循环。
+# 命令行和API服务都在一个长期运行的事件循环中直接await chat，会话在整个进程生命周期内复用，
+# 退出前由chat_loop和API的shutdown事件关闭；chat_sync只供同步调用方使用，其临时循环结束前会关闭自己的会话
+_sessions = weakref.WeakKeyDictionary()
+
+async def get_session() -> "aiohttp.ClientSession":
+    """获取当前事件循环共享的ClientSession，连接池复用TCP/TLS连接"""
+    # aiohttp只在发起异步请求时用到，按需导入
+    import aiohttp
+    
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+        )
+        _sessions[loop] = session
+    return session
+
+async def close_session():
+    """关闭当前事件循环的共享ClientSession，应在事件循环结束前调用"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
@@ -1,8 +1,30 @@
 import random
 import logging
+from string import Template
 
 logger = logging.getLogger(__name__)
 
+# 网络搜索回答结尾随机附加的俏皮话
+WITTY_REMARKS = (
+    "我很享受我们的对话。",
+    "为您服务是我的荣幸。",
+    "这就是我的日常工作。",
+    "要把这个也加入我的成就列表吗？"
+)
+
+# 网络搜索回答提示模板：只有用户问题和搜索结果随请求变化，模板在导入时解析一次
+WEB_SEARCH_ANSWER_TEMPLATE = Template("""根据以下网络搜索结果，回答用户的问题。
+        
+用户问题: $user_input
+
+搜索结果:
+$search_content
+
+请基于搜索结果提供准确、有帮助的回答。如果搜索结果不足以完全回答问题，请说明并提供可用的信息。
+回答应该简洁明了，直接针对用户的问题，不要重复"根据搜索结果"等引导语。
+""")
+render_web_search_prompt = WEB_SEARCH_ANSWER_TEMPLATE.substitute
+
 def _format_response(chatbot, response: str) -> str:
         """格式化响应文本"""
         # 添加问候语
@@ -62,36 +84,13 @@ def _format_web_search_response(chatbot, search_content: str, user_input: str) -
         Returns:
             str: 格式化后的响应
         """
-        try:
-            # 获取相关记忆来确定是否需要问候语
-            memories = chatbot.memory_system.recall_memory(
-                query=f"最近的对话",
-                limit=1
-            )
-            # 确保 memories 是列表且不为空
-            if not isinstance(memories, list):
-                memories = []
-            should_greet = not memories
-        except Exception as e:
-            logger.warning(f"检查对话历史时出错: {e}")
-            should_greet = True
-        
         # 添加问候语
         greeting = ""
-        if should_greet:
+        if chatbot._should_greet():
             greeting = f"{chatbot._get_greeting()}。"
             
         # 构建提示，让AI根据搜索结果回答用户问题
-        prompt = f"""根据以下网络搜索结果，回答用户的问题。
-        
-用户问题: {user_input}
-
-搜索结果:
-{search_content}
-
-请基于搜索结果提供准确、有帮助的回答。如果搜索结果不足以完全回答问题，请说明并提供可用的信息。
-回答应该简洁明了，直接针对用户的问题，不要重复"根据搜索结果"等引导语。
-"""
+        prompt = render_web_search_prompt(user_input=user_input, search_content=search_content)
         
         try:
             # 使用LLM生成回答
@@ -100,18 +99,10 @@ def _format_web_search_response(chatbot, search_content: str, user_input: str) -
             logger.debug(f"收到网络搜索回答响应")
             
             # 根据个性设置添加幽默元素
-            try:
-                humor_level = float(chatbot.personality.get("humor_level", 0.3))
-                if humor_level > 0.5 and random.random() < humor_level:
-                    witty_remarks = [
-                        "我很享受我们的对话。",
-                        "为您服务是我的荣幸。",
-                        "这就是我的日常工作。",
-                        "要把这个也加入我的成就列表吗？"
-                    ]
-                    response += f"\n\n{random.choice(witty_remarks)}"
-            except Exception as e:
-                logger.warning(f"添加幽默元素时出错: {e}")
+            # 幽默程度已在设置个性时转换为浮点数，这里不会出错，无需异常处理
+            humor_level = chatbot.humor_level
+            if humor_level > 0.5 and random.random() < humor_level:
+                response += "\n\n" + random.choice(WITTY_REMARKS)
             
             return f"{greeting}{response}"
         except Exception as e:
@@ -0,0 +1,161 @@
+import re
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 归一化输入时合并连续空白
+_WHITESPACE_RE = re.compile(r"\s+")
+
+class SemanticDecisionCache:
+    """
+    LLM判定结果的两级缓存，线程安全
+
+    第一级按归一化后的输入精确匹配；第二级对输入的嵌入向量做随机投影LSH分桶，
+    在同桶的候选中按余弦相似度查找近似重复的问题。两级共用LRU+TTL淘汰。
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], List[float]]] = None,
+        capacity: int = 1000,
+        ttl: float = 3600,
+        n_tables: int = 8,
+        n_bits: int = 16,
+        threshold: float = 0.95,
+        seed: int = 42
+    ):
+        """
+        初始化缓存
+
+        Args:
+            embed: 文本 -> 嵌入向量的函数，为None时只使用精确匹配
+            capacity: 最多缓存的条目数
+            ttl: 条目过期时间（秒）
+            n_tables: LSH哈希表数量
+            n_bits: 每个哈希表的随机超平面数量
+            threshold: 语义命中所需的最低余弦相似度
+            seed: 生成随机超平面的种子
+        """
+        self.embed = embed
+        self.capacity = capacity
+        self.ttl = ttl
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.threshold = threshold
+        self._rng = np.random.default_rng(seed)
+        self._planes = None  # (n_tables * n_bits, dim)，首次写入时按向量维度生成
+        self._bit_weights = 1 << np.arange(n_bits, dtype=np.int64)
+
+        self._entries = OrderedDict()  # 归一化输入 -> (判定结果, 单位向量或None, 桶键元组或None, 写入时间)
+        self._buckets: List[Dict[int, set]] = [{} for _ in range(n_tables)]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """归一化输入：去首尾空白、合并空白并转小写"""
+        return _WHITESPACE_RE.sub(" ", text.strip()).lower()
+
+    def _embed(self, key: str) -> Optional[np.ndarray]:
+        """计算单位嵌入向量，失败或全零时返回None"""
+        if self.embed is None:
+            return None
+        try:
+            vector = np.asarray(self.embed(key), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"计算语义缓存向量时出错: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+    def _bucket_keys(self, vector: np.ndarray) -> Tuple[int, ...]:
+        """计算向量在每个哈希表中的桶键"""
+        if self._planes is None or self._planes.shape[1] != vector.shape[0]:
+            self._planes = self._rng.standard_normal((self.n_tables * self.n_bits, vector.shape[0])).astype(np.float32)
+            for table in self._buckets:
+                table.clear()
+        bits = (self._planes @ vector > 0).reshape(self.n_tables, self.n_bits)
+        return tuple(int(key) for key in bits @ self._bit_weights)
+
+    def _remove(self, key: str):
+        """删除条目及其在各哈希表中的桶引用，调用方需持有锁"""
+        _, _, bucket_keys, _ = self._entries.pop(key)
+        if bucket_keys is None:
+            return
+        for table, bucket_key in zip(self._buckets, bucket_keys):
+            bucket = table.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del table[bucket_key]
+
+    def _expired(self, created_at: float) -> bool:
+        return time.monotonic() - created_at > self.ttl
+
+    def get(self, text: str) -> Tuple[Optional[Any], Optional[np.ndarray]]:
+        """
+        查找缓存的判定结果
+
+        Returns:
+            (判定结果或None, 本次计算的单位向量或None)；向量可传给put避免重复计算
+        """
+        key = self.normalize(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[3]):
+                    self._entries.move_to_end(key)
+                    return entry[0], None
+                self._remove(key)
+
+        # 嵌入请求可能较慢，不持有锁
+        vector = self._embed(key)
+        if vector is None:
+            return None, None
+
+        with self._lock:
+            if self._planes is None or self._planes.shape[1] != vector.shape[0]:
+                return None, vector
+            candidates = set()
+            for table, bucket_key in zip(self._buckets, self._bucket_keys(vector)):
+                candidates.update(table.get(bucket_key, ()))
+
+            best_key, best_score = None, self.threshold
+            for candidate in candidates:
+                decision, candidate_vector, _, created_at = self._entries[candidate]
+                if self._expired(created_at):
+                    continue
+                score = float(candidate_vector @ vector)
+                if score >= best_score:
+                    best_key, best_score = candidate, score
+
+            if best_key is None:
+                return None, vector
+            self._entries.move_to_end(best_key)
+            logger.debug("语义缓存命中: '%s' ≈ '%s' (相似度 %.3f)", key, best_key, best_score)
+            return self._entries[best_key][0], vector
+
+    def put(self, text: str, decision: Any, vector: Optional[np.ndarray] = None):
+        """写入判定结果；未提供向量时自动计算"""
+        key = self.normalize(text)
+        if vector is None:
+            vector = self._embed(key)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            bucket_keys = None
+            if vector is not None:
+                bucket_keys = self._bucket_keys(vector)
+                for table, bucket_key in zip(self._buckets, bucket_keys):
+                    table.setdefault(bucket_key, set()).add(key)
+            self._entries[key] = (decision, vector, bucket_keys, time.monotonic())
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
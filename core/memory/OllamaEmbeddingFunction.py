@@ -1,12 +1,63 @@
 import logging
+import hashlib
+import threading
+import time
 import requests
 import numpy as np
+from collections import OrderedDict
 from typing import List, Optional
 from chromadb.api import EmbeddingFunction
 from langchain_core.embeddings import Embeddings
 
 logger = logging.getLogger(__name__)
 
+# 嵌入向量的存储精度：归一化后的向量用FP16保存，内存减半且余弦相似度几乎不受影响
+EMBEDDING_DTYPE = np.float16
+
+class EmbeddingCache:
+    """以BLAKE2b摘要为键的LRU+TTL嵌入缓存，线程安全，向量以FP16数组保存"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        """初始化嵌入缓存
+        
+        Args:
+            maxsize: 最多缓存的向量数量
+            ttl: 缓存过期时间（秒）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (FP16 embedding数组, 写入时间)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(model: str, text: str) -> bytes:
+        """根据模型名和文本生成缓存键（仅用于进程内去重，128位BLAKE2b足够且比SHA-256更快）"""
+        return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=16).digest()
+    
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """获取未过期的缓存向量，不存在时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            embedding, created_at = entry
+            if time.monotonic() - created_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return embedding
+    
+    def put(self, key: bytes, embedding: np.ndarray):
+        """写入缓存，超出容量时淘汰最久未使用的向量"""
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+# 全局共享的嵌入缓存，所有OllamaEmbeddingFunction实例共用
+embedding_cache = EmbeddingCache()
+
 class OllamaEmbeddingFunction(EmbeddingFunction, Embeddings):
     """使用Ollama生成文本嵌入的函数类，同时兼容ChromaDB和LangChain"""
     
@@ -38,11 +89,23 @@ class OllamaEmbeddingFunction(EmbeddingFunction, Embeddings):
         return 384  # 默认维度
     
     def _get_embedding(self, text: str) -> List[float]:
-        """获取单个文本的嵌入向量"""
-        try:
-            if not text:
+        """获取单个文本的嵌入向量，优先使用缓存"""
+        if not text:
+            return [0.0] * self._get_dimension()
+        
+        key = EmbeddingCache.make_key(self.model, text)
+        embedding = embedding_cache.get(key)
+        if embedding is None:
+            embedding = self._request_embedding(text)
+            if embedding is None:
                 return [0.0] * self._get_dimension()
-            
+            embedding_cache.put(key, embedding)
+        # ChromaDB和LangChain只接受float列表，输出时展开为FP32
+        return embedding.astype(np.float32).tolist()
+    
+    def _request_embedding(self, text: str) -> Optional[np.ndarray]:
+        """请求Ollama生成归一化的FP16嵌入向量，失败时返回None"""
+        try:
             response = requests.post(
                 f"{self.base_url}/api/embeddings",
                 json={"model": self.model, "prompt": text},
@@ -51,22 +114,57 @@ class OllamaEmbeddingFunction(EmbeddingFunction, Embeddings):
             response.raise_for_status()
             embedding = response.json()["embedding"]
             # 归一化向量
-            embedding = np.array(embedding)
+            embedding = np.asarray(embedding, dtype=np.float32)
             norm = np.linalg.norm(embedding)
             if norm > 0:
-                embedding = (embedding / norm).tolist()
-            return embedding
+                embedding = embedding / norm
+            return embedding.astype(EMBEDDING_DTYPE)
         except Exception as e:
             logger.error(f"获取文本嵌入时出错: {e}", exc_info=True)
-            return [0.0] * self._get_dimension()
+            return None
         
+    def _request_embeddings(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """一次请求批量生成归一化的FP16嵌入向量，批量接口不可用时逐条请求"""
+        if len(texts) == 1:
+            return [self._request_embedding(texts[0])]
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/embed",
+                json={"model": self.model, "input": texts},
+                timeout=60 + 5 * len(texts)
+            )
+            response.raise_for_status()
+            embeddings = np.asarray(response.json()["embeddings"], dtype=np.float32)
+            if embeddings.shape[0] != len(texts):
+                raise ValueError(f"返回的向量数量({embeddings.shape[0]})与文本数量({len(texts)})不一致")
+            # 逐行归一化
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            return list((embeddings / norms).astype(EMBEDDING_DTYPE))
+        except Exception as e:
+            logger.warning(f"批量获取文本嵌入失败，改为逐条请求: {e}")
+            return [self._request_embedding(text) for text in texts]
+    
     def __call__(self, texts: List[str]) -> List[List[float]]:
-        """ChromaDB的EmbeddingFunction接口"""
+        """ChromaDB的EmbeddingFunction接口，未命中缓存的文本合并为一次批量请求"""
         if not texts:
             logger.warning("输入文本列表为空")
             return [[0.0] * self._get_dimension()]
         
-        return [self._get_embedding(text) for text in texts]
+        keys = [EmbeddingCache.make_key(self.model, text) if text else None for text in texts]
+        embeddings = [embedding_cache.get(key) if key else None for key in keys]
+        missing = [i for i, key in enumerate(keys) if key and embeddings[i] is None]
+        if missing:
+            for i, embedding in zip(missing, self._request_embeddings([texts[i] for i in missing])):
+                if embedding is not None:
+                    embedding_cache.put(keys[i], embedding)
+                    embeddings[i] = embedding
+        
+        dimension = self._get_dimension()
+        return [
+            embedding.astype(np.float32).tolist() if embedding is not None else [0.0] * dimension
+            for embedding in embeddings
+        ]
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """LangChain的Embeddings接口 - 批量文档嵌入"""
@@ -1,5 +1,5 @@
 """Memory-related components for the core package."""
 
-from .OllamaEmbeddingFunction import OllamaEmbeddingFunction
+from .OllamaEmbeddingFunction import OllamaEmbeddingFunction, EmbeddingCache
 
-__all__ = ['OllamaEmbeddingFunction']
\ No newline at end of file
+__all__ = ['OllamaEmbeddingFunction', 'EmbeddingCache']
\ No newline at end of file
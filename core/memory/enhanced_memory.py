@@ -7,6 +7,7 @@ import numpy as np
 from dataclasses import dataclass
 from uuid import uuid4
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.neighbors import NearestNeighbors
 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
@@ -16,6 +17,17 @@ from langchain_chroma import Chroma
 
 logger = logging.getLogger(__name__)
 
+# 记忆集合默认的HNSW近似最近邻索引参数
+DEFAULT_HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 400,  # 默认100，建议增加
+    "hnsw:search_ef": 200,        # 默认40，建议显著增加
+    "hnsw:M": 64                  # 默认16，建议加倍
+}
+
+# 回忆后强化记忆的后台线程池：所有记忆系统共享一个工作线程，强化操作依次执行
+STRENGTHEN_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mem-strengthen")
+
 @dataclass
 class MemoryTrace:
     """记忆痕迹，模拟人类记忆的基本单位"""
@@ -43,7 +55,8 @@ class EnhancedMemorySystem:
         initial_memory_strength: float = 0.8,
         forgetting_rate: float = 0.1,
         consolidation_threshold: float = 0.5,
-        merge_threshold: float = 0.95  # 添加合并阈值参数
+        merge_threshold: float = 0.95,  # 添加合并阈值参数
+        collection_metadata: Optional[Dict[str, Any]] = None  # 覆盖默认的HNSW索引参数
     ):
         self.persist_directory = persist_directory
         self.llm = llm
@@ -58,38 +71,15 @@ class EnhancedMemorySystem:
         # 初始化Chroma客户端
         self.client = chromadb.PersistentClient(path=persist_directory)
         
-        # 创建不同类型的记忆集合
+        # 创建不同类型的记忆集合（HNSW索引参数只在集合首次创建时生效）
+        hnsw_metadata = {**DEFAULT_HNSW_METADATA, **(collection_metadata or {})}
         self.collections = {
-            "working": self.client.get_or_create_collection(
-                name=f"{collection_name}_working",
-                embedding_function=embedding_function,
-                metadata={
-                    "hnsw:space": "cosine",
-                    "hnsw:construction_ef": 400,  # 默认100，建议增加
-                    "hnsw:search_ef": 200,        # 默认40，建议显著增加
-                    "hnsw:M": 64                  # 默认16，建议加倍
-                }
-            ),
-            "short_term": self.client.get_or_create_collection(
-                name=f"{collection_name}_short_term",
-                embedding_function=embedding_function,
-                metadata={
-                    "hnsw:space": "cosine",
-                    "hnsw:construction_ef": 400,  # 默认100，建议增加
-                    "hnsw:search_ef": 200,        # 默认40，建议显著增加
-                    "hnsw:M": 64                  # 默认16，建议加倍
-                }
-            ),
-            "long_term": self.client.get_or_create_collection(
-                name=f"{collection_name}_long_term",
+            memory_type: self.client.get_or_create_collection(
+                name=f"{collection_name}_{memory_type}",
                 embedding_function=embedding_function,
-                metadata={
-                    "hnsw:space": "cosine",
-                    "hnsw:construction_ef": 400,  # 默认100，建议增加
-                    "hnsw:search_ef": 200,        # 默认40，建议显著增加
-                    "hnsw:M": 64                  # 默认16，建议加倍
-                }
+                metadata=dict(hnsw_metadata)
             )
+            for memory_type in ("working", "short_term", "long_term")
         }
         
         # 记忆关联图
@@ -187,59 +177,76 @@ class EnhancedMemorySystem:
     
     def add_memory(self, message: BaseMessage, memory_type: str = "episodic") -> str:
         """添加新的记忆（线程安全版本）"""
-        with self.lock:  # 添加线程锁
-            logger.info(f"00000000000000000")
-            # 分析内容
-            emotional_intensity, importance = self._analyze_emotion_and_importance(message.content)
-            context_tags = self._extract_context_tags(message.content)
-            logger.info(f"11111111111111")
-            current_time = datetime.now()
-            # 创建记忆痕迹
-            trace = MemoryTrace(
-                id=str(uuid4()),
-                content=message.content,
-                timestamp=current_time,
-                importance=importance,
-                emotional_intensity=emotional_intensity,
-                context_tags=context_tags,
-                recall_count=0,
-                last_recall=current_time,
-                memory_type=memory_type,
-                associations=[],
-                metadata={
-                    "message_type": message.type,
-                    "additional_kwargs": message.additional_kwargs
-                }
-            )
-            
-            # 确定记忆存储位置
-            if importance > 0.8 or emotional_intensity > 0.8:
-                collection = self.collections["long_term"]
-            else:
-                collection = self.collections["short_term"]
+        return self.add_memories([(message, memory_type)])[0]
+    
+    def add_memories(self, items: List[Tuple[BaseMessage, str]]) -> List[str]:
+        """批量添加新的记忆（线程安全），每个目标集合只调用一次add，嵌入向量一次批量生成
+        
+        与add_memory相同，每条记忆都会分析情感、重要性和上下文标签，并更新记忆关联。
+        
+        Args:
+            items: (记忆消息, 记忆类型) 列表
             
-            # 存储记忆
-            collection.add(
-                ids=[trace.id],
-                documents=[trace.content],
-                metadatas=[{
-                    "timestamp": trace.timestamp.isoformat(),  # 保持原有的ISO格式时间戳
-                    "timestamp_float": trace.timestamp.timestamp(),  # 添加浮点数时间戳
-                    "importance": trace.importance,
-                    "emotional_intensity": trace.emotional_intensity,
-                    "context_tags": json.dumps(trace.context_tags),
-                    "recall_count": trace.recall_count,
-                    "last_recall": trace.last_recall.isoformat(),
-                    "memory_type": trace.memory_type,
-                    "message_type": trace.metadata["message_type"],
-                    "additional_kwargs": json.dumps(trace.metadata["additional_kwargs"])
-                }]
-            )
-            logger.info(f"222222222222222222")
-            # 更新记忆关联
-            self._update_memory_associations(trace)
-            logger.info(f"3333333333333")
-            return trace.id
+        Returns:
+            添加的记忆ID列表，与items的顺序一致
+        """
+        with self.lock:  # 添加线程锁
+            traces_by_collection: Dict[str, List[MemoryTrace]] = {}
+            # 按输入顺序记录ID；下面按集合分组写入，分组后的顺序与输入不同
+            memory_ids = []
+            for message, memory_type in items:
+                # 分析内容
+                emotional_intensity, importance = self._analyze_emotion_and_importance(message.content)
+                context_tags = self._extract_context_tags(message.content)
+                current_time = datetime.now()
+                # 创建记忆痕迹
+                trace = MemoryTrace(
+                    id=str(uuid4()),
+                    content=message.content,
+                    timestamp=current_time,
+                    importance=importance,
+                    emotional_intensity=emotional_intensity,
+                    context_tags=context_tags,
+                    recall_count=0,
+                    last_recall=current_time,
+                    memory_type=memory_type,
+                    associations=[],
+                    metadata={
+                        "message_type": message.type,
+                        "additional_kwargs": message.additional_kwargs
+                    }
+                )
+                memory_ids.append(trace.id)
+                
+                # 确定记忆存储位置
+                if importance > 0.8 or emotional_intensity > 0.8:
+                    traces_by_collection.setdefault("long_term", []).append(trace)
+                else:
+                    traces_by_collection.setdefault("short_term", []).append(trace)
+            
+            # 存储记忆：每个集合一次add
+            for collection_name, traces in traces_by_collection.items():
+                self.collections[collection_name].add(
+                    ids=[trace.id for trace in traces],
+                    documents=[trace.content for trace in traces],
+                    metadatas=[{
+                        "timestamp": trace.timestamp.isoformat(),  # 保持原有的ISO格式时间戳
+                        "timestamp_float": trace.timestamp.timestamp(),  # 添加浮点数时间戳
+                        "importance": trace.importance,
+                        "emotional_intensity": trace.emotional_intensity,
+                        "context_tags": json.dumps(trace.context_tags),
+                        "recall_count": trace.recall_count,
+                        "last_recall": trace.last_recall.isoformat(),
+                        "memory_type": trace.memory_type,
+                        "message_type": trace.metadata["message_type"],
+                        "additional_kwargs": json.dumps(trace.metadata["additional_kwargs"])
+                    } for trace in traces]
+                )
+                
+                # 更新记忆关联
+                for trace in traces:
+                    self._update_memory_associations(trace)
+            return memory_ids
     
     def _update_memory_associations(self, trace: MemoryTrace):
         """更新记忆关联"""
@@ -581,13 +588,8 @@ class EnhancedMemorySystem:
                             except Exception as e:
                                 logger.warning(f"强化单个记忆时出错: {e}")
 
-            # 创建单个线程处理所有记忆
-            update_thread = threading.Thread(
-                target=strengthen_memories,
-                args=(memories,),
-                daemon=True
-            )
-            update_thread.start()
+            # 提交到共享线程池处理所有记忆，避免每次回忆都创建新线程
+            STRENGTHEN_EXECUTOR.submit(strengthen_memories, memories)
             
             return memories
         except Exception as e:
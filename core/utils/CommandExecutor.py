@@ -7,7 +7,7 @@ from langchain_core.messages import SystemMessage, HumanMessage
 from core.utils.ConfigManager import ConfigManager
 import logging
 from core.llmhandle.callopenrouter import _call_openrouter
-from core.llmhandle.callopenrouter import _call_openrouter_other
+from core.llmhandle.callopenrouter import _acall_openrouter_other
 logger = logging.getLogger(__name__)
 
 class CommandExecutor:
@@ -79,7 +79,7 @@ class CommandExecutor:
         请判断是否需要执行命令，并生成适当的命令（如果需要）。"""}
         ]
         
-        content = _call_openrouter_other(self, messages)
+        content = await _acall_openrouter_other(self, messages)
         
         # 尝试提取JSON部分
         json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
@@ -233,7 +233,7 @@ class CommandExecutor:
                 {"role": "user", "content": user_prompt}
             ]
             
-            return _call_openrouter_other(self, messages)
+            return await _acall_openrouter_other(self, messages)
             
         except Exception as e:
             logger.error(f"处理命令结果时出错: {str(e)}")
@@ -1,5 +1,7 @@
 import time
+import asyncio
 import logging
+import threading
 
 logger = logging.getLogger("chatbot")
 
@@ -35,4 +37,50 @@ class RateLimiter:
         self.request_timestamps.append(current_time)
         self.token_usage.append((current_time, tokens))
         
-        return True
\ No newline at end of file
+        return True
+
+class TokenBucket:
+    """令牌桶限速器，线程安全
+
+    按固定速率补充令牌，最多积攒burst个。令牌不足时调用方预约下一个令牌并等待，
+    突发请求因此按速率依次放行，而不是同时打到服务端触发429后再重试。
+    同步调用方使用acquire，协程使用acquire_async。
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        self._lock = threading.Lock()
+        self._tokens = float(max(1, int(burst)))  # 初始时桶是满的
+        self._updated_at = time.monotonic()
+        self.configure(requests_per_minute, burst)
+
+    def configure(self, requests_per_minute: float, burst: int = 1):
+        """调整速率和容量，已积攒的令牌不超过新容量"""
+        with self._lock:
+            self.rate = requests_per_minute / 60.0
+            self.burst = max(1, int(burst))
+            self._tokens = min(self._tokens, self.burst)
+
+    def _reserve(self) -> float:
+        """取走一个令牌，返回需要等待的秒数（令牌可预支为负数，等待时间即补足欠额所需的时间）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0 or self.rate <= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """阻塞直到获得一个令牌"""
+        delay = self._reserve()
+        if delay > 0:
+            logger.debug(f"请求限速，等待 {delay:.2f} 秒")
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """等待直到获得一个令牌，等待期间不阻塞事件循环"""
+        delay = self._reserve()
+        if delay > 0:
+            logger.debug(f"请求限速，等待 {delay:.2f} 秒")
+            await asyncio.sleep(delay)
@@ -1,8 +1,8 @@
 """Memory-related components for the core package."""
 
 from .ConfigManager import ConfigManager, DEFAULT_CONFIG
-from .RateLimiter import RateLimiter
+from .RateLimiter import RateLimiter, TokenBucket
 from .PersistentMemoryManager import PersistentMemoryManager
 from .CustomConversationBufferMemory import CustomConversationBufferMemory
 from .CommandExecutor import CommandExecutor
-__all__ = ['ConfigManager', 'DEFAULT_CONFIG', 'RateLimiter', 'PersistentMemoryManager', 'CustomConversationBufferMemory', 'CommandExecutor']
\ No newline at end of file
+__all__ = ['ConfigManager', 'DEFAULT_CONFIG', 'RateLimiter', 'TokenBucket', 'PersistentMemoryManager', 'CustomConversationBufferMemory', 'CommandExecutor']
\ No newline at end of file
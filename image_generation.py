@@ -11,7 +11,7 @@ import asyncio
 import configparser
 import random
 from core.llmhandle.callopenrouter import _call_openrouter_qwq
-from core.llmhandle.callopenrouter import _call_openrouter_other
+from core.llmhandle.callopenrouter import _acall_openrouter_other
 
 # 配置日志
 logging.basicConfig(
@@ -146,7 +146,7 @@ class GeminiImageGenerator:
                 }
             ]
             
-            extracted_prompt = _call_openrouter_other(None, messages).strip()
+            extracted_prompt = (await _acall_openrouter_other(None, messages)).strip()
             
             if not extracted_prompt:
                 return ""
@@ -223,7 +223,7 @@ class GeminiImageGenerator:
                     }
                     
                     # 发送API请求
-                    response = requests.post(api_url, headers=headers, json=data, timeout=60)
+                    response = await asyncio.to_thread(requests.post, api_url, headers=headers, json=data, timeout=60)
                     
                     if response.status_code == 200:
                         # 请求成功，处理结果
@@ -259,12 +259,12 @@ class GeminiImageGenerator:
                                 # 解码并保存图片
                                 image_data = base64.b64decode(part["inlineData"]["data"])
                                 image = Image.open(BytesIO(image_data))
-                                image.save(image_path)
+                                await asyncio.to_thread(image.save, image_path)
                                 
                                 logger.info(f"图片已保存到: {image_path}")
                                 images_saved.append({
                                     "image_path": str(image_path),
-                                    "image_url": f"/image/{image_filename}"
+                                    "image_url": f"/images/{image_filename}"
                                 })
                                 
                                 # 显示图片
@@ -1259,7 +1259,7 @@ def display_image_from_response(response_text: str) -> str:
     
     try:
         # 构建图片URL
-        image_url = f"{API_URL}/image/{image_filename}"
+        image_url = f"{API_URL}/images/{image_filename}"
         
         # 获取图片数据
         response = requests.get(image_url)